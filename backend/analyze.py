@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Batch analysis - parses and lints every game in the games directory
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from games import find_story_file, game_name, iter_games
+from lint import StoryLinter
+from twee import TweeParser
+
+# Same default as server.py
+GAMES_DIR = Path(os.environ.get('BRANCHED_GAMES_DIR', Path(__file__).parent.parent.parent / "games"))
+
+# Results are reused while the story file keeps its mtime and size
+CACHE_FILE = '.branched-analyze.json'
+
+# Bump when the per-game result changes shape so old cache entries are redone
+CACHE_FORMAT = 1
+
+# Past sizes kept per game for the trend columns
+HISTORY_LENGTH = 30
+
+
+def analyze_story(path):
+    """Worker: parse and lint one story file"""
+    result = {'bytes': os.path.getsize(path), 'error': None}
+    try:
+        started = time.perf_counter()
+        with open(path, 'r', encoding='utf-8') as f:
+            story = TweeParser().parse_story(f)
+        result['parseSeconds'] = round(time.perf_counter() - started, 6)
+
+        report = StoryLinter(story).lint()
+        result.update({
+            'passages': report['stats']['passages'],
+            'lanes': sum(1 for lane in story.lanes if not lane.get('isMetadata')),
+            'links': report['stats']['links'],
+            'brokenLinks': [{'title': issue['title'], 'target': issue['target']}
+                            for issue in report['issues'] if issue['type'] == 'broken-link'],
+            'unreachable': len(report['unreachable']),
+            'deadEnds': len(report['deadEnds']),
+            'cycles': len(report['cycles']),
+            'lintSeconds': report['stats']['seconds']
+        })
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+def discover(games_dir):
+    """(game id, name, story file) for every game with a readable config"""
+    games = []
+    for game_dir, _, config in iter_games(games_dir):
+        if config is None:
+            continue
+        games.append((game_dir.name, game_name(game_dir, config), find_story_file(game_dir, config)))
+    return sorted(games)
+
+
+def load_cache(path):
+    try:
+        with open(path, 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache.get('games', {}) if cache.get('format') == CACHE_FORMAT else {}
+
+
+def save_cache(path, games):
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump({'format': CACHE_FORMAT, 'games': games}, f)
+    os.replace(temp_path, path)
+
+
+def trend(history, key):
+    """Change in `key` since the previous run and since the oldest kept run"""
+    if len(history) < 2:
+        return {'previous': None, 'first': None}
+    return {'previous': history[-1][key] - history[-2][key], 'first': history[-1][key] - history[0][key]}
+
+
+def analyze_games(games_dir, cache_path=None, workers=None, force=False):
+    """Analyze every game, redoing only stories whose mtime or size changed"""
+    started = time.perf_counter()
+    cache = load_cache(cache_path) if cache_path else {}
+    games = discover(games_dir)
+
+    entries = {}
+    pending = []
+    for game_id, name, story_file in games:
+        entry = dict(cache.get(game_id) or {}, name=name)
+        entries[game_id] = entry
+        if story_file is None:
+            entry.update(file=None, signature=None, result={'error': 'story file not found'})
+            continue
+
+        stat = story_file.stat()
+        signature = [str(story_file), stat.st_mtime_ns, stat.st_size]
+        if force or entry.get('signature') != signature:
+            entry['signature'] = signature
+            entry['file'] = story_file.name
+            pending.append((game_id, str(story_file)))
+
+    if workers == 1 or len(pending) <= 1:
+        results = [analyze_story(path) for _, path in pending]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(analyze_story, [path for _, path in pending]))
+
+    now = int(time.time())
+    for (game_id, _), result in zip(pending, results):
+        entry = entries[game_id]
+        entry['result'] = result
+        if result['error'] is None:
+            history = entry.get('history', [])
+            history.append({'time': now, 'bytes': result['bytes'], 'passages': result['passages']})
+            entry['history'] = history[-HISTORY_LENGTH:]
+
+    if cache_path:
+        save_cache(cache_path, entries)
+
+    report = []
+    for game_id, name, _ in games:
+        entry = entries[game_id]
+        history = entry.get('history', [])
+        report.append(dict(entry['result'], id=game_id, name=name, file=entry.get('file'),
+                           bytesTrend=trend(history, 'bytes'), passagesTrend=trend(history, 'passages')))
+
+    analyzed = [game for game in report if game['error'] is None]
+    return {
+        'games': report,
+        'totals': {
+            'games': len(report),
+            'analyzed': len(pending),
+            'cached': sum(1 for _, _, story_file in games if story_file is not None) - len(pending),
+            'errors': len(report) - len(analyzed),
+            'passages': sum(game['passages'] for game in analyzed),
+            'links': sum(game['links'] for game in analyzed),
+            'brokenLinks': sum(len(game['brokenLinks']) for game in analyzed),
+            'bytes': sum(game['bytes'] for game in analyzed),
+            'parseSeconds': round(sum(game['parseSeconds'] for game in analyzed), 6)
+        },
+        'seconds': round(time.perf_counter() - started, 6)
+    }
+
+
+def format_change(value):
+    return '' if value is None else f'{value:+d}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parse and lint every game in the games directory')
+    parser.add_argument('games_dir', nargs='?', default=str(GAMES_DIR),
+                        help='directory holding one folder per game (default: %(default)s)')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--cache', help=f'result cache file (default: {CACHE_FILE} in the games directory)')
+    parser.add_argument('--no-cache', action='store_true', help='neither read nor write the cache')
+    parser.add_argument('--force', action='store_true', help='re-analyze every game, then update the cache')
+    parser.add_argument('--json', action='store_true', help='print the full report as JSON')
+    parser.add_argument('-o', '--output', help='write the full report as JSON here')
+    args = parser.parse_args()
+
+    games_dir = Path(args.games_dir)
+    if not games_dir.is_dir():
+        print(f"Games directory not found: {games_dir}")
+        return 1
+
+    cache_path = None if args.no_cache else (args.cache or str(games_dir / CACHE_FILE))
+    report = analyze_games(games_dir, cache_path, args.workers, args.force)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{'game':<24} {'passages':>9} {'links':>8} {'broken':>7} {'KiB':>9} {'change':>8} {'parse ms':>9}")
+        for game in report['games']:
+            if game['error'] is not None:
+                print(f"{game['id']:<24} ERROR: {game['error']}")
+                continue
+            print(f"{game['id']:<24} {game['passages']:>9} {game['links']:>8} {len(game['brokenLinks']):>7} "
+                  f"{game['bytes'] / 1024:>9.1f} {format_change(game['passagesTrend']['previous']):>8} "
+                  f"{game['parseSeconds'] * 1000:>9.1f}")
+        totals = report['totals']
+        print(f"{totals['games']} games ({totals['analyzed']} analyzed, {totals['cached']} cached, "
+              f"{totals['errors']} errors): {totals['passages']} passages, {totals['links']} links, "
+              f"{totals['brokenLinks']} broken in {report['seconds']:.2f}s")
+
+    return 1 if report['totals']['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,25 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
+import atexit
 import os
-import json
+import threading
+import time
 from twee import TweeParser, TweeExporter
+from graph import StoryGraph
+from store import ProjectStore
+from history import ProjectHistory
+from layout import LayoutEngine
+from search import SearchIndex
+from lint import StoryLinter
+from preview import PreviewRuntime
+from coverage import analyze as analyze_coverage
+from merge import diff_stories, format_story, merge_stories, read_story
+from bulk import bulk_import
+from collab import COLLAB_PORT, CollabServer, CollabThread
+from parsecache import parse_cache
+from outline import StoryScanner, encode_index
+from upload import MAX_IMPORT_BYTES, DecodedLines, detach_upload, hash_stream, iter_import_json, iter_indexed_import_json
+from metrics import metrics, profiler
 
 app = Flask(__name__)
 CORS(app)
@@ -11,6 +28,47 @@ UPLOAD_FOLDER = 'uploads'
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+store = ProjectStore(UPLOAD_FOLDER)
+history = ProjectHistory(os.path.join(UPLOAD_FOLDER, 'history'))
+layout_engine = LayoutEngine()
+preview_runtime = PreviewRuntime()
+search_indexes = {}
+linters = {}
+
+# Serializes store writes with the history and index updates that follow them
+save_lock = threading.Lock()
+
+# CollabThread sharing this process's store; started in __main__
+collab = None
+
+metrics.register_cache('layout', layout_engine)
+metrics.register_cache('preview', preview_runtime)
+metrics.register_cache('parse', parse_cache)
+
+@app.before_request
+def start_request_timer():
+    g.started = time.perf_counter()
+    g.profiler = profiler.start(request.headers)
+
+@app.after_request
+def record_request_metrics(response):
+    elapsed = time.perf_counter() - g.started
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.observe_request(endpoint, request.method, response.status_code, elapsed,
+                            request.content_length or 0,
+                            0 if response.is_streamed else response.content_length or 0)
+    return response
+
+@app.teardown_request
+def stop_request_profiler(error=None):
+    # Runs even when an exception skips after_request, so the profiler is always released
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    profiler.finish(g.pop('profiler', None), time.perf_counter() - g.started, f'{request.method} {endpoint}')
+
+@app.route('/api/metrics')
+def metrics_text():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     return send_from_directory('../static', 'index.html')
@@ -19,19 +77,60 @@ def index():
 def serve_static(path):
     return send_from_directory('../static', path)
 
+def stream_import(stream):
+    """Parse an upload as it is read, indexing it into the parse cache if it completes"""
+    started = time.perf_counter()
+    scanner = StoryScanner()
+    lines = DecodedLines(stream, scanner=scanner)
+    parser = TweeParser()
+
+    yield from iter_import_json(lines, parser)
+
+    metrics.observe_operation('parse', time.perf_counter() - started, parser.passage_id - 1)
+    if lines.complete:
+        parse_cache.store(parse_cache.key('story', lines.digest.hexdigest()), encode_index(scanner.finish()))
+
 @app.route('/api/import', methods=['POST'])
 def import_twee():
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file provided'}), 400
+        if request.mimetype == 'multipart/form-data':
+            if 'file' not in request.files:
+                return jsonify({'error': 'No file provided'}), 400
+
+            file = request.files['file']
+            if file.filename == '':
+                return jsonify({'error': 'No file selected'}), 400
+
+            # Form uploads are already spooled, so bytes indexed before (by an
+            # earlier import or a game outline) are cut up without a parse
+            index = parse_cache.lookup(parse_cache.key('story', hash_stream(file.stream)))
+            if index is not None:
+                return Response(iter_indexed_import_json(file.stream.read(), index, TweeParser()),
+                                mimetype='application/json')
 
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
+            # request.files is closed before the body is generated
+            stream = detach_upload(file.stream)
+            response = Response(stream_with_context(stream_import(stream)), mimetype='application/json')
+            response.call_on_close(stream.close)
+            return response
 
-        content = file.read().decode('utf-8')
-        parser = TweeParser()
-        data = parser.parse(content)
+        # Any other body is parsed while it is still arriving
+        if (request.content_length or 0) > MAX_IMPORT_BYTES:
+            return jsonify({'error': f'Upload is larger than {MAX_IMPORT_BYTES} bytes'}), 413
+        return Response(stream_with_context(stream_import(request.stream)), mimetype='application/json')
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/import/bulk', methods=['POST'])
+def import_twee_bulk():
+    try:
+        files = [f for f in request.files.getlist('files') if f.filename]
+        if not files:
+            return jsonify({'error': 'No files provided'}), 400
+
+        workers = request.args.get('workers', None, type=int)
+        data = bulk_import(((f.filename, f.read()) for f in files), workers)
 
         return jsonify(data)
 
@@ -46,13 +145,190 @@ def export_twee():
             return jsonify({'error': 'No data provided'}), 400
 
         exporter = TweeExporter()
+
+        # ?format=twee streams plain text instead of wrapping it in JSON
+        if request.args.get('format') == 'twee':
+            chunks = metrics.timed_iter('export', exporter.iter_export(data), len(data.get('passages', [])))
+            return Response(stream_with_context(chunks),
+                            mimetype='text/plain',
+                            headers={'Content-Disposition': 'attachment; filename=story.twee'})
+
+        started = time.perf_counter()
         twee_content = exporter.export(data)
+        metrics.observe_operation('export', time.perf_counter() - started, len(data.get('passages', [])))
 
         return jsonify({'content': twee_content})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/graph', methods=['POST'])
+def story_graph():
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+
+        graph = StoryGraph(data)
+
+        return jsonify(graph.to_dict())
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/layout', methods=['POST'])
+def story_layout():
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+
+        return jsonify(layout_engine.layout(data))
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/lint', methods=['POST'])
+def lint_story():
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+
+        return jsonify(StoryLinter(data).lint())
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/lint/<project_id>', methods=['GET'])
+def lint_project(project_id):
+    try:
+        linter = linters.get(project_id)
+        if linter is None:
+            # Like search_project(): a save between the load and the install would never reach it
+            with save_lock:
+                linter = linters.get(project_id)
+                if linter is None:
+                    data = store.load(project_id)
+                    if data is None:
+                        return jsonify({'error': 'Project not found'}), 404
+                    linter = linters[project_id] = StoryLinter(data)
+
+        return jsonify(linter.lint())
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/preview', methods=['POST'])
+def preview_story():
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+
+        # Optionally render just some passages
+        passage_ids = data.get('passageIds')
+        if passage_ids is not None:
+            wanted = set(passage_ids)
+            data = dict(data, passages=[p for p in data.get('passages', []) if p['id'] in wanted])
+
+        return jsonify({'passages': preview_runtime.render_all(data, data.get('variables'))})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/variables', methods=['POST'])
+def story_variables():
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+
+        return jsonify(preview_runtime.variable_index(data))
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/coverage', methods=['POST'])
+def story_coverage():
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+
+        report = analyze_coverage(
+            data,
+            playthroughs=data.get('playthroughs', 10000),
+            variables=data.get('variables'),
+            seed=data.get('seed', 1),
+            max_steps=data.get('maxSteps', 1000),
+            workers=request.args.get('workers', None, type=int),
+            start=data.get('start')
+        )
+
+        return jsonify(report)
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/merge', methods=['POST'])
+def merge_story():
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+
+        if not all(isinstance(data.get(key), str) for key in ('base', 'ours', 'theirs')):
+            return jsonify({'error': 'base, ours and theirs must be Twee text'}), 400
+
+        result = merge_stories(read_story(data['base']), read_story(data['ours']), read_story(data['theirs']))
+
+        return jsonify({
+            'twee': format_story(result['passages']),
+            'conflicts': result['conflicts'],
+            'stats': result['stats']
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/diff', methods=['POST'])
+def diff_story():
+    try:
+        data = request.json
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+
+        if not all(isinstance(data.get(key), str) for key in ('old', 'new')):
+            return jsonify({'error': 'old and new must be Twee text'}), 400
+
+        return jsonify(diff_stories(read_story(data['old']), read_story(data['new'])))
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def record_changes(project_id, data, delta):
+    """Bring history, search and lint up to date with a stored delta; needs save_lock"""
+    version = history.record(project_id, data, delta)
+
+    index = search_indexes.get(project_id)
+    if index is not None and delta:
+        index.apply_delta(delta, data.get('lanes', []))
+
+    linter = linters.get(project_id)
+    if linter is not None and delta:
+        linter.apply_delta(delta, data.get('lanes', []))
+
+    return version
+
+def commit_collab_changes(project_id, delta):
+    """CollabServer commit: journal a session's changes the way /api/save would"""
+    with save_lock:
+        project = store.append(project_id, delta)
+        record_changes(project_id, project, delta)
+
 @app.route('/api/save', methods=['POST'])
 def save_project():
     try:
@@ -61,12 +337,16 @@ def save_project():
             return jsonify({'error': 'No data provided'}), 400
 
         project_id = data.get('id', 'default')
-        filepath = os.path.join(UPLOAD_FOLDER, f'{project_id}.json')
 
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=2)
+        def write():
+            with save_lock:
+                delta = store.save(project_id, data)
+                return record_changes(project_id, data, delta)
 
-        return jsonify({'success': True, 'id': project_id})
+        # A live collaboration session is committed and closed around the save
+        version = collab.replace(project_id, write) if collab is not None else write()
+
+        return jsonify({'success': True, 'id': project_id, 'version': version})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -74,18 +354,77 @@ def save_project():
 @app.route('/api/load/<project_id>', methods=['GET'])
 def load_project(project_id):
     try:
-        filepath = os.path.join(UPLOAD_FOLDER, f'{project_id}.json')
+        version = request.args.get('version', None, type=int)
+        if version is not None:
+            data = history.load(project_id, version)
+        else:
+            data = store.load(project_id)
 
-        if not os.path.exists(filepath):
+        if data is None:
             return jsonify({'error': 'Project not found'}), 404
 
-        with open(filepath, 'r') as f:
-            data = json.load(f)
-
         return jsonify(data)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/history/<project_id>', methods=['GET'])
+def project_history(project_id):
+    try:
+        versions = history.history(project_id)
+        if not versions:
+            return jsonify({'error': 'No history for project'}), 404
+
+        return jsonify({'id': project_id, 'versions': versions})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/history/gc', methods=['POST'])
+def collect_history():
+    try:
+        return jsonify(history.gc())
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/search/<project_id>', methods=['GET'])
+def search_project(project_id):
+    try:
+        index = search_indexes.get(project_id)
+        if index is None:
+            # A save between the load and the install would never reach the index
+            with save_lock:
+                index = search_indexes.get(project_id)
+                if index is None:
+                    data = store.load(project_id)
+                    if data is None:
+                        return jsonify({'error': 'Project not found'}), 404
+                    index = search_indexes[project_id] = SearchIndex(data)
+
+        query = request.args.get('q', '')
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('perPage', 50, type=int)
+
+        return jsonify(index.search(query, page, per_page))
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def start_collab():
+    """Serve collaboration sessions from this process, on BRANCHED_COLLAB_PORT"""
+    thread = CollabThread(CollabServer(store, commit=commit_collab_changes))
+    try:
+        thread.start(port=COLLAB_PORT)
+    except OSError as e:
+        print(f"Error: collaboration server not started on port {COLLAB_PORT}: {e}")
+        return None
+    atexit.register(thread.close)
+    print(f"Collaboration server on port {COLLAB_PORT}")
+    return thread
+
 if __name__ == '__main__':
+    # The reloader runs this module twice; only the child it starts serves requests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        collab = start_collab()
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Bulk Twee import - parses many .twee files in parallel and merges them
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from twee import TweeParser
+
+TWEE_SUFFIXES = ('.twee', '.tw')
+
+
+def expand_paths(paths):
+    """Expand directories into the Twee files they contain, sorted by name"""
+    files = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            files.extend(sorted(p for p in path.rglob('*') if p.suffix in TWEE_SUFFIXES))
+        else:
+            files.append(path)
+    return files
+
+
+def parse_source(name, source):
+    """Worker: parse one file (a path, or the uploaded bytes) and time it"""
+    started = time.perf_counter()
+    try:
+        if isinstance(source, bytes):
+            data = TweeParser().parse_story(source.decode('utf-8'))
+        else:
+            with open(source, 'r', encoding='utf-8') as f:
+                data = TweeParser().parse_story(f)
+        error = None
+    except Exception as e:
+        data = None
+        error = str(e)
+
+    return {
+        'name': name,
+        'data': data,
+        'error': error,
+        'seconds': time.perf_counter() - started
+    }
+
+
+def merge_results(results):
+    """Merge per-file parse results in input order.
+
+    IDs are re-issued the way TweeParser.parse would for the files read
+    back to back: lanes are shared by name and numbered in order of first
+    appearance, passages are numbered in file order. Which worker finished
+    first never changes the outcome.
+    """
+    lanes = [{'id': 'metadata', 'name': 'Metadata', 'isMetadata': True}]
+    lane_map = {}
+    passages = []
+    files = []
+
+    for result in results:
+        data = result['data']
+        report = {
+            'name': result['name'],
+            'seconds': round(result['seconds'], 6),
+            'passages': 0,
+            'error': result['error']
+        }
+        files.append(report)
+        if data is None:
+            continue
+
+        lane_ids = {'metadata': 'metadata'}
+        for lane in data['lanes']:
+            if lane.get('isMetadata'):
+                continue
+            if lane['name'] not in lane_map:
+                lane_map[lane['name']] = f'lane_{len(lane_map) + 1}'
+                lanes.append(dict(lane, id=lane_map[lane['name']]))
+            lane_ids[lane['id']] = lane_map[lane['name']]
+
+        for passage in data['passages']:
+            passages.append(dict(
+                passage,
+                id=f'passage_{len(passages) + 1}',
+                laneId=lane_ids.get(passage['laneId'], passage['laneId'])
+            ))
+        report['passages'] = len(data['passages'])
+
+    return {
+        'passages': passages,
+        'lanes': lanes,
+        'files': files
+    }
+
+
+def bulk_import(sources, workers=None):
+    """Parse (name, source) pairs across a process pool and merge them"""
+    sources = list(sources)
+    started = time.perf_counter()
+
+    if workers == 1 or len(sources) <= 1:
+        results = [parse_source(name, source) for name, source in sources]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(parse_source, *zip(*sources)))
+
+    merged = merge_results(results)
+    merged['seconds'] = round(time.perf_counter() - started, 6)
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parse many Twee files in parallel and merge them')
+    parser.add_argument('paths', nargs='+', help='.twee files or directories to search for them')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('-o', '--output', help='write the merged story JSON here')
+    args = parser.parse_args()
+
+    files = expand_paths(args.paths)
+    if not files:
+        print("No .twee files found")
+        return 1
+
+    result = bulk_import(((str(path), str(path)) for path in files), args.workers)
+
+    for report in result['files']:
+        status = f"ERROR: {report['error']}" if report['error'] else f"{report['passages']} passages"
+        print(f"{report['seconds'] * 1000:9.1f} ms  {report['name']}  {status}")
+    print(f"Merged {len(result['passages'])} passages in {len(result['lanes'])} lanes "
+          f"from {len(files)} files in {result['seconds']:.2f}s using {args.workers or os.cpu_count()} workers")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f)
+
+    return 1 if any(report['error'] for report in result['files']) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
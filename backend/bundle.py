@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Static bundle builder - one minified, content-hashed script and stylesheet for the editor
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from pathlib import Path
+
+STATIC_DIR = Path(__file__).parent.parent / "static"
+
+# Where `branched` writes the bundle so the server can start without rebuilding
+BUILD_DIR = Path(os.environ.get('BRANCHED_BUILD_DIR', Path(__file__).parent.parent / "build"))
+
+# Bundles are served from here, outside the static/ namespace
+ASSET_PREFIX = '/assets/'
+
+# Bump when the output for the same sources changes so old builds are redone
+BUNDLE_FORMAT = 1
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+SCRIPT_TAG_REGEX = re.compile(r'[ \t]*<script src="([^":]+\.js)"></script>[ \t]*\n?')
+STYLESHEET_TAG_REGEX = re.compile(r'[ \t]*<link rel="stylesheet" href="([^":]+\.css)">[ \t]*\n?')
+
+# A `/` after one of these starts a regular expression rather than a division
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+REGEX_KEYWORDS = {'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void',
+                  'throw', 'case', 'do', 'else', 'yield', 'await'}
+
+WORD_CHARS = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_$')
+
+
+def skip_quoted(source, start):
+    """Index just past the string literal opening at `start`"""
+    quote = source[start]
+    i = start + 1
+    while i < len(source) and source[i] != quote:
+        i += 2 if source[i] == '\\' else 1
+    return i + 1
+
+
+def skip_regex(source, start):
+    """Index just past the regular expression literal (and flags) opening at `start`"""
+    i = start + 1
+    in_class = False
+    while i < len(source):
+        char = source[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char == '[':
+            in_class = True
+        elif char == ']':
+            in_class = False
+        elif char == '/' and not in_class:
+            break
+        elif char == '\n':
+            raise ValueError(f'unterminated regular expression at offset {start}')
+        i += 1
+    i += 1
+    while i < len(source) and source[i] in WORD_CHARS:
+        i += 1
+    return i
+
+
+def minify_js(source):
+    """Drop comments, indentation, trailing spaces and blank lines.
+
+    Line breaks are kept so automatic semicolon insertion behaves exactly
+    as before, and strings, template literals and regular expressions are
+    copied untouched.
+    """
+    out = []
+    i = 0
+    length = len(source)
+    last = ''            # last significant character written
+    last_word = ''
+    line_start = True
+    braces = 0
+    templates = []       # brace depth at each open ${ ... } inside a template
+
+    def copy_template(i):
+        """Copy template text from i up to its closing backtick or next ${; returns the new index"""
+        nonlocal braces
+        start = i
+        while i < length:
+            char = source[i]
+            if char == '\\':
+                i += 2
+                continue
+            if char == '`':
+                out.append(source[start:i + 1])
+                return i + 1
+            if char == '$' and source.startswith('${', i):
+                out.append(source[start:i + 2])
+                templates.append(braces)
+                braces += 1
+                return i + 2
+            i += 1
+        raise ValueError('unterminated template literal')
+
+    while i < length:
+        char = source[i]
+
+        if char in ' \t':
+            end = i
+            while end < length and source[end] in ' \t':
+                end += 1
+            if not line_start and end < length and source[end] not in '\r\n':
+                out.append(' ')
+            i = end
+            continue
+
+        if char in '\r\n':
+            if not line_start:
+                if out[-1] == ' ':
+                    out.pop()
+                out.append('\n')
+                line_start = True
+            i += 1
+            continue
+
+        if source.startswith('//', i):
+            while i < length and source[i] not in '\r\n':
+                i += 1
+            continue
+
+        if source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            if end < 0:
+                raise ValueError(f'unterminated comment at offset {i}')
+            # A comment spanning lines still ends the line for semicolon insertion,
+            # and one between two tokens must not glue them together
+            if not line_start and '\n' in source[i:end]:
+                out.append('\n')
+                line_start = True
+            elif not line_start and end + 2 < length and source[end + 2] not in ' \t\r\n':
+                out.append(' ')
+            i = end + 2
+            continue
+
+        line_start = False
+
+        if char in '"\'':
+            end = skip_quoted(source, i)
+            out.append(source[i:end])
+            last, last_word = char, ''
+            i = end
+            continue
+
+        if char == '`':
+            last, last_word = '`', ''
+            out.append('`')
+            i = copy_template(i + 1)
+            continue
+
+        if char == '/' and (last in REGEX_PRECEDERS or last == '' or last_word in REGEX_KEYWORDS):
+            end = skip_regex(source, i)
+            out.append(source[i:end])
+            last, last_word = '/', ''
+            i = end
+            continue
+
+        if char in WORD_CHARS:
+            end = i
+            while end < length and source[end] in WORD_CHARS:
+                end += 1
+            last_word = source[i:end]
+            last = 'a'
+            out.append(last_word)
+            i = end
+            continue
+
+        if char == '{':
+            braces += 1
+        elif char == '}':
+            braces -= 1
+            if templates and templates[-1] == braces:
+                # End of a ${ ... } substitution: back inside the template
+                templates.pop()
+                out.append('}')
+                i = copy_template(i + 1)
+                continue
+
+        out.append(char)
+        last, last_word = char, ''
+        i += 1
+
+    return ''.join(out).rstrip('\n') + '\n'
+
+
+def minify_css(source):
+    """Drop comments and collapse whitespace around braces, semicolons and commas"""
+    out = []
+    i = 0
+    length = len(source)
+    while i < length:
+        char = source[i]
+        if source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = length if end < 0 else end + 2
+            continue
+        if char in '"\'':
+            end = skip_quoted(source, i)
+            out.append(source[i:end])
+            i = end
+            continue
+        if char in ' \t\r\n':
+            end = i
+            while end < length and source[end] in ' \t\r\n':
+                end += 1
+            previous = out[-1][-1:] if out else ''
+            following = source[end:end + 1]
+            # Spaces matter between selector parts and values, not around punctuation
+            if previous and previous not in '{};,>' and following not in '{};,>' \
+                    and not source.startswith('/*', end):
+                out.append(' ')
+            i = end
+            continue
+        out.append(char)
+        i += 1
+    return ''.join(out).strip() + '\n'
+
+
+def content_hash(body):
+    return hashlib.sha256(body).hexdigest()[:16]
+
+
+class Bundle:
+    """The editor's assets, minified, hashed and gzipped in memory.
+
+    `assets` maps a URL path like /assets/branched.<hash>.js to
+    (body, gzipped body, content type). `index` is index.html rewritten to
+    load the bundles instead of the individual files. `sources` records the
+    (mtime_ns, size) of every input so a stale bundle can be noticed.
+    """
+
+    def __init__(self, static_dir, index, assets, sources):
+        self.static_dir = Path(static_dir)
+        self.index = index
+        self.index_gzip = gzip.compress(index, 9, mtime=0)
+        self.index_etag = f'"{content_hash(index)}"'
+        self.assets = assets
+        self.sources = sources
+
+    def is_fresh(self):
+        """Whether every source file still has the mtime and size it was built from"""
+        for name, signature in self.sources.items():
+            try:
+                stat = os.stat(self.static_dir / name)
+            except OSError:
+                return False
+            if [stat.st_mtime_ns, stat.st_size] != signature:
+                return False
+        return True
+
+    def write(self, build_dir):
+        """Save the bundle so the next server start can load it instead of rebuilding"""
+        build_dir = Path(build_dir)
+        build_dir.mkdir(parents=True, exist_ok=True)
+        files = {}
+        for path, (body, body_gzip, content_type) in self.assets.items():
+            name = path[len(ASSET_PREFIX):]
+            (build_dir / name).write_bytes(body)
+            (build_dir / f'{name}.gz').write_bytes(body_gzip)
+            files[path] = {'file': name, 'type': content_type}
+        (build_dir / 'index.html').write_bytes(self.index)
+
+        manifest = {'format': BUNDLE_FORMAT, 'static': str(self.static_dir.resolve()),
+                    'sources': self.sources, 'assets': files}
+        temp_path = build_dir / 'manifest.json.tmp'
+        temp_path.write_text(json.dumps(manifest, indent=2))
+        os.replace(temp_path, build_dir / 'manifest.json')
+
+        # Bundles from earlier builds are no longer referenced
+        keep = {entry['file'] for entry in files.values()}
+        keep |= {f'{name}.gz' for name in keep} | {'index.html', 'manifest.json'}
+        for path in build_dir.iterdir():
+            if path.name not in keep and path.name.startswith('branched.'):
+                path.unlink()
+
+
+def source_signature(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def build_bundle(static_dir=STATIC_DIR):
+    """Bundle the scripts and stylesheets index.html loads, in the order it loads them"""
+    static_dir = Path(static_dir)
+    sources = {'index.html': source_signature(static_dir / 'index.html')}
+    html = (static_dir / 'index.html').read_text(encoding='utf-8')
+    assets = {}
+
+    for regex, minify, suffix, content_type, tag in (
+            (STYLESHEET_TAG_REGEX, minify_css, 'css', 'text/css; charset=utf-8',
+             '    <link rel="stylesheet" href="{}">\n'),
+            (SCRIPT_TAG_REGEX, minify_js, 'js', 'application/javascript; charset=utf-8',
+             '    <script src="{}"></script>\n')):
+        names = regex.findall(html)
+        if not names:
+            continue
+
+        parts = []
+        for name in names:
+            sources[name] = source_signature(static_dir / name)
+            text = (static_dir / name).read_text(encoding='utf-8')
+            try:
+                parts.append(f'/* {name} */\n' if suffix == 'css' else f'// {name}\n')
+                parts.append(minify(text))
+            except ValueError as e:
+                raise ValueError(f'{name}: {e}')
+        # Scripts are separate <script> elements today, so keep them separate statements
+        body = (';\n' if suffix == 'js' else '').join(
+            parts[i] + parts[i + 1] for i in range(0, len(parts), 2)).encode('utf-8')
+
+        path = f'{ASSET_PREFIX}branched.{content_hash(body)}.{suffix}'
+        assets[path] = (body, gzip.compress(body, 9, mtime=0), content_type)
+
+        # The first tag becomes the bundle, the rest go
+        first = [True]
+
+        def replace(match, path=path, tag=tag):
+            if first[0]:
+                first[0] = False
+                return tag.format(path)
+            return ''
+        html = regex.sub(replace, html)
+
+    return Bundle(static_dir, html.encode('utf-8'), assets, sources)
+
+
+def load_bundle(build_dir=BUILD_DIR, static_dir=STATIC_DIR):
+    """A bundle written by an earlier build, or None if it is missing or stale"""
+    build_dir = Path(build_dir)
+    try:
+        manifest = json.loads((build_dir / 'manifest.json').read_text())
+        if manifest.get('format') != BUNDLE_FORMAT or manifest.get('static') != str(Path(static_dir).resolve()):
+            return None
+        assets = {}
+        for path, entry in manifest['assets'].items():
+            body = (build_dir / entry['file']).read_bytes()
+            if path != f"{ASSET_PREFIX}branched.{content_hash(body)}.{path.rsplit('.', 1)[1]}":
+                return None
+            assets[path] = (body, (build_dir / f"{entry['file']}.gz").read_bytes(), entry['type'])
+        bundle = Bundle(static_dir, (build_dir / 'index.html').read_bytes(), assets, manifest['sources'])
+    except (OSError, ValueError, KeyError):
+        return None
+    return bundle if bundle.is_fresh() else None
+
+
+class BundleCache:
+    """The current bundle, rebuilt when a source file changes.
+
+    get() costs one stat() per source file, so editing static/ while the
+    server runs is picked up on the next page load.
+    """
+
+    def __init__(self, static_dir=STATIC_DIR, build_dir=BUILD_DIR):
+        self.static_dir = static_dir
+        self.build_dir = build_dir
+        self.bundle = None
+        self.previous = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            if self.bundle is not None and self.bundle.is_fresh():
+                self.hits += 1
+                return self.bundle
+            self.misses += 1
+
+            bundle = load_bundle(self.build_dir, self.static_dir) if self.bundle is None else None
+            if bundle is None:
+                bundle = build_bundle(self.static_dir)
+            if self.bundle is not None:
+                # Pages loaded before the rebuild still ask for the old names
+                self.previous = dict(self.bundle.assets)
+            self.bundle = bundle
+            return bundle
+
+    def asset(self, path):
+        """(body, gzipped body, content type) for an /assets/ path, or None"""
+        bundle = self.get()
+        return bundle.assets.get(path) or self.previous.get(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the hashed, minified editor bundle')
+    parser.add_argument('--static', default=str(STATIC_DIR), help='static directory (default: %(default)s)')
+    parser.add_argument('-o', '--output', default=str(BUILD_DIR), help='build directory (default: %(default)s)')
+    parser.add_argument('--check', action='store_true', help='only report whether the existing build is current')
+    args = parser.parse_args()
+
+    if args.check:
+        current = load_bundle(args.output, args.static) is not None
+        print('Bundle is up to date' if current else 'Bundle is missing or stale')
+        return 0 if current else 1
+
+    bundle = load_bundle(args.output, args.static)
+    if bundle is not None:
+        print(f"Bundle is up to date in {args.output}")
+        return 0
+
+    try:
+        bundle = build_bundle(args.static)
+    except (OSError, ValueError) as e:
+        print(f"Error building bundle: {e}")
+        return 1
+    bundle.write(args.output)
+
+    sources = sum(size for _, size in bundle.sources.values())
+    for path, (body, body_gzip, _) in bundle.assets.items():
+        print(f"{path}: {len(body) / 1024:.1f} KiB, {len(body_gzip) / 1024:.1f} KiB gzipped")
+    print(f"Built {len(bundle.assets)} bundles from {len(bundle.sources) - 1} files "
+          f"({sources / 1024:.1f} KiB) in {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
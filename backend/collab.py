@@ -0,0 +1,1091 @@
+#!/usr/bin/env python3
+"""
+Collaboration server - several clients editing one project through small operations
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import deque
+from http import HTTPStatus
+
+from metrics import endpoint_label, metrics
+from store import ProjectStore, dumps
+
+COLLAB_PORT = int(os.environ.get('BRANCHED_COLLAB_PORT', 5001))
+
+# Operations arriving within this many seconds are coalesced and broadcast together
+BATCH_INTERVAL = float(os.environ.get('BRANCHED_COLLAB_BATCH_MS', 50)) / 1000
+
+# Seconds between journal writes of the changes made since the last one
+PERSIST_INTERVAL = float(os.environ.get('BRANCHED_COLLAB_PERSIST_INTERVAL', 1.0))
+
+# Broadcast batches kept so reconnecting clients can catch up
+BATCH_HISTORY = 1000
+
+# A client this many batches behind is disconnected and catches up on reconnect
+MAX_QUEUED_BATCHES = 500
+
+# Seconds between SSE comments that keep idle streams open
+KEEPALIVE_INTERVAL = 15
+
+MAX_BODY_BYTES = 1024 * 1024
+
+PROJECT_ID_REGEX = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+
+def utf16_len(text):
+    return len(text) if text.isascii() else len(text.encode('utf-16-le')) // 2
+
+
+def utf16_index(text, units):
+    """str index of a UTF-16 code unit offset, which is what the browser counts in"""
+    if text.isascii():
+        return units
+    count = 0
+    for index, char in enumerate(text):
+        if count >= units:
+            return index
+        count += 2 if ord(char) > 0xFFFF else 1
+    return len(text)
+
+
+def apply_splices(text, splices):
+    """Apply [at, remove, insert] edits in order; offsets are in UTF-16 code units"""
+    for at, remove, insert in splices:
+        if at < 0 or remove < 0 or at + remove > utf16_len(text):
+            raise OpError('invalid', 'splice out of range')
+        text = text[:utf16_index(text, at)] + insert + text[utf16_index(text, at + remove):]
+    return text
+
+
+def coalesce_splices(splices, more):
+    """Append splices, folding typing and backspacing at the end of the previous insert into it"""
+    splices = list(splices)
+    for at, remove, insert in more:
+        if splices:
+            last_at, last_remove, last_insert = splices[-1]
+            end = last_at + utf16_len(last_insert)
+            if remove == 0 and at == end:
+                splices[-1] = [last_at, last_remove, last_insert + insert]
+                continue
+            if at + remove == end and remove <= utf16_len(last_insert):
+                kept = last_insert[:utf16_index(last_insert, utf16_len(last_insert) - remove)]
+                splices[-1] = [last_at, last_remove, kept + insert]
+                continue
+        splices.append([at, remove, insert])
+    return splices
+
+
+def field_changes(op):
+    """(fields to set, splices) of an edit/move/retag operation"""
+    kind = op['op']
+    if kind == 'move':
+        return {'x': op['x'], 'y': op['y']}, []
+    if kind == 'retag':
+        return {'tags': op['tags']}, []
+    fields = {key: op[key] for key in ('title', 'content') if key in op}
+    return fields, [list(splice) for splice in op.get('splices', [])]
+
+
+class OpError(ValueError):
+    """An operation the server refused, with a short code the client can act on"""
+
+    def __init__(self, code, message, **details):
+        super().__init__(message)
+        self.code = code
+        self.details = details
+
+    def to_dict(self):
+        return dict(self.details, ok=False, error=self.code, message=str(self))
+
+
+def validate_op(op):
+    """Check the shape of a client operation; raises OpError"""
+    if not isinstance(op, dict) or not isinstance(op.get('op'), str):
+        raise OpError('invalid', 'operation must be an object with an "op"')
+    kind = op['op']
+    if kind not in ('create', 'edit', 'move', 'retag', 'relane', 'delete', 'lane', 'lane-delete'):
+        raise OpError('invalid', f'unknown operation {kind!r}')
+
+    if kind in ('edit', 'move', 'retag', 'relane', 'delete'):
+        if not isinstance(op.get('id'), str):
+            raise OpError('invalid', f'{kind} needs a passage id')
+        if not isinstance(op.get('base'), int):
+            raise OpError('invalid', f'{kind} needs the base version it was made against')
+    for key in ('title', 'tags', 'content', 'name'):
+        if key in op and not isinstance(op[key], str):
+            raise OpError('invalid', f'{key} must be a string')
+    if kind == 'create' and not isinstance(op.get('title'), str):
+        raise OpError('invalid', 'create needs a title')
+    if kind in ('create', 'relane') and not isinstance(op.get('laneId'), str):
+        raise OpError('invalid', f'{kind} needs a laneId')
+    if kind == 'move' and not all(isinstance(op.get(key), (int, float)) for key in ('x', 'y')):
+        raise OpError('invalid', 'move needs numeric x and y')
+    if kind == 'retag' and not isinstance(op.get('tags'), str):
+        raise OpError('invalid', 'retag needs tags')
+    if 'splices' in op:
+        splices = op['splices']
+        if not isinstance(splices, list) or not all(
+                isinstance(s, list) and len(s) == 3 and isinstance(s[0], int) and isinstance(s[1], int)
+                and isinstance(s[2], str) for s in splices):
+            raise OpError('invalid', 'splices must be [at, remove, insert] lists')
+        if 'content' in op:
+            raise OpError('invalid', 'send either content or splices')
+    if kind == 'lane-delete' and not isinstance(op.get('id'), str):
+        raise OpError('invalid', 'lane-delete needs a lane id')
+
+
+class CollabSession:
+    """One project being edited by several clients.
+
+    Operations are applied as they arrive. Each passage has a version that
+    goes up with every change; an operation names the version it was made
+    against (`base`) and is refused with a "conflict" if another client
+    changed the passage since. A client's own changes in between don't
+    count, so it can keep typing without waiting for acknowledgements.
+
+    Accepted operations wait in an outbox for BATCH_INTERVAL. Field edits
+    (text, position, tags) by the same client to the same passage are
+    folded into its previous pending operation, so a burst of keystrokes
+    goes out as one splice. Creates, relanes, deletes and lane operations
+    are never reordered. Each batch is encoded once and sent to every
+    subscriber except the clients that made the changes.
+
+    Changed passages are journaled through the ProjectStore every
+    PERSIST_INTERVAL, so both broadcast and storage cost follow the edit
+    rate rather than the project size.
+    """
+
+    def __init__(self, project_id, project, batch_interval=BATCH_INTERVAL, version=0):
+        self.project_id = project_id
+        self.batch_interval = batch_interval
+
+        project = project or {}
+        entries = project.get('passages', [])
+        # Keep whichever passage shape the stored project uses
+        self.pairs = not entries or not isinstance(entries[0], dict)
+        self.passages = {}
+        for entry in entries:
+            passage_id, passage = (entry['id'], entry) if isinstance(entry, dict) else entry
+            self.passages[passage_id] = dict(passage)
+
+        self.lanes = [dict(lane, passages=list(lane.get('passages', []))) for lane in project.get('lanes', [])]
+        if not self.lanes:
+            self.lanes = [{'id': 'metadata', 'name': 'Metadata', 'isMetadata': True, 'passages': [], 'collapsed': False}]
+        self.lane_map = {lane['id']: lane for lane in self.lanes}
+        self.fields = {key: value for key, value in project.items() if key not in ('passages', 'lanes')}
+        self.fields.setdefault('nextPassageId', len(self.passages) + 1)
+        self.fields.setdefault('nextLaneId', len(self.lanes))
+
+        self.versions = {}
+        self.writers = {}
+
+        self.version = version
+        self.outbox = []
+        self.pending = {}
+        self.flush_handle = None
+        self.batches = deque(maxlen=BATCH_HISTORY)
+        self.subscribers = set()
+
+        self.changed = set()
+        self.lanes_changed = not project
+        self.fields_changed = not project
+
+        self.stats = {'applied': 0, 'rejected': 0, 'broadcast': 0, 'batches': 0, 'bytesSent': 0, 'seconds': 0.0}
+
+    # Applying operations
+
+    def check_base(self, client, passage_id, base):
+        """Refuse an operation made against a version another client has since changed"""
+        current = self.versions.get(passage_id, 0)
+        writer, run_start = self.writers.get(passage_id, (None, 0))
+        if base >= current or (writer == client and base >= run_start):
+            return
+        raise OpError('conflict', f'passage {passage_id} changed since version {base}',
+                      version=current, passage=self.passages[passage_id])
+
+    def bump(self, client, passage_id):
+        current = self.versions.get(passage_id, 0)
+        if self.writers.get(passage_id, (None, 0))[0] != client:
+            self.writers[passage_id] = (client, current)
+        self.versions[passage_id] = current + 1
+        self.changed.add(passage_id)
+        return current + 1
+
+    def get_passage(self, op):
+        passage = self.passages.get(op['id'])
+        if passage is None:
+            raise OpError('not-found', f"no passage {op['id']}")
+        return passage
+
+    def get_lane(self, lane_id):
+        lane = self.lane_map.get(lane_id)
+        if lane is None:
+            raise OpError('not-found', f'no lane {lane_id}')
+        return lane
+
+    def apply(self, client, op):
+        """Apply one client operation and queue it for broadcast; returns the result for the client"""
+        validate_op(op)
+        kind = op['op']
+
+        if kind == 'create':
+            lane = self.get_lane(op['laneId'])
+            passage_id = op.get('id')
+            if passage_id is None:
+                passage_id = f"passage_{self.fields['nextPassageId']}"
+                self.fields['nextPassageId'] += 1
+                self.fields_changed = True
+            if not isinstance(passage_id, str) or passage_id in self.passages:
+                raise OpError('exists', f'passage {passage_id} already exists')
+            passage = {'id': passage_id, 'title': op['title'], 'tags': op.get('tags', ''),
+                       'content': op.get('content', ''), 'laneId': lane['id'],
+                       'x': op.get('x', 0), 'y': op.get('y', 0), 'relativeY': 0}
+            self.passages[passage_id] = passage
+            lane['passages'].append(passage_id)
+            self.lanes_changed = True
+            self.versions.pop(passage_id, None)
+            version = self.bump(client, passage_id)
+            self.queue(client, {'op': 'create', 'id': passage_id, 'passage': dict(passage), 'version': version},
+                       passage_id)
+            return {'ok': True, 'id': passage_id, 'version': version}
+
+        if kind == 'lane':
+            return self.apply_lane(client, op)
+
+        if kind == 'lane-delete':
+            lane = self.get_lane(op['id'])
+            if lane.get('isMetadata') or lane['passages']:
+                raise OpError('invalid', 'only empty, non-metadata lanes can be deleted')
+            self.lanes.remove(lane)
+            del self.lane_map[lane['id']]
+            self.lanes_changed = True
+            self.queue(client, {'op': 'lane-delete', 'id': lane['id']})
+            return {'ok': True}
+
+        passage = self.get_passage(op)
+        passage_id = op['id']
+        self.check_base(client, passage_id, op['base'])
+
+        if kind == 'delete':
+            del self.passages[passage_id]
+            self.remove_from_lane(passage_id, passage.get('laneId'))
+            self.versions.pop(passage_id, None)
+            self.writers.pop(passage_id, None)
+            self.changed.add(passage_id)
+            self.queue(client, {'op': 'delete', 'id': passage_id})
+            self.pending.pop(passage_id, None)
+            return {'ok': True}
+
+        if kind == 'relane':
+            lane = self.get_lane(op['laneId'])
+            if lane['id'] != passage.get('laneId'):
+                self.remove_from_lane(passage_id, passage.get('laneId'))
+                lane['passages'].append(passage_id)
+                passage['laneId'] = lane['id']
+                self.lanes_changed = True
+            version = self.bump(client, passage_id)
+            self.queue(client, {'op': 'update', 'id': passage_id, 'version': version,
+                                'set': {'laneId': lane['id']}}, passage_id)
+            return {'ok': True, 'version': version}
+
+        fields, splices = field_changes(op)
+        content = apply_splices(fields.get('content', passage.get('content', '')), splices) if splices else None
+        passage.update(fields)
+        if content is not None:
+            passage['content'] = content
+        version = self.bump(client, passage_id)
+        self.queue_fields(client, passage_id, version, fields, splices)
+        return {'ok': True, 'version': version}
+
+    def apply_lane(self, client, op):
+        lane = self.lane_map.get(op.get('id'))
+        if lane is None:
+            if not isinstance(op.get('name'), str):
+                raise OpError('invalid', 'a new lane needs a name')
+            lane_id = op.get('id') or f"lane_{self.fields['nextLaneId']}"
+            if op.get('id') is None:
+                self.fields['nextLaneId'] += 1
+                self.fields_changed = True
+            lane = {'id': lane_id, 'name': op['name'], 'isMetadata': False, 'passages': [], 'collapsed': False}
+            self.lanes.append(lane)
+            self.lane_map[lane_id] = lane
+        for key in ('name', 'collapsed'):
+            if key in op:
+                lane[key] = op[key]
+        self.lanes_changed = True
+        self.queue(client, {'op': 'lane', 'lane': {key: value for key, value in lane.items() if key != 'passages'}})
+        return {'ok': True, 'id': lane['id']}
+
+    def remove_from_lane(self, passage_id, lane_id):
+        lane = self.lane_map.get(lane_id)
+        if lane is not None and passage_id in lane['passages']:
+            lane['passages'].remove(passage_id)
+            self.lanes_changed = True
+
+    # Batching
+
+    def queue(self, client, op, passage_id=None):
+        """Add an operation to the outbox; later field edits of passage_id may fold into it"""
+        self.outbox.append([client, op])
+        if passage_id is not None:
+            self.pending[passage_id] = len(self.outbox) - 1
+        self.schedule_flush()
+
+    def queue_fields(self, client, passage_id, version, fields, splices):
+        position = self.pending.get(passage_id)
+        if position is None or self.outbox[position][0] != client:
+            op = {'op': 'update', 'id': passage_id, 'version': version}
+            if fields:
+                op['set'] = dict(fields)
+            if splices:
+                op['splices'] = splices
+            self.queue(client, op, passage_id)
+            return
+
+        # Same client, and nobody else touched the passage since: fold it in
+        op = self.outbox[position][1]
+        op['version'] = version
+        target = op['passage'] if op['op'] == 'create' else op.setdefault('set', {})
+        if 'content' in fields:
+            op.pop('splices', None)
+        target.update(fields)
+        if splices:
+            if op['op'] == 'create' or 'content' in target:
+                target['content'] = apply_splices(target['content'], splices)
+            else:
+                op['splices'] = coalesce_splices(op.get('splices', []), splices)
+        if not target and op['op'] == 'update':
+            del op['set']
+
+    def schedule_flush(self):
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.batch_interval, self.flush)
+
+    def flush(self):
+        """Broadcast the outbox as one batch"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.outbox:
+            return
+
+        started = time.perf_counter()
+        encoded = [(client, dumps(op).encode('utf-8')) for client, op in self.outbox]
+        self.version += 1
+        self.batches.append((self.version, encoded))
+        self.outbox = []
+        self.pending = {}
+
+        for subscriber in list(self.subscribers):
+            self.stats['bytesSent'] += subscriber.send(self.version, encoded)
+
+        elapsed = time.perf_counter() - started
+        self.stats['batches'] += 1
+        self.stats['broadcast'] += len(encoded)
+        self.stats['seconds'] += elapsed
+        metrics.observe_operation('collab-batch', elapsed, len(encoded))
+
+    def batches_since(self, version):
+        """Batches after `version`, or None when they are no longer kept"""
+        if version >= self.version:
+            return []
+        if not self.batches or self.batches[0][0] > version + 1:
+            return None
+        return [batch for batch in self.batches if batch[0] > version]
+
+    # Snapshots and persistence
+
+    def entry(self, passage_id):
+        passage = dict(self.passages[passage_id])
+        return [passage_id, passage] if self.pairs else passage
+
+    def snapshot(self):
+        """Whole project plus passage versions, for a client joining the session"""
+        self.flush()
+        return dict(self.fields,
+                    id=self.project_id,
+                    version=self.version,
+                    lanes=self.lanes,
+                    passages=[self.entry(passage_id) for passage_id in self.passages],
+                    versions={passage_id: version for passage_id, version in self.versions.items()})
+
+    def take_delta(self):
+        """ProjectStore delta for everything changed since the last call"""
+        delta = {}
+        put = {passage_id: self.entry(passage_id) for passage_id in self.changed if passage_id in self.passages}
+        removed = [passage_id for passage_id in self.changed if passage_id not in self.passages]
+        if put:
+            delta['put'] = put
+        if removed:
+            delta['remove'] = removed
+
+        fields = {}
+        if self.lanes_changed:
+            fields['lanes'] = [dict(lane, passages=list(lane['passages'])) for lane in self.lanes]
+        if self.fields_changed:
+            fields.update(self.fields)
+        if fields:
+            delta['fields'] = fields
+
+        self.changed = set()
+        self.lanes_changed = False
+        self.fields_changed = False
+        return delta
+
+    def close(self):
+        """Tell every subscriber to fetch the project again and end their streams"""
+        event = f'event: reload\ndata: {{"version":{self.version}}}\n\n'.encode()
+        for subscriber in list(self.subscribers):
+            subscriber.queue.put_nowait(event)
+            subscriber.queue.put_nowait(None)
+
+
+class Subscriber:
+    """One event stream; batches are queued here and written by the connection's task"""
+
+    def __init__(self, client):
+        self.client = client
+        self.queue = asyncio.Queue()
+        self.overflowed = False
+
+    def send(self, version, encoded):
+        """Queue the ops of a batch that other clients made; returns the bytes queued"""
+        ops = [data for client, data in encoded if client != self.client]
+        if not ops or self.overflowed:
+            return 0
+        if self.queue.qsize() >= MAX_QUEUED_BATCHES:
+            # Too slow to keep up; it resumes from Last-Event-ID after reconnecting
+            self.overflowed = True
+            self.queue.put_nowait(None)
+            return 0
+        event = (f'id: {version}\nevent: ops\ndata: {{"version":{version},"ops":['.encode('utf-8')
+                 + b','.join(ops) + b']}\n\n')
+        self.queue.put_nowait(event)
+        return len(event)
+
+
+class HttpError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or HTTPStatus(status).phrase)
+        self.status = status
+
+
+async def read_request(reader):
+    """(method, path, query, headers, body) of the next request, or None once the client hangs up"""
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError:
+        return None
+    except asyncio.LimitOverrunError:
+        raise HttpError(431)
+
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, _ = lines[0].split(' ', 2)
+    except ValueError:
+        raise HttpError(400, 'Malformed request line')
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        raise HttpError(400, 'Invalid Content-Length')
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413)
+    body = await reader.readexactly(length) if length else b''
+
+    parsed = urllib.parse.urlsplit(target)
+    return method, parsed.path, urllib.parse.parse_qs(parsed.query), headers, body
+
+
+def response_head(status, content_type=None, length=None, extra=()):
+    lines = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}',
+             'Access-Control-Allow-Origin: *',
+             'Access-Control-Allow-Headers: Content-Type, Last-Event-ID']
+    if content_type:
+        lines.append(f'Content-Type: {content_type}')
+    if length is not None:
+        lines.append(f'Content-Length: {length}')
+    lines.extend(extra)
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+class CollabServer:
+    """asyncio HTTP server for collaboration sessions.
+
+    GET  /api/collab/<project>          snapshot to start from
+    GET  /api/collab/<project>/events   server-sent event stream of batches
+    POST /api/collab/<project>/ops      apply {"client", "ops": [...]}
+    GET  /api/metrics                   Prometheus metrics
+
+    Sessions are loaded from the store, and their changes are handed to
+    commit(project_id, delta), store.append by default. The Flask backend
+    passes its own commit so collaboration edits also reach its history,
+    search indexes and linters.
+    """
+
+    def __init__(self, store, batch_interval=BATCH_INTERVAL, persist_interval=PERSIST_INTERVAL, commit=None):
+        self.store = store
+        self.batch_interval = batch_interval
+        self.persist_interval = persist_interval
+        self.commit = commit or store.append
+        self.sessions = {}
+        self.closed_versions = {}
+        self.connections = {}
+        self.server = None
+        self.persister = None
+        self.persisting = asyncio.Lock()
+
+    def session(self, project_id):
+        session = self.sessions.get(project_id)
+        if session is None:
+            # Batch ids carry on from a replaced session so Last-Event-ID stays monotonic
+            session = CollabSession(project_id, self.store.load(project_id), self.batch_interval,
+                                    self.closed_versions.pop(project_id, 0))
+            self.sessions[project_id] = session
+        return session
+
+    async def replace(self, project_id, write):
+        """Run write() for a whole-project save with no collaboration changes pending.
+
+        Pending operations on the project are committed first, and write()
+        runs on the event loop so no operation can slip in between. The
+        session is then dropped and its clients told to reload, so the next
+        request starts from what write() stored. Returns what write() does.
+        """
+        async with self.persisting:
+            session = self.sessions.pop(project_id, None)
+            if session is not None:
+                session.flush()
+                delta = session.take_delta()
+                if delta:
+                    self.commit(project_id, delta)
+            result = write()
+
+        if session is not None:
+            self.closed_versions[project_id] = session.version
+            session.close()
+        return result
+
+    async def start(self, host='', port=COLLAB_PORT):
+        self.server = await asyncio.start_server(self.handle_connection, host or None, port)
+        self.persister = asyncio.create_task(self.persist_loop())
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+        if self.persister is not None:
+            self.persister.cancel()
+        for session in self.sessions.values():
+            session.flush()
+            for subscriber in list(session.subscribers):
+                subscriber.queue.put_nowait(None)
+        # Let open connections finish instead of being cancelled mid-read
+        for writer in self.connections.values():
+            writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        await self.persist()
+
+    async def persist_loop(self):
+        while True:
+            await asyncio.sleep(self.persist_interval)
+            try:
+                await self.persist()
+            except Exception as e:
+                print(f"Error saving collaboration changes: {e}")
+
+    async def persist(self):
+        loop = asyncio.get_running_loop()
+        async with self.persisting:
+            for project_id, session in list(self.sessions.items()):
+                delta = session.take_delta()
+                if delta:
+                    await loop.run_in_executor(None, self.commit, project_id, delta)
+
+    async def handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections[task] = writer
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HttpError as e:
+                    await self.send_json(writer, e.status, {'error': str(e)})
+                    break
+                if request is None:
+                    break
+
+                method, path, query, headers, body = request
+                started = time.perf_counter()
+                status, sent = await self.route(writer, method, path, query, headers, body)
+                metrics.observe_request(endpoint_label(path), method, status,
+                                        time.perf_counter() - started, len(body), sent or 0)
+                if sent is None or headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            del self.connections[task]
+            writer.close()
+
+    async def route(self, writer, method, path, query, headers, body):
+        """Handle one request; returns (status, body bytes), with None bytes after an event stream"""
+        if method == 'OPTIONS':
+            writer.write(response_head(204, extra=['Access-Control-Allow-Methods: GET, POST, OPTIONS']))
+            await writer.drain()
+            return 204, 0
+
+        if method == 'GET' and path == '/api/metrics':
+            return await self.send_body(writer, 200, metrics.render().encode(),
+                                        'text/plain; version=0.0.4; charset=utf-8')
+
+        parts = path.strip('/').split('/')
+        if len(parts) < 3 or parts[:2] != ['api', 'collab'] or not PROJECT_ID_REGEX.match(parts[2]):
+            return await self.send_json(writer, 404, {'error': 'Not found'})
+        project_id = parts[2]
+        action = '/'.join(parts[3:])
+
+        if method == 'GET' and action == '':
+            return await self.send_json(writer, 200, self.session(project_id).snapshot())
+
+        if method == 'GET' and action == 'events':
+            client = query.get('client', [''])[0]
+            since = query.get('since', [headers.get('last-event-id')])[0]
+            try:
+                since = int(since) if since is not None else None
+            except ValueError:
+                return await self.send_json(writer, 400, {'error': 'Invalid since'})
+            await self.stream_events(writer, self.session(project_id), client, since)
+            return 200, None
+
+        if method == 'POST' and action == 'ops':
+            try:
+                data = json.loads(body)
+            except ValueError:
+                return await self.send_json(writer, 400, {'error': 'Invalid JSON'})
+            if not isinstance(data, dict) or not isinstance(data.get('client'), str) \
+                    or not isinstance(data.get('ops'), list):
+                return await self.send_json(writer, 400, {'error': 'Expected {"client", "ops": [...]}'})
+            return await self.send_json(writer, 200, {'results': self.apply_ops(project_id, data)})
+
+        return await self.send_json(writer, 405 if action in ('', 'events', 'ops') else 404,
+                                    {'error': 'Not found'})
+
+    def apply_ops(self, project_id, data):
+        session = self.session(project_id)
+        started = time.perf_counter()
+        results = []
+        for op in data['ops']:
+            try:
+                results.append(session.apply(data['client'], op))
+                session.stats['applied'] += 1
+            except OpError as e:
+                results.append(e.to_dict())
+                session.stats['rejected'] += 1
+        session.stats['seconds'] += time.perf_counter() - started
+        return results
+
+    async def stream_events(self, writer, session, client, since):
+        writer.write(response_head(200, 'text/event-stream', extra=['Cache-Control: no-cache']))
+        subscriber = Subscriber(client)
+        session.subscribers.add(subscriber)
+        try:
+            if since is not None:
+                batches = session.batches_since(since)
+                if batches is None:
+                    # Too far behind; the client reloads the snapshot
+                    writer.write(f'event: reload\ndata: {{"version":{session.version}}}\n\n'.encode())
+                else:
+                    for version, encoded in batches:
+                        subscriber.send(version, encoded)
+            await writer.drain()
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    event = b': keepalive\n\n'
+                if event is None:
+                    break
+                writer.write(event)
+                await writer.drain()
+        finally:
+            session.subscribers.discard(subscriber)
+
+    async def send_body(self, writer, status, body, content_type):
+        writer.write(response_head(status, content_type, len(body)) + body)
+        await writer.drain()
+        return status, len(body)
+
+    async def send_json(self, writer, status, data):
+        return await self.send_body(writer, status, dumps(data).encode('utf-8'), 'application/json')
+
+
+class CollabThread:
+    """A CollabServer on its own event loop thread inside the process that owns the store.
+
+    The Flask backend runs one of these so collaboration edits and /api/save
+    share one ProjectStore, and whole-project saves go through replace().
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='collab', daemon=True)
+
+    def start(self, host='', port=COLLAB_PORT):
+        """Start listening; raises OSError when the port can't be bound"""
+        self.thread.start()
+        try:
+            asyncio.run_coroutine_threadsafe(self.server.start(host, port), self.loop).result()
+        except OSError:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            raise
+
+    def replace(self, project_id, write):
+        """CollabServer.replace() from another thread; blocks until write() has run"""
+        return asyncio.run_coroutine_threadsafe(self.server.replace(project_id, write), self.loop).result()
+
+    def close(self, timeout=10):
+        """Journal pending changes, close every connection and stop the loop"""
+        try:
+            asyncio.run_coroutine_threadsafe(self.server.close(), self.loop).result(timeout)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout)
+
+
+class Replica:
+    """A client's copy of a session, kept in step with the event stream.
+
+    This is the bookkeeping a client needs: apply ops from the stream,
+    skipping any whose passage version is not newer than the local one,
+    and apply its own ops once the server acknowledges them.
+    """
+
+    def __init__(self, snapshot):
+        self.passages = {}
+        for entry in snapshot['passages']:
+            passage_id, passage = (entry['id'], entry) if isinstance(entry, dict) else entry
+            self.passages[passage_id] = dict(passage)
+        self.lanes = {lane['id']: dict(lane, passages=list(lane['passages'])) for lane in snapshot['lanes']}
+        self.versions = dict(snapshot.get('versions', {}))
+        self.version = snapshot['version']
+
+    def apply(self, op):
+        """Apply a broadcast op"""
+        kind = op['op']
+        if kind == 'lane':
+            lane = self.lanes.setdefault(op['lane']['id'], {'passages': []})
+            lane.update(op['lane'])
+        elif kind == 'lane-delete':
+            self.lanes.pop(op['id'], None)
+        elif kind == 'create':
+            if op['id'] not in self.passages:
+                self.passages[op['id']] = dict(op['passage'])
+                self.lanes[op['passage']['laneId']]['passages'].append(op['id'])
+                self.versions[op['id']] = op['version']
+        elif kind == 'delete':
+            passage = self.passages.pop(op['id'], None)
+            if passage is not None:
+                self.lanes[passage['laneId']]['passages'].remove(op['id'])
+            self.versions.pop(op['id'], None)
+        elif kind == 'update':
+            passage = self.passages.get(op['id'])
+            if passage is None or op['version'] <= self.versions.get(op['id'], 0):
+                return
+            fields = op.get('set', {})
+            if 'laneId' in fields and fields['laneId'] != passage['laneId']:
+                self.lanes[passage['laneId']]['passages'].remove(op['id'])
+                self.lanes[fields['laneId']]['passages'].append(op['id'])
+            passage.update(fields)
+            if op.get('splices'):
+                passage['content'] = apply_splices(passage['content'], op['splices'])
+            self.versions[op['id']] = op['version']
+
+    def apply_own(self, op, result):
+        """Apply an operation of ours that the server accepted"""
+        kind = op['op']
+        if kind == 'create':
+            passage = {'id': result['id'], 'title': op['title'], 'tags': op.get('tags', ''),
+                       'content': op.get('content', ''), 'laneId': op['laneId'],
+                       'x': op.get('x', 0), 'y': op.get('y', 0), 'relativeY': 0}
+            self.apply({'op': 'create', 'id': result['id'], 'passage': passage, 'version': result['version']})
+        elif kind == 'lane':
+            lane = dict(self.lanes.get(result['id'], {'isMetadata': False, 'collapsed': False}), id=result['id'])
+            lane.pop('passages', None)
+            lane.update({key: op[key] for key in ('name', 'collapsed') if key in op})
+            self.apply({'op': 'lane', 'lane': lane})
+        elif kind in ('delete', 'lane-delete'):
+            self.apply({'op': kind, 'id': op['id']})
+        elif kind == 'relane':
+            self.apply({'op': 'update', 'id': op['id'], 'version': result['version'], 'set': {'laneId': op['laneId']}})
+        else:
+            fields, splices = field_changes(op)
+            self.apply({'op': 'update', 'id': op['id'], 'version': result['version'],
+                        'set': fields, 'splices': splices})
+
+    def state(self):
+        """Comparable view: passages, and lanes with their members as sets"""
+        lanes = {lane_id: (lane.get('name'), lane.get('collapsed'), frozenset(lane['passages']))
+                 for lane_id, lane in self.lanes.items()}
+        return self.passages, lanes
+
+
+# Simulated clients
+
+async def http_request(reader, writer, method, path, data=None):
+    body = dumps(data).encode('utf-8') if data is not None else b''
+    writer.write((f'{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+                  f'Content-Length: {len(body)}\r\n\r\n').encode('latin-1') + body)
+    await writer.drain()
+    head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1')
+    status = int(head.split(' ', 2)[1])
+    length = int(re.search(r'(?im)^content-length:\s*(\d+)', head).group(1))
+    return status, json.loads(await reader.readexactly(length))
+
+
+class SimulatedClient:
+    """Types into passages at a steady rate, mostly in bursts on one passage at a time"""
+
+    def __init__(self, name, host, port, project_id, rng, hot_passages=8):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.project_id = project_id
+        self.rng = rng
+        self.hot_passages = hot_passages
+        self.replica = None
+        self.current = None
+        self.cursor = 0
+        self.stats = {'sent': 0, 'accepted': 0, 'conflicts': 0, 'errors': 0, 'received': 0, 'bytesReceived': 0}
+        self.stream_task = None
+        self.stream_writer = None
+        self.synced = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        status, snapshot = await http_request(self.reader, self.writer, 'GET', f'/api/collab/{self.project_id}')
+        self.replica = Replica(snapshot)
+        self.stream_task = asyncio.create_task(self.listen(snapshot['version']))
+
+    async def listen(self, since):
+        reader, self.stream_writer = await asyncio.open_connection(self.host, self.port)
+        self.stream_writer.write((f'GET /api/collab/{self.project_id}/events?client={self.name}&since={since} '
+                                  f'HTTP/1.1\r\nHost: localhost\r\n\r\n').encode('latin-1'))
+        await reader.readuntil(b'\r\n\r\n')
+        while True:
+            try:
+                event = await reader.readuntil(b'\n\n')
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return
+            self.stats['bytesReceived'] += len(event)
+            fields = dict(line.split(': ', 1) for line in event.decode('utf-8').splitlines() if ': ' in line)
+            if fields.get('event') == 'ops':
+                batch = json.loads(fields['data'])
+                for op in batch['ops']:
+                    self.replica.apply(op)
+                    self.stats['received'] += 1
+                self.replica.version = batch['version']
+
+    def next_op(self):
+        rng = self.rng
+        replica = self.replica
+        passage_ids = list(replica.passages)
+        lane_ids = [lane_id for lane_id, lane in replica.lanes.items() if not lane.get('isMetadata')]
+        roll = rng.random()
+
+        if self.current not in replica.passages or rng.random() < 0.02:
+            # Mostly the first few passages, so clients run into each other
+            pool = passage_ids[:self.hot_passages] if rng.random() < 0.5 else passage_ids
+            self.current = rng.choice(pool) if pool else None
+            if self.current is not None:
+                self.cursor = rng.randint(0, utf16_len(replica.passages[self.current]['content']))
+
+        if self.current is None or roll < 0.02:
+            return {'op': 'create', 'title': f'{self.name} {rng.randrange(10 ** 6)}', 'laneId': rng.choice(lane_ids)}
+
+        passage = replica.passages[self.current]
+        base = replica.versions.get(self.current, 0)
+        length = utf16_len(passage['content'])
+        self.cursor = min(self.cursor, length)
+
+        if roll < 0.04:
+            return {'op': 'move', 'id': self.current, 'base': base,
+                    'x': rng.randrange(2000), 'y': rng.randrange(2000)}
+        if roll < 0.05:
+            return {'op': 'retag', 'id': self.current, 'base': base, 'tags': rng.choice(['', 'draft', 'done'])}
+        if roll < 0.06:
+            return {'op': 'relane', 'id': self.current, 'base': base, 'laneId': rng.choice(lane_ids)}
+        if roll < 0.062:
+            return {'op': 'delete', 'id': self.current, 'base': base}
+        if roll < 0.15 and self.cursor > 0:
+            # Backspace over one character (one or two UTF-16 units)
+            text = passage['content']
+            index = utf16_index(text, self.cursor)
+            remove = utf16_len(text[index - 1]) if index > 0 else 1
+            self.cursor -= remove
+            return {'op': 'edit', 'id': self.current, 'base': base, 'splices': [[self.cursor, remove, '']]}
+
+        char = rng.choice('abcdefghijklmnopqrstuvwxyz    .é🙂')
+        splice = [self.cursor, 0, char]
+        self.cursor += utf16_len(char)
+        return {'op': 'edit', 'id': self.current, 'base': base, 'splices': [splice]}
+
+    async def run(self, seconds, rate):
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            op = self.next_op()
+            status, response = await http_request(self.reader, self.writer, 'POST',
+                                                  f'/api/collab/{self.project_id}/ops',
+                                                  {'client': self.name, 'ops': [op]})
+            self.stats['sent'] += 1
+            result = response['results'][0]
+            if result['ok']:
+                self.stats['accepted'] += 1
+                self.replica.apply_own(op, result)
+            elif result['error'] == 'conflict':
+                # Drop the keystroke; the stream brings the other client's change
+                self.stats['conflicts'] += 1
+                self.current = None
+            else:
+                self.stats['errors'] += 1
+                self.current = None
+            await asyncio.sleep(self.rng.expovariate(rate))
+
+    async def close(self):
+        self.writer.close()
+        if self.stream_writer is not None:
+            self.stream_writer.close()
+        if self.stream_task is not None:
+            self.stream_task.cancel()
+
+
+def seed_project(store, project_id, passages, lanes=4, rng=None):
+    """Store a project of `passages` short passages spread over `lanes` lanes"""
+    rng = rng or random.Random(1)
+    project_lanes = [{'id': 'metadata', 'name': 'Metadata', 'isMetadata': True, 'passages': [], 'collapsed': False}]
+    project_lanes += [{'id': f'lane_{i}', 'name': 'Main' if i == 1 else f'Lane {i}', 'isMetadata': False,
+                       'passages': [], 'collapsed': False} for i in range(1, lanes + 1)]
+    entries = []
+    for index in range(1, passages + 1):
+        lane = project_lanes[1 + index % lanes]
+        passage_id = f'passage_{index}'
+        content = ' '.join(rng.choice(['the', 'door', 'opens', 'onto', 'a', 'corridor']) for _ in range(30))
+        entries.append([passage_id, {'id': passage_id, 'title': f'Passage {index}', 'tags': '',
+                                     'content': f'{content} [[Passage {index % passages + 1}]]',
+                                     'laneId': lane['id'], 'x': 0, 'y': 0, 'relativeY': 0}])
+        lane['passages'].append(passage_id)
+    store.save(project_id, {'lanes': project_lanes, 'passages': entries,
+                            'nextPassageId': passages + 1, 'nextLaneId': lanes + 1})
+
+
+async def simulate(args):
+    server = None
+    store = None
+    if args.connect:
+        host, port = args.connect.rsplit(':', 1)
+        port = int(port)
+    else:
+        store = ProjectStore(tempfile.mkdtemp(prefix='branched-collab-'))
+        seed_project(store, args.project, args.passages)
+        server = CollabServer(store, args.batch_ms / 1000)
+        listener = await server.start('127.0.0.1', 0)
+        host, port = '127.0.0.1', listener.sockets[0].getsockname()[1]
+
+    rng = random.Random(args.seed)
+    clients = [SimulatedClient(f'client{i}', host, port, args.project, random.Random(rng.random()))
+               for i in range(args.clients)]
+    for client in clients:
+        await client.connect()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client.run(args.seconds, args.rate) for client in clients))
+    elapsed = time.perf_counter() - started
+
+    # Let the last batches reach everyone, then compare against a fresh snapshot
+    await asyncio.sleep(args.batch_ms / 1000 * 4 + 0.2)
+    reader, writer = await asyncio.open_connection(host, port)
+    _, snapshot = await http_request(reader, writer, 'GET', f'/api/collab/{args.project}')
+    writer.close()
+    await asyncio.sleep(args.batch_ms / 1000 * 4 + 0.2)
+    expected = Replica(snapshot).state()
+    diverged = [client.name for client in clients if client.replica.state() != expected]
+
+    for client in clients:
+        await client.close()
+
+    sent = sum(client.stats['sent'] for client in clients)
+    report = {
+        'clients': args.clients,
+        'passages': len(snapshot['passages']),
+        'seconds': round(elapsed, 3),
+        'opsSent': sent,
+        'accepted': sum(client.stats['accepted'] for client in clients),
+        'conflicts': sum(client.stats['conflicts'] for client in clients),
+        'errors': sum(client.stats['errors'] for client in clients),
+        'opsReceived': sum(client.stats['received'] for client in clients),
+        'bytesReceivedPerClient': round(sum(client.stats['bytesReceived'] for client in clients) / len(clients)),
+        'diverged': diverged
+    }
+    if server is not None:
+        session = server.sessions[args.project]
+        report['server'] = dict(session.stats, seconds=round(session.stats['seconds'], 6),
+                                microsecondsPerOp=round(session.stats['seconds'] / max(sent, 1) * 1e6, 1))
+        await server.close()
+        store.close()
+        shutil.rmtree(store.folder, ignore_errors=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate clients editing one project through the collaboration server')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    sim = commands.add_parser('simulate', help='edit one project from several simulated clients')
+    sim.add_argument('--clients', type=int, default=5, help='simulated clients (default: %(default)s)')
+    sim.add_argument('--seconds', type=float, default=5, help='how long each client types (default: %(default)s)')
+    sim.add_argument('--rate', type=float, default=20, help='operations per second per client (default: %(default)s)')
+    sim.add_argument('--passages', type=int, default=200, help='size of the seeded project (default: %(default)s)')
+    sim.add_argument('--project', default='collab-sim', help='project id (default: %(default)s)')
+    sim.add_argument('--batch-ms', type=float, default=BATCH_INTERVAL * 1000,
+                     help='batch interval of the in-process server (default: %(default)s)')
+    sim.add_argument('--connect', help='host:port of the backend\'s collaboration server instead of an in-process one')
+    sim.add_argument('--seed', type=int, default=1, help='random seed (default: %(default)s)')
+    sim.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    report = asyncio.run(simulate(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{report['clients']} clients, {report['passages']} passages, {report['seconds']:.1f}s: "
+              f"{report['opsSent']} ops sent, {report['accepted']} accepted, {report['conflicts']} conflicts, "
+              f"{report['errors']} errors")
+        print(f"{report['opsReceived']} ops received, {report['bytesReceivedPerClient'] / 1024:.1f} KiB per client")
+        if 'server' in report:
+            server = report['server']
+            print(f"server: {server['batches']} batches, {server['broadcast']} ops after coalescing, "
+                  f"{server['microsecondsPerOp']} us per op")
+        print('replicas converged' if not report['diverged'] else f"DIVERGED: {', '.join(report['diverged'])}")
+    return 1 if report['diverged'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
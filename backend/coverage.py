@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Story coverage - exact path counts and Monte Carlo playthroughs
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from graph import iter_link_targets, is_start_passage
+from lint import StoryLinter
+from preview import Program, evaluate_condition, initial_variables, parse_assignment
+from model import passage_record
+from twee import TweeParser
+
+# Playthroughs that haven't reached an ending after this many steps are cut off
+DEFAULT_MAX_STEPS = 1000
+
+# Walks per task handed to a worker process
+BATCH_SIZE = 10000
+
+
+class WalkGraph:
+    """Integer-indexed copy of a story's link graph for fast random walks.
+
+    Passages whose links sit inside <<if>> sections, or that <<set>>
+    variables, keep a small program of (condition, targets, assignments)
+    steps; every other passage is just a list of successor indexes. Only
+    plain ints, tuples and lists are kept so it pickles cheaply to workers.
+    """
+
+    def __init__(self, data, start=None):
+        passages = [passage_record(item) for item in data.get('passages', [])]
+        self.linter = StoryLinter(data)
+        self.ids = [passage['id'] for passage in passages]
+        self.index = {passage_id: i for i, passage_id in enumerate(self.ids)}
+        self.successors = [[self.index[target] for target in self.linter.outgoing[passage_id]]
+                           for passage_id in self.ids]
+        self.variables = initial_variables(passages)
+
+        self.programs = {}
+        for i, passage in enumerate(passages):
+            program = Program(passage.get('content') or '')
+            if any(step[0] == 'branch' or step[2] for step in program.instructions):
+                self.programs[i] = self.compile_program(program, passage.get('laneId'))
+
+        if start is None:
+            roots = [i for i, passage in enumerate(passages) if is_start_passage(passage)]
+        else:
+            roots = [i for i, passage in enumerate(passages) if start in (passage['id'], passage.get('title'))]
+        self.start = roots[0] if roots else None
+
+    def resolve_all(self, text, lane_id):
+        targets = []
+        for title in iter_link_targets(text):
+            target_id = self.linter.resolve(title, lane_id)
+            if target_id is not None:
+                targets.append(self.index[target_id])
+        return targets
+
+    def compile_program(self, program, lane_id):
+        steps = []
+        for instruction in program.instructions:
+            if instruction[0] == 'text':
+                _, text, sets = instruction
+                steps.append((None, [(True, self.resolve_all(text, lane_id), sets)]))
+            else:
+                steps.append((True, [(condition, self.resolve_all(text, lane_id), sets)
+                                     for condition, text, sets in instruction[1]]))
+        return steps
+
+    def payload(self):
+        return self.successors, self.programs, self.start
+
+    def count_paths(self):
+        """Exact route counts from the start passage over the condensed graph.
+
+        Every strongly connected component is collapsed to one node, so a
+        loop counts once rather than forever, and a memoized pass in
+        topological order adds up the routes into each component. Returns
+        {passage_id: count} for every reachable passage.
+        """
+        if self.start is None:
+            return {}
+
+        start_id = self.ids[self.start]
+        components, reachable = self.linter.components([start_id])
+        component_of = {}
+        for number, component in enumerate(components):
+            for passage_id in component:
+                component_of[passage_id] = number
+
+        # Tarjan emits components in reverse topological order
+        counts = [0] * len(components)
+        counts[component_of[start_id]] = 1
+        for number in range(len(components) - 1, -1, -1):
+            if not counts[number]:
+                continue
+            targets = set()
+            for passage_id in components[number]:
+                for target_id in self.linter.outgoing.get(passage_id, ()):
+                    target = component_of[target_id]
+                    if target != number:
+                        targets.add(target)
+            for target in targets:
+                counts[target] += counts[number]
+
+        return {passage_id: counts[component_of[passage_id]]
+                for passage_id in self.ids if passage_id in reachable}
+
+
+def run_program(steps, state):
+    """Links available from a conditional passage; applies its <<set>>s to state"""
+    targets = []
+    for branch, sections in steps:
+        for condition, links, sets in sections:
+            if branch is None or condition is None or evaluate_condition(condition, state):
+                targets.extend(links)
+                if sets:
+                    state.update(sets)
+                break
+    return targets
+
+
+def simulate_batch(payload, variables, walks, seed, max_steps):
+    """Worker: run a batch of random playthroughs and return the tallies"""
+    successors, programs, start = payload
+    rng = random.Random(seed).random
+
+    visits = [0] * len(successors)
+    endings = {}
+    truncated = 0
+
+    for _ in range(walks):
+        state = dict(variables) if programs else None
+        node = start
+        seen = {node}
+        for _ in range(max_steps):
+            steps = programs.get(node)
+            choices = successors[node] if steps is None else run_program(steps, state)
+            if not choices:
+                endings[node] = endings.get(node, 0) + 1
+                break
+            node = choices[int(rng() * len(choices))]
+            seen.add(node)
+        else:
+            truncated += 1
+        for passage in seen:
+            visits[passage] += 1
+
+    return visits, endings, truncated
+
+
+def simulate(graph, playthroughs, variables=None, seed=1, max_steps=DEFAULT_MAX_STEPS, workers=None):
+    """Run playthroughs in batches across a process pool and merge the tallies"""
+    state = dict(graph.variables, **(variables or {}))
+    payload = graph.payload()
+    batches = [min(BATCH_SIZE, playthroughs - offset) for offset in range(0, playthroughs, BATCH_SIZE)]
+    args = [(payload, state, walks, seed * 1000003 + number, max_steps)
+            for number, walks in enumerate(batches)]
+
+    if workers == 1 or len(batches) <= 1:
+        results = [simulate_batch(*arg) for arg in args]
+    else:
+        # Ship the graph once per worker rather than once per batch
+        with ProcessPoolExecutor(max_workers=workers, initializer=set_worker_payload,
+                                 initargs=(payload,)) as pool:
+            results = list(pool.map(simulate_worker_batch, [arg[1:] for arg in args]))
+
+    visits = [0] * len(graph.ids)
+    endings = {}
+    truncated = 0
+    for batch_visits, batch_endings, batch_truncated in results:
+        for i, count in enumerate(batch_visits):
+            if count:
+                visits[i] += count
+        for node, count in batch_endings.items():
+            endings[node] = endings.get(node, 0) + count
+        truncated += batch_truncated
+
+    return visits, endings, truncated
+
+
+worker_payload = None
+
+
+def set_worker_payload(payload):
+    global worker_payload
+    worker_payload = payload
+
+
+def simulate_worker_batch(args):
+    return simulate_batch(worker_payload, *args)
+
+
+def analyze(data, playthroughs=10000, variables=None, seed=1, max_steps=DEFAULT_MAX_STEPS,
+            workers=None, start=None):
+    """Path counts and simulated visit/ending frequencies for a story"""
+    started = time.perf_counter()
+    graph = WalkGraph(data, start)
+    if graph.start is None:
+        raise ValueError('No start passage found')
+
+    paths = graph.count_paths()
+    endings = [passage_id for passage_id in paths if not graph.successors[graph.index[passage_id]]]
+
+    report = {
+        'start': graph.ids[graph.start],
+        'paths': {
+            # Strings, since route counts quickly outgrow JavaScript numbers
+            'total': str(sum(paths[passage_id] for passage_id in endings)),
+            'endings': {passage_id: str(paths[passage_id]) for passage_id in endings},
+            'passages': {passage_id: str(count) for passage_id, count in paths.items()}
+        }
+    }
+
+    if playthroughs:
+        visits, ending_counts, truncated = simulate(graph, playthroughs, variables, seed, max_steps, workers)
+        report['simulation'] = {
+            'playthroughs': playthroughs,
+            'maxSteps': max_steps,
+            'visits': {graph.ids[i]: count / playthroughs for i, count in enumerate(visits) if count},
+            'endings': {graph.ids[node]: count / playthroughs for node, count in
+                        sorted(ending_counts.items(), key=lambda item: -item[1])},
+            'truncated': truncated / playthroughs,
+            'unvisited': [graph.ids[i] for i, count in enumerate(visits)
+                          if not count and graph.ids[i] in paths]
+        }
+
+    report['seconds'] = round(time.perf_counter() - started, 6)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Count routes through a Twee story and simulate playthroughs')
+    parser.add_argument('file', help='.twee file to analyze')
+    parser.add_argument('-n', '--playthroughs', type=int, default=10000)
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--max-steps', type=int, default=DEFAULT_MAX_STEPS)
+    parser.add_argument('--start', help='title of the passage to start from (default: Start/$start)')
+    parser.add_argument('--var', action='append', default=[], metavar='$NAME=VALUE',
+                        help='set a variable before playing')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--rare', type=int, default=10, help='how many least visited passages to list')
+    parser.add_argument('-o', '--output', help='write the full report as JSON')
+    args = parser.parse_args()
+
+    with open(args.file, 'r', encoding='utf-8') as f:
+        data = TweeParser().parse_story(f)
+    titles = {passage['id']: passage['title'] for passage in data['passages']}
+
+    try:
+        report = analyze(data, args.playthroughs, dict(parse_assignment(text) for text in args.var),
+                         args.seed, args.max_steps, args.workers, args.start)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+
+    print(f"{report['paths']['total']} distinct routes from \"{titles[report['start']]}\" "
+          f"to {len(report['paths']['endings'])} endings")
+    for passage_id, count in report['paths']['endings'].items():
+        reached = report.get('simulation', {}).get('endings', {}).get(passage_id, 0)
+        print(f"  {titles[passage_id]:<30} {count:>20} routes  {reached * 100:6.2f}% of playthroughs")
+
+    simulation = report.get('simulation')
+    if simulation:
+        rare = sorted(simulation['visits'].items(), key=lambda item: item[1])[:args.rare]
+        print(f"{simulation['playthroughs']} playthroughs, {simulation['truncated'] * 100:.2f}% cut off "
+              f"after {simulation['maxSteps']} steps, {len(simulation['unvisited'])} reachable passages never visited")
+        for passage_id, frequency in rare:
+            print(f"  {titles[passage_id]:<30} visited in {frequency * 100:6.2f}%")
+    print(f"Done in {report['seconds']:.2f}s using {args.workers or os.cpu_count()} workers")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
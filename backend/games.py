@@ -0,0 +1,46 @@
+import json
+
+CONFIG_FILE = 'game_config.json'
+
+
+def iter_games(games_dir):
+    """(game_dir, config_file, config) for each game folder, in directory order.
+
+    `config` is None when the folder has no readable game_config.json.
+    """
+    if not games_dir.exists():
+        return
+
+    for game_dir in games_dir.iterdir():
+        if not game_dir.is_dir():
+            continue
+
+        config_file = game_dir / CONFIG_FILE
+        config = None
+        if config_file.exists():
+            try:
+                with open(config_file, 'r') as f:
+                    config = json.load(f)
+            except Exception as e:
+                print(f"Error reading {config_file}: {e}")
+        yield game_dir, config_file, config
+
+
+def game_name(game_dir, config):
+    return config.get('title', config.get('game_name', game_dir.name))
+
+
+def find_story_file(game_dir, config):
+    """Path of the game's main .twee file from story_settings.main_story_file, or None"""
+    story_file_path = (config or {}).get('story_settings', {}).get('main_story_file')
+    if not story_file_path:
+        return None
+
+    # Handle both absolute and relative paths
+    if story_file_path.startswith('data/'):
+        story_file_path = story_file_path[5:]  # Remove 'data/' prefix
+
+    story_file = game_dir / story_file_path
+    if story_file.exists() and story_file.suffix == '.twee':
+        return story_file
+    return None
@@ -0,0 +1,224 @@
+import re
+from collections import deque
+
+LINK_REGEX = re.compile(r'\[\[([^\]]+)\]\]')
+
+
+def link_target(link_text):
+    """Return the passage title a [[...]] link points at"""
+    if '|' in link_text:
+        # [[display text|passage name]]
+        return link_text.split('|')[-1].strip()
+    if '->' in link_text:
+        # [[display text->passage name]]
+        return link_text.rsplit('->', 1)[1].strip()
+    if '<-' in link_text:
+        # [[passage name<-display text]]
+        return link_text.split('<-', 1)[0].strip()
+    return link_text.strip()
+
+
+def iter_link_targets(content):
+    for match in LINK_REGEX.finditer(content or ''):
+        yield link_target(match.group(1))
+
+
+def is_start_passage(passage):
+    return passage.get('title') == 'Start' or '$start' in (passage.get('tags') or '')
+
+
+class StoryGraph:
+    """Link graph over a story's passages and lanes.
+
+    Titles are indexed by (laneId, title) and by title so each link is
+    resolved with two dict lookups, same lane first, like extractLinks().
+    """
+
+    def __init__(self, data, compute_depths=True):
+        self.passages = {}
+        self.lanes = list(data.get('lanes', []))
+        self.lane_passages = {lane['id']: [] for lane in self.lanes}
+        self.by_lane_title = {}
+        self.by_title = {}
+
+        for passage in data.get('passages', []):
+            passage_id = passage['id']
+            lane_id = passage.get('laneId')
+            title = passage.get('title')
+
+            self.passages[passage_id] = passage
+            self.lane_passages.setdefault(lane_id, []).append(passage_id)
+            self.by_lane_title.setdefault((lane_id, title), passage_id)
+            self.by_title.setdefault(title, passage_id)
+
+        # Honour the client's lane ordering when it sends one
+        for lane in self.lanes:
+            if lane.get('passages'):
+                self.lane_passages[lane['id']] = [
+                    passage_id for passage_id in lane['passages']
+                    if passage_id in self.passages
+                ]
+
+        self.links = []
+        self.outgoing = {}
+        self.incoming = {}
+        self.extract_links()
+
+        # Callers that cache per-lane depths (see layout.py) fill this in
+        self.depths = {}
+        if compute_depths:
+            for lane in self.lanes:
+                self.depths.update(self.calculate_depths(lane['id']))
+
+    def resolve(self, title, lane_id):
+        """Find a passage by title, preferring the given lane"""
+        passage_id = self.by_lane_title.get((lane_id, title))
+        if passage_id is None:
+            passage_id = self.by_title.get(title)
+        return passage_id
+
+    def extract_links(self):
+        for passage_id, passage in self.passages.items():
+            for target_title in iter_link_targets(passage.get('content')):
+                target_id = self.resolve(target_title, passage.get('laneId'))
+                if target_id is not None:
+                    self.links.append({'from': passage_id, 'to': target_id})
+                    self.outgoing.setdefault(passage_id, []).append(target_id)
+                    self.incoming.setdefault(target_id, []).append(passage_id)
+
+    def lane_children(self, passage_id, lane_id):
+        for target_id in self.outgoing.get(passage_id, ()):
+            if self.passages[target_id].get('laneId') == lane_id:
+                yield target_id
+
+    def calculate_depths(self, lane_id):
+        """Port of calculatePassageDepths() for a single lane"""
+        lane_ids = self.lane_passages.get(lane_id, [])
+
+        # First pass: BFS from Start (or from passages with no incoming
+        # in-lane link) to find backward and same-level links
+        temp_depths = {}
+        temp_queue = deque()
+
+        for passage_id in lane_ids:
+            if is_start_passage(self.passages[passage_id]):
+                temp_queue.append(passage_id)
+                temp_depths[passage_id] = 0
+
+        if not temp_queue:
+            for passage_id in lane_ids:
+                if passage_id not in self.incoming:
+                    temp_queue.append(passage_id)
+                    temp_depths[passage_id] = 0
+
+        backward_links = set()
+        while temp_queue:
+            current = temp_queue.popleft()
+            current_depth = temp_depths[current]
+
+            for target_id in self.lane_children(current, lane_id):
+                if target_id not in temp_depths:
+                    temp_depths[target_id] = current_depth + 1
+                    temp_queue.append(target_id)
+                elif temp_depths[target_id] <= current_depth:
+                    backward_links.add((current, target_id))
+
+        # Forward-only graph inside the lane
+        forward_links = {passage_id: [] for passage_id in lane_ids}
+        incoming_count = dict.fromkeys(lane_ids, 0)
+
+        for passage_id in lane_ids:
+            seen = set()
+            for target_id in self.lane_children(passage_id, lane_id):
+                if (passage_id, target_id) in backward_links:
+                    continue
+                if target_id not in seen:
+                    seen.add(target_id)
+                    forward_links[passage_id].append(target_id)
+                if target_id in incoming_count:
+                    incoming_count[target_id] += 1
+
+        # BFS from roots assigning depths
+        depths = {}
+        queue = deque()
+
+        for passage_id in lane_ids:
+            if is_start_passage(self.passages[passage_id]) or incoming_count[passage_id] == 0:
+                queue.append(passage_id)
+                depths[passage_id] = 0
+
+        while queue:
+            current = queue.popleft()
+            current_depth = depths[current]
+
+            for child_id in forward_links.get(current, ()):
+                if child_id not in depths:
+                    depths[child_id] = current_depth + 1
+                    queue.append(child_id)
+                elif current_depth + 1 > depths[child_id]:
+                    # Longer path found, but don't re-queue to avoid loops
+                    depths[child_id] = current_depth + 1
+
+        for passage_id in lane_ids:
+            depths.setdefault(passage_id, 0)
+
+        return depths
+
+    def classify_links(self):
+        """Split links into backward (same lane, back to a root) and cross-lane"""
+        backward_links = []
+        cross_lane_links = []
+
+        for link in self.links:
+            from_passage = self.passages[link['from']]
+            to_passage = self.passages[link['to']]
+
+            if from_passage.get('laneId') != to_passage.get('laneId'):
+                cross_lane_links.append(link)
+            else:
+                from_depth = self.depths.get(link['from'], 0)
+                to_depth = self.depths.get(link['to'], 0)
+
+                if from_depth >= to_depth and to_depth == 0:
+                    backward_links.append(link)
+
+        return backward_links, cross_lane_links
+
+    def to_dict(self):
+        backward_links, cross_lane_links = self.classify_links()
+        lane_names = {lane['id']: lane.get('name') for lane in self.lanes}
+
+        loop_passages = []
+        for link in backward_links:
+            loop_passages.append({
+                'id': f"loop_{link['from']}_{link['to']}",
+                'type': 'loop',
+                'fromId': link['from'],
+                'toId': link['to'],
+                'toTitle': self.passages[link['to']].get('title'),
+                'laneId': self.passages[link['from']].get('laneId')
+            })
+
+        jump_passages = []
+        for link in cross_lane_links:
+            to_lane_id = self.passages[link['to']].get('laneId')
+            if to_lane_id not in lane_names:
+                continue
+            jump_passages.append({
+                'id': f"jump_{link['from']}_{link['to']}",
+                'type': 'jump',
+                'fromId': link['from'],
+                'toId': link['to'],
+                'toTitle': self.passages[link['to']].get('title'),
+                'toLaneName': lane_names[to_lane_id],
+                'laneId': self.passages[link['from']].get('laneId')
+            })
+
+        return {
+            'links': self.links,
+            'backwardLinks': backward_links,
+            'crossLaneLinks': cross_lane_links,
+            'depths': self.depths,
+            'loopPassages': loop_passages,
+            'jumpPassages': jump_passages
+        }
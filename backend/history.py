@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Project history - content-addressed version history for saved projects
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from store import dumps, passage_key
+
+# Versions are only deleted once they are both outside the newest
+# KEEP_VERSIONS of their project and older than KEEP_DAYS
+KEEP_VERSIONS = int(os.environ.get('BRANCHED_HISTORY_KEEP_VERSIONS', 200))
+KEEP_DAYS = float(os.environ.get('BRANCHED_HISTORY_KEEP_DAYS', 30))
+
+# Flask backend the command line talks to; it owns uploads/history
+BACKEND_URL = os.environ.get('BRANCHED_BACKEND_URL', 'http://localhost:5000')
+
+
+class ProjectHistory:
+    """Version history where passages are stored once as content-hashed blobs.
+
+    history/blobs.pack holds each distinct passage, lane and set of project
+    fields once, as a `<hash> <length>` line followed by the JSON. Blobs
+    are shared by every version and project that contains them.
+    history/<project id>/<version>.json is a manifest listing the blob
+    hashes of one version, so a save only appends the passages it changed.
+    Old manifests are dropped by retention, and gc() rewrites the pack
+    without the blobs no manifest references any more.
+
+    Only one process may open a history folder: the offsets index lives in
+    memory and gc() replaces the pack. Everything else goes through the
+    process that owns it (see main()).
+    """
+
+    def __init__(self, folder, keep_versions=KEEP_VERSIONS, keep_days=KEEP_DAYS):
+        self.folder = folder
+        self.pack_path = os.path.join(folder, 'blobs.pack')
+        self.keep_versions = keep_versions
+        self.keep_days = keep_days
+        self.latest = {}
+        self.lock = threading.RLock()
+
+        os.makedirs(folder, exist_ok=True)
+        self.pack = open(self.pack_path, 'a+b')
+        self.offsets = self.read_pack_index()
+
+    def read_pack_index(self):
+        """hash -> (offset, length) for every blob, dropping a torn final record"""
+        offsets = {}
+        self.pack.seek(0)
+        position = 0
+        while True:
+            header = self.pack.readline()
+            try:
+                digest, length = header.decode('ascii').split()
+                length = int(length)
+            except ValueError:
+                break
+            start = position + len(header)
+            if start + length + 1 > os.fstat(self.pack.fileno()).st_size:
+                break
+            offsets[digest] = (start, length)
+            position = start + length + 1
+            self.pack.seek(position)
+
+        self.pack.truncate(position)
+        return offsets
+
+    def put_blob(self, value):
+        """Append value unless an identical blob is stored; returns its hash"""
+        text = dumps(value).encode('utf-8')
+        digest = hashlib.blake2b(text, digest_size=16).hexdigest()
+        if digest in self.offsets:
+            return digest
+
+        header = f'{digest} {len(text)}\n'.encode('ascii')
+        self.pack.seek(0, os.SEEK_END)
+        start = self.pack.tell() + len(header)
+        self.pack.write(header + text + b'\n')
+        self.offsets[digest] = (start, len(text))
+        return digest
+
+    def get_blob(self, digest):
+        # gc() swaps the pack and its offsets, so both are read under the lock
+        with self.lock:
+            start, length = self.offsets[digest]
+            return json.loads(os.pread(self.pack.fileno(), length, start))
+
+    def project_folder(self, project_id):
+        return os.path.join(self.folder, project_id)
+
+    def manifest_path(self, project_id, version):
+        return os.path.join(self.project_folder(project_id), f'{version:08d}.json')
+
+    def versions(self, project_id):
+        """Version numbers of a project, oldest first"""
+        try:
+            names = os.listdir(self.project_folder(project_id))
+        except OSError:
+            return []
+        return sorted(int(name[:-5]) for name in names if name.endswith('.json') and name[:-5].isdigit())
+
+    def read_manifest(self, project_id, version):
+        try:
+            with open(self.manifest_path(project_id, version), 'r') as f:
+                return json.load(f)
+        except OSError:
+            return None
+
+    def latest_manifest(self, project_id):
+        """(newest manifest, whether the last save was recorded by this process)"""
+        if project_id not in self.latest:
+            versions = self.versions(project_id)
+            manifest = self.read_manifest(project_id, versions[-1]) if versions else None
+            # Saves made before a restart may not have been recorded, so the
+            # next delta isn't relative to this manifest
+            self.latest[project_id] = (manifest, False)
+        return self.latest[project_id]
+
+    def record(self, project_id, data, delta=None):
+        """Store data as a new version and return its number.
+
+        `delta` is what ProjectStore.save() returned; passages it doesn't
+        mention keep the hash they had in the previous version, so only
+        changed passages are serialized and hashed. Returns None when
+        nothing changed.
+        """
+        with self.lock:
+            previous, trusted = self.latest_manifest(project_id)
+            if previous is not None and delta is not None and not delta:
+                return None
+
+            known = {}
+            changed = None
+            if previous is not None and trusted and delta is not None:
+                known = dict(previous['passages'])
+                changed = set(delta.get('put', {}))
+
+            passages = []
+            for passage in data.get('passages', []):
+                key = passage_key(passage)
+                digest = known.get(key)
+                if digest is None or changed is None or key in changed:
+                    digest = self.put_blob(passage)
+                passages.append([key, digest])
+
+            fields = {key: value for key, value in data.items() if key not in ('passages', 'lanes')}
+            version = previous['version'] + 1 if previous is not None else 1
+            manifest = {
+                'version': version,
+                'time': time.time(),
+                'fields': self.put_blob(fields),
+                'lanes': [self.put_blob(lane) for lane in data.get('lanes', [])],
+                'passages': passages,
+                'changes': (len(delta.get('put', {})) + len(delta.get('remove', []))
+                            if delta is not None and previous is not None else len(passages))
+            }
+
+            # Blobs must be on disk before a manifest refers to them
+            self.pack.flush()
+            os.fsync(self.pack.fileno())
+
+            os.makedirs(self.project_folder(project_id), exist_ok=True)
+            path = self.manifest_path(project_id, version)
+            with open(f'{path}.tmp', 'w') as f:
+                f.write(dumps(manifest))
+            os.replace(f'{path}.tmp', path)
+            self.latest[project_id] = (manifest, True)
+
+            self.apply_retention(project_id)
+            return version
+
+    def history(self, project_id):
+        """Summary of each stored version, newest first"""
+        summaries = []
+        for version in reversed(self.versions(project_id)):
+            manifest = self.read_manifest(project_id, version)
+            if manifest is None:
+                continue
+            summaries.append({
+                'version': version,
+                'time': manifest['time'],
+                'passages': len(manifest['passages']),
+                'lanes': len(manifest['lanes']),
+                'changes': manifest['changes']
+            })
+        return summaries
+
+    def load(self, project_id, version):
+        """Rebuild the project as saved in a version, or None"""
+        # Held from the manifest to the last blob so gc() can't drop the
+        # version's blobs part way through
+        with self.lock:
+            manifest = self.read_manifest(project_id, version)
+            if manifest is None:
+                return None
+
+            project = self.get_blob(manifest['fields'])
+            project['lanes'] = [self.get_blob(digest) for digest in manifest['lanes']]
+            project['passages'] = [self.get_blob(digest) for _, digest in manifest['passages']]
+            return project
+
+    def apply_retention(self, project_id):
+        """Drop manifests outside both the newest keep_versions and keep_days"""
+        versions = self.versions(project_id)
+        cutoff = time.time() - self.keep_days * 86400
+        for version in versions[:-self.keep_versions] if self.keep_versions else versions[:-1]:
+            path = self.manifest_path(project_id, version)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def gc(self):
+        """Apply retention to every project and rewrite the pack without unreferenced blobs"""
+        with self.lock:
+            referenced = set()
+            projects = [name for name in os.listdir(self.folder)
+                        if os.path.isdir(os.path.join(self.folder, name))]
+            for project_id in projects:
+                self.apply_retention(project_id)
+                for version in self.versions(project_id):
+                    manifest = self.read_manifest(project_id, version)
+                    if manifest is None:
+                        continue
+                    referenced.add(manifest['fields'])
+                    referenced.update(manifest['lanes'])
+                    referenced.update(digest for _, digest in manifest['passages'])
+
+            self.pack.flush()
+            before = os.path.getsize(self.pack_path)
+            removed = len(self.offsets) - len(referenced & self.offsets.keys())
+            if removed:
+                tmp_path = f'{self.pack_path}.tmp'
+                with open(tmp_path, 'wb') as f:
+                    for digest, (start, length) in self.offsets.items():
+                        if digest in referenced:
+                            f.write(f'{digest} {length}\n'.encode('ascii'))
+                            f.write(os.pread(self.pack.fileno(), length, start) + b'\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.pack_path)
+
+                self.pack.close()
+                self.pack = open(self.pack_path, 'a+b')
+                self.offsets = self.read_pack_index()
+
+            return {
+                'projects': len(projects),
+                'blobs': len(self.offsets),
+                'removed': removed,
+                'freedBytes': before - os.path.getsize(self.pack_path)
+            }
+
+
+def request_backend(server, method, path):
+    """JSON response of the backend that owns the history folder"""
+    request = urllib.request.Request(server.rstrip('/') + path, data=b'' if method == 'POST' else None,
+                                     method=method)
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.load(e).get('error', e.reason)
+        except ValueError:
+            message = e.reason
+        raise RuntimeError(message)
+    except urllib.error.URLError as e:
+        raise RuntimeError(f'cannot reach {server}: {e.reason}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or garbage collect saved project history')
+    parser.add_argument('command', choices=['log', 'gc'], help='list versions or collect garbage')
+    parser.add_argument('project', nargs='?', help='project id for log')
+    parser.add_argument('--server', default=BACKEND_URL, help='running backend (default: %(default)s)')
+    args = parser.parse_args()
+
+    # The backend keeps the pack open and indexed, so it does the work
+    try:
+        if args.command == 'gc':
+            result = request_backend(args.server, 'POST', '/api/history/gc')
+            print(f"{result['projects']} projects, {result['blobs']} blobs in use, "
+                  f"removed {result['removed']} ({result['freedBytes'] / 1024:.1f} KiB)")
+            return 0
+
+        if not args.project:
+            parser.error('log needs a project id')
+        result = request_backend(args.server, 'GET', f"/api/history/{urllib.parse.quote(args.project, safe='')}")
+    except RuntimeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    for entry in result['versions']:
+        print(f"{entry['version']:>6}  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['time']))}  "
+              f"{entry['passages']} passages, {entry['changes']} changed")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
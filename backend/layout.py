@@ -0,0 +1,251 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from graph import StoryGraph
+
+# Mirrors App.CONSTANTS in static/app.js
+CONSTANTS = {
+    'LANE_MIN_HEIGHT': 200,
+    'HEADER_HEIGHT': 40,
+    'COLLAPSED_LANE_HEIGHT': 40,
+    'PASSAGE_WIDTH': 150,
+    'PASSAGE_HEIGHT': 100,
+    'PASSAGE_SPACING': 20,
+    'PASSAGE_PADDING': 10,
+    'VERTICAL_SPACING': 15
+}
+
+# Metadata passages without links between them are laid out in rows of this size
+METADATA_PER_ROW = 5
+
+# Sticky notes beyond this many per source passage are stacked out of sight
+MAX_VISIBLE_STICKIES = 3
+STICKY_STACK_OFFSET = 8
+
+MAX_CACHED_LANES = 4096
+
+
+class LayoutEngine:
+    """Port of updatePassagePositions() with per-lane result caching.
+
+    A lane's layout only depends on its own passages, the links touching
+    them and the relativeY of cross-lane parents, so that is what the cache
+    key hashes. Passage text that doesn't change links leaves the key alone.
+    """
+
+    def __init__(self, constants=None, max_cached_lanes=MAX_CACHED_LANES):
+        self.c = dict(CONSTANTS, **(constants or {}))
+        self.max_cached_lanes = max_cached_lanes
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lane_key(self, graph, lane, lane_ids, relative_y):
+        parts = [lane['id'], bool(lane.get('isMetadata'))]
+        for passage_id in lane_ids:
+            passage = graph.passages[passage_id]
+            parts.append([
+                passage_id,
+                passage.get('title'),
+                passage.get('tags') or '',
+                graph.outgoing.get(passage_id, []),
+                [(parent_id, relative_y.get(parent_id, 0))
+                 for parent_id in graph.incoming.get(passage_id, [])
+                 if graph.passages[parent_id].get('laneId') != lane['id']]
+            ])
+        encoded = json.dumps(parts, separators=(',', ':')).encode('utf-8')
+        return hashlib.sha1(encoded).hexdigest()
+
+    def lane_height(self, lane, lane_ids, relative_y):
+        """Port of calculateLaneHeight()"""
+        if lane.get('collapsed'):
+            return self.c['COLLAPSED_LANE_HEIGHT']
+
+        min_y = 0
+        max_y = 0
+        for passage_id in lane_ids:
+            y = relative_y.get(passage_id, 0)
+            min_y = min(min_y, y)
+            max_y = max(max_y, y + self.c['PASSAGE_HEIGHT'])
+
+        total_height = (self.c['HEADER_HEIGHT'] + self.c['PASSAGE_PADDING'] * 3 +
+                        (max_y - min_y) + 20)
+        return max(self.c['LANE_MIN_HEIGHT'], total_height)
+
+    def layout_metadata_grid(self, lane_ids):
+        c = self.c
+        positions = {}
+        vertical_spacing = c['PASSAGE_HEIGHT'] + c['PASSAGE_SPACING']
+
+        for index, passage_id in enumerate(lane_ids):
+            row, column = divmod(index, METADATA_PER_ROW)
+            positions[passage_id] = (
+                c['PASSAGE_PADDING'] + column * (c['PASSAGE_WIDTH'] + c['PASSAGE_SPACING'] * 2),
+                c['PASSAGE_PADDING'] + row * vertical_spacing
+            )
+        return positions
+
+    def layout_lane(self, graph, lane, lane_ids, relative_y):
+        """Return ({passage_id: (x, relativeY)}, depths, is_grid) for one lane"""
+        c = self.c
+        lane_id = lane['id']
+        lane_set = set(lane_ids)
+
+        if lane.get('isMetadata'):
+            has_internal_links = any(
+                target_id in lane_set
+                for passage_id in lane_ids
+                for target_id in graph.outgoing.get(passage_id, ())
+            )
+            if not has_internal_links:
+                return self.layout_metadata_grid(lane_ids), graph.calculate_depths(lane_id), True
+
+        depths = graph.calculate_depths(lane_id)
+        column_width = c['PASSAGE_WIDTH'] + c['PASSAGE_SPACING'] * 8
+        row_height = c['PASSAGE_HEIGHT'] + c['VERTICAL_SPACING']
+
+        depth_groups = {}
+        for passage_id, depth in depths.items():
+            depth_groups.setdefault(depth, []).append(passage_id)
+
+        # Parents in this lane are positioned as we go; start from zero
+        lane_y = {passage_id: 0 for passage_id in lane_ids}
+        positions = {}
+
+        def parent_y(parent_id):
+            if parent_id in lane_y:
+                return lane_y[parent_id]
+            return relative_y.get(parent_id, 0)
+
+        # No cross-lane roots are laid out above the columns any more
+        top_y = c['PASSAGE_PADDING']
+
+        for depth in sorted(depth_groups):
+            current_x = c['PASSAGE_PADDING'] + depth * column_width
+
+            parent_groups = {}
+            for passage_id in depth_groups[depth]:
+                parents = graph.incoming.get(passage_id, [])
+                in_lane = [p for p in parents if graph.passages[p].get('laneId') == lane_id]
+                parents = in_lane or parents
+                parent_key = parents[0] if parents else 'root'
+                parent_groups.setdefault(parent_key, []).append(passage_id)
+
+            parent_keys = sorted(
+                parent_groups,
+                key=lambda key: (0, 0) if key == 'root' else (1, parent_y(key))
+            )
+
+            next_available_y = top_y + c['VERTICAL_SPACING'] if top_y > 0 else c['PASSAGE_PADDING']
+
+            for group_index, parent_key in enumerate(parent_keys):
+                if parent_key != 'root' and parent_key in graph.passages:
+                    current_y = max(parent_y(parent_key), next_available_y)
+                else:
+                    current_y = max(c['PASSAGE_PADDING'], next_available_y)
+
+                for passage_id in parent_groups[parent_key]:
+                    if passage_id not in positions:
+                        positions[passage_id] = (current_x, current_y)
+                        lane_y[passage_id] = current_y
+                        current_y += row_height
+
+                next_available_y = current_y
+                if group_index < len(parent_keys) - 1:
+                    next_available_y += c['VERTICAL_SPACING']
+
+        return positions, depths, False
+
+    def layout(self, data):
+        """Lay out every lane; returns positions, lane offsets and sticky notes"""
+        c = self.c
+        graph = StoryGraph(data, compute_depths=False)
+
+        relative_y = {
+            passage_id: passage.get('relativeY') or 0
+            for passage_id, passage in graph.passages.items()
+        }
+
+        lane_results = []
+        for lane in graph.lanes:
+            lane_ids = graph.lane_passages.get(lane['id'], [])
+            key = self.lane_key(graph, lane, lane_ids, relative_y)
+
+            with self.lock:
+                result = self.cache.get(key)
+                if result is not None:
+                    self.cache.move_to_end(key)
+                    self.hits += 1
+                else:
+                    self.misses += 1
+
+            if result is None:
+                result = self.layout_lane(graph, lane, lane_ids, relative_y)
+                with self.lock:
+                    self.cache[key] = result
+                    while len(self.cache) > self.max_cached_lanes:
+                        self.cache.popitem(last=False)
+
+            positions, depths, is_grid = result
+            graph.depths.update(depths)
+            for passage_id in lane_ids:
+                relative_y[passage_id] = positions.get(passage_id, (0, 0))[1]
+            lane_results.append((lane, lane_ids, positions, is_grid))
+
+        # Lane offsets depend on the heights of every lane above
+        passages = {}
+        lanes = {}
+        lane_top = 0
+        for lane, lane_ids, positions, is_grid in lane_results:
+            height = self.lane_height(lane, lane_ids, relative_y)
+            base_y = lane_top + c['HEADER_HEIGHT']
+            offset = 0 if is_grid else c['PASSAGE_PADDING']
+
+            for passage_id in lane_ids:
+                x, y = positions.get(passage_id, (0, 0))
+                passages[passage_id] = {'x': x, 'y': base_y + offset + y, 'relativeY': y}
+
+            lanes[lane['id']] = {'y': lane_top, 'height': height}
+            lane_top += height
+
+        graph_data = graph.to_dict()
+        stickies = self.position_stickies(
+            graph_data['loopPassages'] + graph_data['jumpPassages'], passages)
+
+        return {
+            'passages': passages,
+            'lanes': lanes,
+            'stickies': stickies,
+            'links': graph_data['links'],
+            'height': lane_top
+        }
+
+    def position_stickies(self, stickies, passages):
+        """Place LOOP and JUMP notes to the right of their source passage"""
+        c = self.c
+        by_source = OrderedDict()
+        for sticky in stickies:
+            by_source.setdefault(sticky['fromId'], []).append(sticky)
+
+        result = {}
+        for source_id, group in by_source.items():
+            source = passages.get(source_id)
+            if source is None:
+                continue
+
+            # Loops come before jumps
+            group.sort(key=lambda sticky: sticky['type'] != 'loop')
+            for index, sticky in enumerate(group):
+                visible_index = min(index, MAX_VISIBLE_STICKIES - 1)
+                result[sticky['id']] = dict(
+                    sticky,
+                    x=source['x'] + c['PASSAGE_WIDTH'] + c['PASSAGE_SPACING'] + visible_index * STICKY_STACK_OFFSET,
+                    y=source['y'] + visible_index * STICKY_STACK_OFFSET,
+                    stackIndex=index,
+                    totalInStack=len(group),
+                    isVisible=index < MAX_VISIBLE_STICKIES
+                )
+        return result
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Story lint - broken links, unreachable passages, cycles and dead ends
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from graph import iter_link_targets, is_start_passage
+from model import passage_record
+from twee import TweeParser
+
+SEVERITY_ORDER = ('error', 'warning', 'info')
+
+# Passages story formats read directly rather than through links
+SPECIAL_TITLES = {
+    'StoryTitle', 'StoryData', 'StoryAuthor', 'StorySubtitle', 'StoryInit',
+    'StoryMenu', 'StoryBanner', 'StoryCaption', 'StoryInterface', 'StoryShare',
+    'PassageReady', 'PassageDone', 'PassageHeader', 'PassageFooter'
+}
+SPECIAL_TAGS = {'script', 'stylesheet', 'widget', 'Twine.image'}
+
+
+class StoryLinter:
+    """Link graph kept up to date one passage at a time.
+
+    Each passage's raw link targets are extracted once, when it is added
+    or changed. `referrers` maps a title to the passages linking to it, so
+    renaming, adding or removing a passage re-resolves only the links that
+    could point at it. lint() then walks the resolved graph once: an
+    iterative Tarjan pass seeded from the start passages yields
+    reachability and strongly connected components together.
+    """
+
+    def __init__(self, data=None):
+        self.passages = {}
+        self.order = {}
+        self.next_order = 0
+        self.metadata_lanes = set()
+        self.titles = {}
+        self.lane_titles = {}
+        self.targets = {}
+        self.referrers = {}
+        self.outgoing = {}
+        self.broken = {}
+
+        if data:
+            self.set_lanes(data.get('lanes', []))
+            self.update_passages(passage_record(item) for item in data.get('passages', []))
+
+    def set_lanes(self, lanes):
+        self.metadata_lanes = {lane['id'] for lane in lanes if lane.get('isMetadata')}
+
+    def resolve(self, title, lane_id):
+        """Same lane first, then any lane, like StoryGraph.resolve()"""
+        candidates = self.lane_titles.get((lane_id, title)) or self.titles.get(title)
+        return candidates[0] if candidates else None
+
+    def resolve_links(self, passage_id):
+        lane_id = self.passages[passage_id].get('laneId')
+        outgoing = []
+        broken = []
+        for title in self.targets[passage_id]:
+            target_id = self.resolve(title, lane_id)
+            if target_id is None:
+                broken.append(title)
+            else:
+                outgoing.append(target_id)
+        self.outgoing[passage_id] = outgoing
+        self.broken[passage_id] = broken
+
+    def resolve_referrers(self, titles):
+        for title in titles:
+            for passage_id in self.referrers.get(title, ()):
+                self.resolve_links(passage_id)
+
+    def index_title(self, passage_id, passage):
+        title = passage.get('title')
+        lane_key = (passage.get('laneId'), title)
+        for index, key in ((self.titles, title), (self.lane_titles, lane_key)):
+            ids = index.setdefault(key, [])
+            ids.append(passage_id)
+            ids.sort(key=self.order.__getitem__)
+
+    def unindex_title(self, passage_id, passage):
+        title = passage.get('title')
+        lane_key = (passage.get('laneId'), title)
+        for index, key in ((self.titles, title), (self.lane_titles, lane_key)):
+            ids = index.get(key, [])
+            if passage_id in ids:
+                ids.remove(passage_id)
+            if not ids:
+                index.pop(key, None)
+
+    def update_passage(self, passage):
+        self.update_passages([passage])
+
+    def update_passages(self, passages):
+        """Add or change passages, then resolve the links they affect once.
+
+        Links are only resolved after every passage is indexed, so a full
+        build or a large delta resolves each link once rather than after
+        every insert, when most titles aren't known yet.
+        """
+        updated = []
+        titles = set()
+        for passage in passages:
+            passage_id = passage['id']
+            old = self.passages.get(passage_id)
+            if passage_id not in self.order:
+                self.order[passage_id] = self.next_order
+                self.next_order += 1
+
+            renamed = old is None or (old.get('title'), old.get('laneId')) != (passage.get('title'), passage.get('laneId'))
+            if old is not None:
+                for title in self.targets.get(passage_id, ()):
+                    self.referrers.get(title, set()).discard(passage_id)
+                if renamed:
+                    self.unindex_title(passage_id, old)
+                    titles.add(old.get('title'))
+
+            self.passages[passage_id] = passage
+            if renamed:
+                self.index_title(passage_id, passage)
+                titles.add(passage.get('title'))
+
+            self.targets[passage_id] = list(iter_link_targets(passage.get('content')))
+            for title in self.targets[passage_id]:
+                self.referrers.setdefault(title, set()).add(passage_id)
+            updated.append(passage_id)
+
+        resolved = set(updated)
+        for passage_id in updated:
+            self.resolve_links(passage_id)
+        for title in titles:
+            for passage_id in self.referrers.get(title, ()):
+                if passage_id not in resolved:
+                    resolved.add(passage_id)
+                    self.resolve_links(passage_id)
+
+    def remove_passage(self, passage_id):
+        passage = self.passages.pop(passage_id, None)
+        if passage is None:
+            return
+        for title in self.targets.pop(passage_id, ()):
+            self.referrers.get(title, set()).discard(passage_id)
+        self.unindex_title(passage_id, passage)
+        self.order.pop(passage_id, None)
+        self.outgoing.pop(passage_id, None)
+        self.broken.pop(passage_id, None)
+        self.resolve_referrers([passage.get('title')])
+
+    def apply_delta(self, delta, lanes=None):
+        """Update from a ProjectStore delta, like SearchIndex.apply_delta()"""
+        if lanes is not None:
+            self.set_lanes(lanes)
+        for passage_id in delta.get('remove', []):
+            self.remove_passage(passage_id)
+        self.update_passages(passage_record(item) for item in delta.get('put', {}).values())
+
+    def is_story_passage(self, passage):
+        """Metadata and special passages (StoryTitle, widgets...) aren't part of the flow"""
+        if is_start_passage(passage):
+            return True
+        if passage.get('laneId') in self.metadata_lanes or passage.get('title') in SPECIAL_TITLES:
+            return False
+        return not SPECIAL_TAGS.intersection((passage.get('tags') or '').split())
+
+    def components(self, roots):
+        """Iterative Tarjan SCC; returns (components, ids reachable from roots)"""
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        components = []
+        reachable = None
+
+        ordered = sorted(self.passages, key=self.order.__getitem__)
+        for start_nodes in (roots, ordered):
+            for root in start_nodes:
+                if root in index:
+                    continue
+                index[root] = low[root] = len(index)
+                stack.append(root)
+                on_stack.add(root)
+                work = [(root, iter(self.outgoing.get(root, ())))]
+
+                while work:
+                    node, children = work[-1]
+                    for child in children:
+                        if child not in index:
+                            index[child] = low[child] = len(index)
+                            stack.append(child)
+                            on_stack.add(child)
+                            work.append((child, iter(self.outgoing.get(child, ()))))
+                            break
+                        if child in on_stack and index[child] < low[node]:
+                            low[node] = index[child]
+                    else:
+                        work.pop()
+                        if work:
+                            parent = work[-1][0]
+                            if low[node] < low[parent]:
+                                low[parent] = low[node]
+                        if low[node] == index[node]:
+                            component = []
+                            while True:
+                                member = stack.pop()
+                                on_stack.discard(member)
+                                component.append(member)
+                                if member == node:
+                                    break
+                            components.append(component)
+
+            if reachable is None:
+                reachable = set(index)
+
+        return components, reachable
+
+    def lint(self):
+        started = time.perf_counter()
+        issues = []
+
+        def issue(kind, severity, passage_id, message, **extra):
+            passage = self.passages.get(passage_id, {}) if passage_id else {}
+            issues.append(dict({
+                'type': kind,
+                'severity': severity,
+                'passageId': passage_id,
+                'title': passage.get('title'),
+                'message': message
+            }, **extra))
+
+        ordered = sorted(self.passages, key=self.order.__getitem__)
+        story = [passage_id for passage_id in ordered if self.is_story_passage(self.passages[passage_id])]
+        roots = [passage_id for passage_id in story if is_start_passage(self.passages[passage_id])]
+
+        broken_links = []
+        for passage_id in ordered:
+            for title in self.broken.get(passage_id, ()):
+                broken_links.append({'from': passage_id, 'target': title})
+                issue('broken-link', 'error', passage_id,
+                      f'links to missing passage "{title}"', target=title)
+
+        components, reachable = self.components(roots)
+
+        unreachable = []
+        if not roots:
+            issue('no-start', 'error', None, 'no Start or $start passage')
+        else:
+            unreachable = [passage_id for passage_id in story if passage_id not in reachable]
+            for passage_id in unreachable:
+                issue('unreachable', 'warning', passage_id, 'not reachable from a start passage')
+
+        dead_ends = [passage_id for passage_id in story if not self.targets.get(passage_id)]
+        for passage_id in dead_ends:
+            issue('dead-end', 'info', passage_id, 'has no outgoing links')
+
+        cycles = []
+        for component in components:
+            if len(component) == 1 and component[0] not in self.outgoing.get(component[0], ()):
+                continue
+            component.sort(key=self.order.__getitem__)
+            cycles.append(component)
+        cycles.sort(key=lambda component: self.order[component[0]])
+        for component in cycles:
+            issue('cycle', 'info', component[0],
+                  f'cycle through {len(component)} passage(s)', passages=component)
+
+        issues.sort(key=lambda item: SEVERITY_ORDER.index(item['severity']))
+
+        return {
+            'issues': issues,
+            'brokenLinks': broken_links,
+            'unreachable': unreachable,
+            'deadEnds': dead_ends,
+            'cycles': cycles,
+            'stats': {
+                'passages': len(self.passages),
+                'links': sum(len(targets) for targets in self.outgoing.values()),
+                'components': len(components),
+                'seconds': round(time.perf_counter() - started, 6)
+            }
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check a Twee story for broken links, unreachable passages and cycles')
+    parser.add_argument('file', help='.twee file to check')
+    parser.add_argument('--strict', action='store_true', help='fail on warnings as well as errors')
+    parser.add_argument('--json', action='store_true', help='print the full report as JSON')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only print errors and warnings')
+    args = parser.parse_args()
+
+    with open(args.file, 'r', encoding='utf-8') as f:
+        report = StoryLinter(TweeParser().parse_story(f)).lint()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for item in report['issues']:
+            if args.quiet and item['severity'] == 'info':
+                continue
+            where = f'"{item["title"]}"' if item['title'] is not None else 'story'
+            print(f"{args.file}: {item['severity']}: {where} {item['message']}")
+        stats = report['stats']
+        print(f"{stats['passages']} passages, {stats['links']} links, "
+              f"{len(report['brokenLinks'])} broken, {len(report['unreachable'])} unreachable, "
+              f"{len(report['cycles'])} cycles, {len(report['deadEnds'])} dead ends "
+              f"({stats['seconds'] * 1000:.1f} ms)")
+
+    failing = ('error', 'warning') if args.strict else ('error',)
+    return 1 if any(item['severity'] in failing for item in report['issues']) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Story merge - passage-level diff and three-way merge of Twee stories
+"""
+
+import argparse
+import difflib
+import hashlib
+import json
+import sys
+import time
+
+from outline import editor_lane
+from twee import TweeParser
+
+CONFLICT_OURS = '<<<<<<< ours'
+CONFLICT_SEPARATOR = '======='
+CONFLICT_THEIRS = '>>>>>>> theirs'
+
+
+class StoryPassage:
+    __slots__ = ('title', 'tags', 'content', 'lane', 'digest')
+
+    def __init__(self, title, tags, content):
+        self.title = title
+        self.tags = tags
+        self.content = content
+        self.lane = editor_lane(tags)[0]
+        self.digest = hashlib.blake2b(f'{tags}\n{content}'.encode('utf-8'), digest_size=16).digest()
+
+    def to_dict(self):
+        return {'title': self.title, 'lane': self.lane, 'tags': self.tags, 'content': self.content}
+
+
+def read_story(source):
+    """StoryPassages in file order from Twee text or a file object"""
+    return [StoryPassage(title, tags, '\n'.join(lines).strip())
+            for (title, tags), lines in TweeParser().iter_sections(source)]
+
+
+def match_passages(old, new):
+    """Pair passages of two versions: {new index: old index}.
+
+    Passages match by title and lane; whatever is left matches by title
+    alone when that title is unambiguous, which catches lane moves.
+    """
+    by_key = {}
+    for i, passage in enumerate(old):
+        by_key.setdefault((passage.title, passage.lane), []).append(i)
+
+    pairs = {}
+    leftover = []
+    for j, passage in enumerate(new):
+        candidates = by_key.get((passage.title, passage.lane))
+        if candidates:
+            pairs[j] = candidates.pop(0)
+        else:
+            leftover.append(j)
+
+    if leftover:
+        matched = set(pairs.values())
+        by_title = {}
+        for i, passage in enumerate(old):
+            if i not in matched:
+                by_title.setdefault(passage.title, []).append(i)
+        new_titles = {}
+        for j in leftover:
+            new_titles.setdefault(new[j].title, []).append(j)
+        for title, js in new_titles.items():
+            if len(js) == 1 and len(by_title.get(title, ())) == 1:
+                pairs[js[0]] = by_title[title][0]
+
+    return pairs
+
+
+def split_tags(tags):
+    return tags.split()
+
+
+def diff_stories(old, new, context=3):
+    """Passage-level diff between two read_story() results.
+
+    Unchanged passages are skipped by comparing body digests; only changed
+    passages get a line diff.
+    """
+    pairs = match_passages(old, new)
+    matched = set(pairs.values())
+
+    added = [new[j].to_dict() for j in range(len(new)) if j not in pairs]
+    removed = [old[i].to_dict() for i in range(len(old)) if i not in matched]
+    changed = []
+    unchanged = 0
+
+    for j, i in sorted(pairs.items()):
+        before, after = old[i], new[j]
+        if before.digest == after.digest:
+            unchanged += 1
+            continue
+
+        change = {'title': after.title, 'lane': after.lane}
+        if before.lane != after.lane:
+            change['oldLane'] = before.lane
+        if before.tags != after.tags:
+            old_tags, new_tags = split_tags(before.tags), split_tags(after.tags)
+            change['tags'] = {
+                'added': [tag for tag in new_tags if tag not in old_tags],
+                'removed': [tag for tag in old_tags if tag not in new_tags]
+            }
+        if before.content != after.content:
+            change['diff'] = list(difflib.unified_diff(
+                before.content.split('\n'), after.content.split('\n'),
+                f'a/{before.title}', f'b/{after.title}', n=context, lineterm=''))
+        changed.append(change)
+
+    return {
+        'added': added,
+        'removed': removed,
+        'changed': changed,
+        'stats': {'added': len(added), 'removed': len(removed), 'changed': len(changed), 'unchanged': unchanged}
+    }
+
+
+def line_changes(base, side):
+    """(base start, base end, side start, side end) of each region side changed"""
+    matcher = difflib.SequenceMatcher(None, base, side, autojunk=False)
+    return [(i1, i2, j1, j2) for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal']
+
+
+def merge_lines(base, ours, theirs):
+    """Three-way merge of line lists; returns (lines, conflicts).
+
+    Changes from each side are grouped where they touch the same base
+    lines. A group changed by one side, or identically by both, merges
+    cleanly; otherwise both versions are kept between conflict markers.
+    """
+    changes = sorted([(i1, i2, j1, j2, 0) for i1, i2, j1, j2 in line_changes(base, ours)] +
+                     [(i1, i2, j1, j2, 1) for i1, i2, j1, j2 in line_changes(base, theirs)])
+    sides = (ours, theirs)
+    offsets = [0, 0]
+    merged = []
+    conflicts = 0
+    position = 0
+    index = 0
+
+    while index < len(changes):
+        low, high = changes[index][0], changes[index][1]
+        group = [changes[index]]
+        index += 1
+        while index < len(changes) and changes[index][0] <= high:
+            high = max(high, changes[index][1])
+            group.append(changes[index])
+            index += 1
+
+        merged.extend(base[position:low])
+        position = high
+
+        # Each side's lines for base[low:high]
+        versions = []
+        for side in (0, 1):
+            growth = sum((j2 - j1) - (i2 - i1) for i1, i2, j1, j2, s in group if s == side)
+            start = low + offsets[side]
+            versions.append(sides[side][start:high + offsets[side] + growth])
+            offsets[side] += growth
+
+        touched = {s for *_, s in group}
+        if touched == {0}:
+            merged.extend(versions[0])
+        elif touched == {1}:
+            merged.extend(versions[1])
+        elif versions[0] == versions[1]:
+            merged.extend(versions[0])
+        else:
+            conflicts += 1
+            merged.append(CONFLICT_OURS)
+            merged.extend(versions[0])
+            merged.append(CONFLICT_SEPARATOR)
+            merged.extend(versions[1])
+            merged.append(CONFLICT_THEIRS)
+
+    merged.extend(base[position:])
+    return merged, conflicts
+
+
+def tag_key(tag):
+    """Tags like $lane:Name hold one value per key; plain tags are their own key"""
+    return tag.split(':', 1)[0] + ':' if ':' in tag else tag
+
+
+def merge_tags(base, ours, theirs):
+    """Merge tag strings tag by tag; returns (tags, conflicting tag keys)"""
+    base_tags, our_tags, their_tags = ({tag_key(t): t for t in split_tags(tags)} for tags in (base, ours, theirs))
+    keys = list(our_tags) + [key for key in their_tags if key not in our_tags]
+    keys += [key for key in base_tags if key not in our_tags and key not in their_tags]
+
+    merged = []
+    conflicts = []
+    for key in keys:
+        b, o, t = base_tags.get(key), our_tags.get(key), their_tags.get(key)
+        if o == t:
+            value = o
+        elif o == b:
+            value = t
+        elif t == b:
+            value = o
+        else:
+            # Both sides set a different value; ours wins and the key is reported
+            conflicts.append(key.rstrip(':'))
+            value = o if o is not None else t
+        if value is not None:
+            merged.append(value)
+    return ' '.join(merged), conflicts
+
+
+def merge_passage(base, ours, theirs):
+    """Merge one passage present on both sides; returns (StoryPassage, conflicts)"""
+    if ours.digest == theirs.digest or (base is not None and theirs.digest == base.digest):
+        return ours, []
+    if base is not None and ours.digest == base.digest:
+        return theirs, []
+
+    base_tags = base.tags if base is not None else ''
+    base_lines = base.content.split('\n') if base is not None else []
+    kind = 'modify/modify' if base is not None else 'add/add'
+    conflicts = []
+
+    tags, tag_conflicts = merge_tags(base_tags, ours.tags, theirs.tags)
+    for key in tag_conflicts:
+        conflicts.append({'title': ours.title, 'lane': ours.lane, 'type': 'tag', 'tag': key, 'change': kind})
+
+    if ours.content == theirs.content:
+        content = ours.content
+    else:
+        lines, hunks = merge_lines(base_lines, ours.content.split('\n'), theirs.content.split('\n'))
+        content = '\n'.join(lines)
+        if hunks:
+            conflicts.append({'title': ours.title, 'lane': ours.lane, 'type': 'content',
+                              'hunks': hunks, 'change': kind})
+
+    return StoryPassage(ours.title, tags, content), conflicts
+
+
+def merge_stories(base, ours, theirs):
+    """Three-way merge of read_story() results.
+
+    Passages are matched to the base by title and lane. Ours decides the
+    order; passages only theirs added go after the passage they follow in
+    theirs. A passage deleted on one side and edited on the other is kept
+    with the edit and reported as a conflict. Conflict `change` values
+    read ours/theirs, e.g. 'modify/delete'.
+    """
+    started = time.perf_counter()
+    ours_base = match_passages(base, ours)
+    theirs_base = match_passages(base, theirs)
+    base_theirs = {i: j for j, i in theirs_base.items()}
+    base_ours = {i: j for j, i in ours_base.items()}
+
+    # Passages added on both sides are matched to each other
+    ours_added = [j for j in range(len(ours)) if j not in ours_base]
+    theirs_added = [j for j in range(len(theirs)) if j not in theirs_base]
+    added_pairs = {}
+    if ours_added and theirs_added:
+        pairs = match_passages([ours[j] for j in ours_added], [theirs[j] for j in theirs_added])
+        added_pairs = {ours_added[i]: theirs_added[t] for t, i in pairs.items()}
+    paired_theirs = set(added_pairs.values())
+
+    result = []
+    conflicts = []
+    placed = {}
+
+    for j, passage in enumerate(ours):
+        i = ours_base.get(j)
+        if i is None:
+            t = added_pairs.get(j)
+            if t is None:
+                merged = passage
+            else:
+                merged, found = merge_passage(None, passage, theirs[t])
+                conflicts.extend(found)
+                placed[t] = len(result)
+        elif i in base_theirs:
+            t = base_theirs[i]
+            merged, found = merge_passage(base[i], passage, theirs[t])
+            conflicts.extend(found)
+            placed[t] = len(result)
+        elif passage.digest == base[i].digest:
+            # Deleted by theirs, untouched by us
+            continue
+        else:
+            merged = passage
+            conflicts.append({'title': passage.title, 'lane': passage.lane, 'type': 'delete',
+                              'change': 'modify/delete'})
+        result.append(merged)
+
+    # Passages theirs added or kept that ours doesn't have, after their predecessor in theirs
+    insertions = {}
+    previous = -1
+    for t, passage in enumerate(theirs):
+        if t in placed:
+            previous = placed[t]
+            continue
+        i = theirs_base.get(t)
+        if i is None:
+            if t in paired_theirs:
+                continue
+        elif i in base_ours:
+            continue
+        elif passage.digest == base[i].digest:
+            # Deleted by ours, untouched by theirs
+            continue
+        else:
+            conflicts.append({'title': passage.title, 'lane': passage.lane, 'type': 'delete',
+                              'change': 'delete/modify'})
+        insertions.setdefault(previous, []).append(passage)
+
+    merged = list(insertions.get(-1, []))
+    for position, passage in enumerate(result):
+        merged.append(passage)
+        merged.extend(insertions.get(position, []))
+
+    return {
+        'passages': merged,
+        'conflicts': conflicts,
+        'stats': {
+            'passages': len(merged),
+            'conflicts': len(conflicts),
+            'seconds': time.perf_counter() - started
+        }
+    }
+
+
+def format_story(passages):
+    """Twee text in the editor's export format"""
+    return ''.join(f":: {p.title}{f' [{p.tags}]' if p.tags else ''}\n{p.content}\n\n" for p in passages)
+
+
+def read_file(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return read_story(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Diff or three-way merge Twee stories passage by passage')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    diff_parser = commands.add_parser('diff', help='show passages added, removed and changed')
+    diff_parser.add_argument('old', help='original .twee file')
+    diff_parser.add_argument('new', help='changed .twee file')
+    diff_parser.add_argument('--json', action='store_true', help='print the diff as JSON')
+
+    merge_parser = commands.add_parser('merge', help='merge two versions with a common base')
+    merge_parser.add_argument('base', help='common ancestor .twee file')
+    merge_parser.add_argument('ours', help='our version')
+    merge_parser.add_argument('theirs', help='their version')
+    merge_parser.add_argument('-o', '--output', help='write the merged story here instead of stdout')
+    merge_parser.add_argument('--json', action='store_true', help='print conflicts as JSON on stderr')
+    args = parser.parse_args()
+
+    if args.command == 'diff':
+        diff = diff_stories(read_file(args.old), read_file(args.new))
+        if args.json:
+            print(json.dumps(diff, indent=2))
+        else:
+            for passage in diff['removed']:
+                print(f"- {passage['title']}")
+            for passage in diff['added']:
+                print(f"+ {passage['title']}")
+            for change in diff['changed']:
+                print(f"~ {change['title']}")
+                for line in change.get('diff', [])[2:]:
+                    print(f'    {line}')
+            stats = diff['stats']
+            print(f"{stats['added']} added, {stats['removed']} removed, "
+                  f"{stats['changed']} changed, {stats['unchanged']} unchanged")
+        return 1 if diff['added'] or diff['removed'] or diff['changed'] else 0
+
+    result = merge_stories(read_file(args.base), read_file(args.ours), read_file(args.theirs))
+    text = format_story(result['passages'])
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+    if args.json:
+        print(json.dumps(result['conflicts'], indent=2), file=sys.stderr)
+    else:
+        for conflict in result['conflicts']:
+            detail = conflict.get('tag') or conflict.get('hunks') or conflict['change']
+            print(f"conflict: {conflict['type']}: \"{conflict['title']}\" ({detail})", file=sys.stderr)
+    return 1 if result['conflicts'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
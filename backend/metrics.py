@@ -0,0 +1,216 @@
+import cProfile
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Requests slower than this many milliseconds get a cProfile dump;
+# unset means profiling only happens for requests that ask for it
+PROFILE_SLOW_MS = os.environ.get('BRANCHED_PROFILE_SLOW_MS')
+PROFILE_DIR = os.environ.get('BRANCHED_PROFILE_DIR', 'profiles')
+PROFILE_HEADER = 'X-BranchEd-Profile'
+
+# The header writes a dump for every request that sends it, so clients
+# may only ask for profiles when the server is started with this set
+PROFILE_HEADER_ENABLED = os.environ.get('BRANCHED_PROFILE_HEADER', '0') not in ('', '0')
+
+ID_SEGMENT_REGEX = re.compile(r'^(/api/[^/]+)/[^/]+(/(?:events|changes|outline|passages|passage|ops))?$')
+
+
+def endpoint_label(path):
+    """Collapse per-item paths like /api/game/<id> so labels stay bounded"""
+    if not path.startswith('/api/'):
+        return 'static'
+    match = ID_SEGMENT_REGEX.match(path)
+    return f'{match.group(1)}/{{id}}{match.group(2) or ""}' if match else path
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels) + '}'
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}')
+        lines.append(f'{name}_sum{format_labels(labels)} {self.sum}')
+        lines.append(f'{name}_count{format_labels(labels)} {self.count}')
+        return lines
+
+
+class MetricsRegistry:
+    """Request and operation metrics rendered in Prometheus text format"""
+
+    def __init__(self, prefix='branched'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.request_latency = {}
+        self.bytes = {}
+        self.operation_latency = {}
+        self.operation_passages = {}
+        self.caches = {}
+
+    def observe_request(self, endpoint, method, status, seconds, bytes_in=0, bytes_out=0):
+        with self.lock:
+            key = (('endpoint', endpoint), ('method', method), ('status', status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+            key = (('endpoint', endpoint), ('method', method))
+            histogram = self.request_latency.get(key)
+            if histogram is None:
+                histogram = self.request_latency[key] = Histogram()
+            histogram.observe(seconds)
+
+            for direction, count in (('in', bytes_in), ('out', bytes_out)):
+                key = (('endpoint', endpoint), ('direction', direction))
+                self.bytes[key] = self.bytes.get(key, 0) + (count or 0)
+
+    def observe_operation(self, operation, seconds, passages=0):
+        """Record a parse/export style operation and how many passages it handled"""
+        with self.lock:
+            key = (('operation', operation),)
+            histogram = self.operation_latency.get(key)
+            if histogram is None:
+                histogram = self.operation_latency[key] = Histogram()
+            histogram.observe(seconds)
+            self.operation_passages[key] = self.operation_passages.get(key, 0) + passages
+
+    def timed_iter(self, operation, iterator, passages=0):
+        """Wrap a generator so the operation is recorded once it is exhausted"""
+        started = time.perf_counter()
+        yield from iterator
+        self.observe_operation(operation, time.perf_counter() - started, passages)
+
+    def register_cache(self, name, cache):
+        """Track an object exposing `hits` and `misses` counters"""
+        self.caches[name] = cache
+
+    def render(self):
+        p = self.prefix
+        lines = []
+
+        with self.lock:
+            lines.append(f'# HELP {p}_requests_total HTTP requests by endpoint and status.')
+            lines.append(f'# TYPE {p}_requests_total counter')
+            for labels, count in sorted(self.requests.items()):
+                lines.append(f'{p}_requests_total{format_labels(labels)} {count}')
+
+            lines.append(f'# HELP {p}_request_duration_seconds HTTP request latency.')
+            lines.append(f'# TYPE {p}_request_duration_seconds histogram')
+            for labels, histogram in sorted(self.request_latency.items()):
+                lines.extend(histogram.render(f'{p}_request_duration_seconds', labels))
+
+            lines.append(f'# HELP {p}_bytes_total Request and response body bytes.')
+            lines.append(f'# TYPE {p}_bytes_total counter')
+            for labels, count in sorted(self.bytes.items()):
+                lines.append(f'{p}_bytes_total{format_labels(labels)} {count}')
+
+            lines.append(f'# HELP {p}_operation_duration_seconds Parse/export durations.')
+            lines.append(f'# TYPE {p}_operation_duration_seconds histogram')
+            for labels, histogram in sorted(self.operation_latency.items()):
+                lines.extend(histogram.render(f'{p}_operation_duration_seconds', labels))
+
+            lines.append(f'# HELP {p}_operation_passages_total Passages handled by each operation.')
+            lines.append(f'# TYPE {p}_operation_passages_total counter')
+            for labels, count in sorted(self.operation_passages.items()):
+                lines.append(f'{p}_operation_passages_total{format_labels(labels)} {count}')
+
+        lines.append(f'# HELP {p}_cache_hits_total Cache hits.')
+        lines.append(f'# TYPE {p}_cache_hits_total counter')
+        for name, cache in sorted(self.caches.items()):
+            lines.append(f'{p}_cache_hits_total{format_labels((("cache", name),))} {cache.hits}')
+        lines.append(f'# HELP {p}_cache_misses_total Cache misses.')
+        lines.append(f'# TYPE {p}_cache_misses_total counter')
+        for name, cache in sorted(self.caches.items()):
+            lines.append(f'{p}_cache_misses_total{format_labels((("cache", name),))} {cache.misses}')
+
+        return '\n'.join(lines) + '\n'
+
+
+class RequestProfiler:
+    """Opt-in cProfile capture for slow requests.
+
+    Profiling is on when BRANCHED_PROFILE_SLOW_MS is set, and, if
+    BRANCHED_PROFILE_HEADER is set too, for single requests that send an
+    `X-BranchEd-Profile: 1` header. Requests slower than the threshold (0
+    when only the header asked) get a .prof dump in BRANCHED_PROFILE_DIR,
+    readable with pstats or snakeviz.
+
+    cProfile can only run one profile at a time (Python 3.12+ raises when
+    a second one starts), so requests that arrive while another is being
+    profiled run unprofiled and are counted in `skipped`.
+    """
+
+    def __init__(self, slow_ms=PROFILE_SLOW_MS, directory=PROFILE_DIR, header_enabled=PROFILE_HEADER_ENABLED):
+        self.slow_ms = float(slow_ms) if slow_ms not in (None, '') else None
+        self.directory = directory
+        self.header_enabled = header_enabled
+        self.active = threading.Lock()
+        self.skipped = 0
+
+    def start(self, headers):
+        requested = self.header_enabled and headers.get(PROFILE_HEADER, '') not in ('', '0')
+        if self.slow_ms is None and not requested:
+            return None
+
+        if not self.active.acquire(blocking=False):
+            self.skipped += 1
+            return None
+
+        profiler = cProfile.Profile()
+        profiler.threshold_ms = self.slow_ms if self.slow_ms is not None else 0
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiling tool, such as a debugger or coverage, is active
+            self.active.release()
+            self.skipped += 1
+            return None
+        return profiler
+
+    def finish(self, profiler, seconds, label):
+        """Stop profiling and dump the stats if the request was slow; returns the path"""
+        if profiler is None:
+            return None
+        try:
+            profiler.disable()
+        finally:
+            self.active.release()
+
+        if seconds * 1000 < profiler.threshold_ms:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        safe_label = re.sub(r'[^A-Za-z0-9_.-]+', '_', label).strip('_') or 'root'
+        path = os.path.join(self.directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{int(seconds * 1000)}ms-{safe_label}.prof')
+        profiler.dump_stats(path)
+        return path
+
+
+metrics = MetricsRegistry()
+profiler = RequestProfiler()
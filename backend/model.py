@@ -0,0 +1,190 @@
+import sys
+from array import array
+
+PASSAGE_FIELDS = ('id', 'title', 'content', 'laneId', 'tags')
+
+
+def passage_record(item):
+    """Saved projects hold passage dicts or [id, passage] pairs"""
+    return item[1] if isinstance(item, (list, tuple)) else item
+
+
+def default_passage_id(index):
+    return f'passage_{index + 1}'
+
+
+class Passage:
+    """Read-only view of one row of a Story.
+
+    Supports the dict operations the rest of the backend uses on passages
+    (`p['id']`, `p.get('tags')`, `dict(p)`), so graph, lint and search code
+    work on a Story unchanged without a dict being kept per passage.
+    """
+
+    __slots__ = ('story', 'index')
+
+    def __init__(self, story, index):
+        self.story = story
+        self.index = index
+
+    def get(self, key, default=None):
+        story = self.story
+        i = self.index
+        extras = story.extras.get(i)
+        if extras is not None and key in extras:
+            return extras[key]
+        if key == 'id':
+            return story.ids[i] if story.ids is not None else default_passage_id(i)
+        if key == 'title':
+            return story.titles[i]
+        if key == 'content':
+            return story.contents[i]
+        if key == 'laneId':
+            return story.lanes[story.lane_of[i]]['id']
+        if key == 'tags':
+            return story.tags[i] or default
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key, KeyError)
+        if value is KeyError:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, KeyError) is not KeyError
+
+    def keys(self):
+        keys = [key for key in PASSAGE_FIELDS if key in self]
+        keys.extend(key for key in self.story.extras.get(self.index, ()) if key not in keys)
+        return keys
+
+    def to_dict(self):
+        return {key: self[key] for key in self.keys()}
+
+
+class PassageList:
+    """Sequence of Passage views over a Story's columns"""
+
+    __slots__ = ('story',)
+
+    def __init__(self, story):
+        self.story = story
+
+    def __len__(self):
+        return len(self.story.titles)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Passage(self.story, i) for i in range(len(self))[index]]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return Passage(self.story, index)
+
+    def __iter__(self):
+        story = self.story
+        for i in range(len(story.titles)):
+            yield Passage(story, i)
+
+
+class Story:
+    """Columnar story model for large stories.
+
+    Passages are stored as parallel columns - titles, contents, tags and a
+    compact array of lane indexes - instead of one dict each. Titles, tags
+    and lane names are interned, and IDs are implicit row numbers unless
+    the story came in with IDs of its own. Convert with from_dict()/to_dict()
+    at the API boundary; inside the backend `story.get('passages')` yields
+    dict-like views so existing code can read it directly.
+    """
+
+    def __init__(self):
+        self.titles = []
+        self.contents = []
+        self.tags = []
+        self.lane_of = array('i')
+        self.lanes = [{'id': 'metadata', 'name': 'Metadata', 'isMetadata': True}]
+        self.lane_index = {'metadata': 0}
+        self.lane_names = {}
+        self.ids = None
+        self.extras = {}
+
+    def __len__(self):
+        return len(self.titles)
+
+    def get(self, key, default=None):
+        if key == 'passages':
+            return PassageList(self)
+        if key == 'lanes':
+            return self.lanes
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def lane_for_name(self, name):
+        """Index of the lane with this name, added in order of first use"""
+        index = self.lane_names.get(name)
+        if index is None:
+            lane_id = f'lane_{len(self.lane_names) + 1}'
+            index = self.add_lane({'id': lane_id, 'name': sys.intern(name), 'isMetadata': False})
+            self.lane_names[name] = index
+        return index
+
+    def add_lane(self, lane):
+        self.lane_index[lane['id']] = len(self.lanes)
+        self.lanes.append(lane)
+        return len(self.lanes) - 1
+
+    def append(self, title, content, lane, tags='', passage_id=None):
+        """Add a passage; `lane` is an index into self.lanes"""
+        index = len(self.titles)
+        self.titles.append(sys.intern(title))
+        self.contents.append(content)
+        self.tags.append(sys.intern(tags) if tags else '')
+        self.lane_of.append(lane)
+
+        if passage_id is not None and self.ids is None and passage_id != default_passage_id(index):
+            self.ids = [default_passage_id(i) for i in range(index)]
+        if self.ids is not None:
+            self.ids.append(passage_id if passage_id is not None else default_passage_id(index))
+        return index
+
+    @classmethod
+    def from_dict(cls, data):
+        story = cls()
+        story.lanes = []
+        story.lane_index = {}
+        for lane in data.get('lanes', []):
+            story.add_lane(lane)
+            if not lane.get('isMetadata'):
+                story.lane_names.setdefault(lane.get('name'), story.lane_index[lane['id']])
+
+        for item in data.get('passages', []):
+            passage = passage_record(item)
+            lane = story.lane_index.get(passage.get('laneId'), -1)
+            tags = passage.get('tags') or ''
+            index = story.append(passage.get('title') or '', passage.get('content') or '', lane,
+                                 tags if isinstance(tags, str) else '', passage.get('id'))
+
+            # Anything the columns can't hold verbatim is kept per passage
+            extras = {key: value for key, value in passage.items()
+                      if key not in PASSAGE_FIELDS or (key == 'tags' and not isinstance(value, str))}
+            if 'tags' in passage and not passage['tags']:
+                extras['tags'] = passage['tags']
+            if lane == -1:
+                extras['laneId'] = passage.get('laneId')
+            if extras:
+                story.extras[index] = extras
+        return story
+
+    def to_dict(self):
+        return {
+            'passages': [passage.to_dict() for passage in self.get('passages')],
+            'lanes': self.lanes
+        }
@@ -0,0 +1,263 @@
+import io
+import json
+import os
+import threading
+
+from preview import LINK_REGEX
+from twee import parse_header
+
+# Passage bodies returned per /passages page unless the client asks otherwise
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+# Bump when scan_story() output changes shape so old sidecar files are rebuilt
+SIDECAR_FORMAT = 1
+
+
+def editor_lane(tags):
+    """(lane name, passage tags) the way the editor's addTweePassage() assigns them;
+    a lane name of None means the metadata lane"""
+    lane_name = 'Main'
+    passage_tags = []
+    for tag in tags.split():
+        if tag.startswith('$lane:'):
+            lane_name = tag[6:]
+        else:
+            passage_tags.append(tag)
+    if '$metadata' in passage_tags:
+        lane_name = None
+    return lane_name, ' '.join(passage_tags)
+
+
+def decode_body(raw):
+    return raw.decode('utf-8').replace('\r\n', '\n').strip()
+
+
+class StoryScanner:
+    """scan_story() fed one line at a time, for sources read incrementally.
+
+    Only the titles, tags, links and byte ranges found so far and the
+    current passage's body are held, never the whole source.
+    """
+
+    def __init__(self):
+        self.state = {'titles': [], 'tags': [], 'links': [], 'starts': [], 'ends': []}
+        self.offset = 0
+        self.body = None
+
+    def close_passage(self):
+        self.state['links'].append([match.group(1) for match in LINK_REGEX.finditer(''.join(self.body))])
+        self.state['ends'].append(self.offset)
+
+    def feed(self, line, size=None):
+        """Add the next decoded line, including its line ending if it has one;
+        size is its length in bytes when the caller already knows it"""
+        if size is None:
+            size = len(line.encode('utf-8'))
+        parsed = parse_header(line.rstrip('\r\n')) if line.startswith(':: ') else None
+        if parsed is not None:
+            if self.body is not None:
+                self.close_passage()
+            self.state['titles'].append(parsed[0])
+            self.state['tags'].append(parsed[1])
+            self.state['starts'].append(self.offset + size)
+            self.body = []
+        elif self.body is not None:
+            self.body.append(line)
+        self.offset += size
+
+    def finish(self):
+        """The scan_story() state for everything fed so far"""
+        if self.body is not None:
+            self.close_passage()
+            self.body = None
+        return self.state
+
+
+def scan_story(source):
+    """Titles, tags, [[link]] text and body byte ranges for .twee source bytes"""
+    scanner = StoryScanner()
+    for line in io.BytesIO(source):
+        scanner.feed(line.decode('utf-8'), len(line))
+    return scanner.finish()
+
+
+def index_source(source):
+    """scan_story() state as the bytes ParseCache keeps under the 'story' kind.
+
+    The Flask /api/import builds its passages from the same entry, so a story
+    indexed by either server is not scanned again by the other.
+    """
+    return encode_index(scan_story(source))
+
+
+def encode_index(state):
+    """index_source() for a state that is already scanned, like StoryScanner.finish()"""
+    return json.dumps(state).encode()
+
+
+class StoryIndex:
+    """Byte offsets of every passage in a .twee file.
+
+    Built with one pass over the file (see scan_story), keeping only titles,
+    tags, link text and where each body starts and ends. Bodies are then
+    read with one pread() per run of consecutive passages instead of
+    re-reading the file, so fetching a single passage costs the same on a
+    large story as on a small one.
+    """
+
+    def __init__(self, path, signature, state):
+        self.path = path
+        self.signature = signature
+        self.titles = state['titles']
+        self.tags = state['tags']
+        self.links = state['links']
+        self.starts = state['starts']
+        self.ends = state['ends']
+        self.positions = None
+
+    def __len__(self):
+        return len(self.titles)
+
+    def outline(self):
+        """Lanes and passages without their bodies, in file order"""
+        lanes = []
+        passages = []
+        for index, (title, tags, links) in enumerate(zip(self.titles, self.tags, self.links)):
+            lane, passage_tags = editor_lane(tags)
+            if lane is not None and lane not in lanes:
+                lanes.append(lane)
+            passages.append({
+                'index': index,
+                'title': title,
+                'tags': tags,
+                'lane': lane,
+                'links': links
+            })
+        return {'lanes': lanes, 'passages': passages}
+
+    def lane_indexes(self, lane):
+        """Indexes of the passages in a lane; '$metadata' selects the metadata lane"""
+        wanted = None if lane == '$metadata' else lane
+        return [index for index, tags in enumerate(self.tags) if editor_lane(tags)[0] == wanted]
+
+    def find(self, title, lane=None):
+        """Index of the passage with this title, or None.
+
+        `lane` narrows the match to one lane ('$metadata' for the metadata
+        lane); without it the first passage with the title wins.
+        """
+        if self.positions is None:
+            positions = {}
+            for index, (passage_title, tags) in enumerate(zip(self.titles, self.tags)):
+                positions.setdefault((passage_title, editor_lane(tags)[0] or '$metadata'), index)
+                positions.setdefault((passage_title, None), index)
+            self.positions = positions
+        return self.positions.get((title, lane))
+
+    def read(self, indexes):
+        """[(index, content)] for the given passage indexes"""
+        indexes = sorted(set(i for i in indexes if 0 <= i < len(self)))
+        bodies = []
+
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            run_start = 0
+            while run_start < len(indexes):
+                # Passages next to each other in the file come back in one read
+                run_end = run_start
+                while run_end + 1 < len(indexes) and indexes[run_end + 1] == indexes[run_end] + 1:
+                    run_end += 1
+
+                first = indexes[run_start]
+                chunk = os.pread(fd, self.ends[indexes[run_end]] - self.starts[first], self.starts[first])
+                for index in indexes[run_start:run_end + 1]:
+                    start = self.starts[index] - self.starts[first]
+                    end = self.ends[index] - self.starts[first]
+                    # The next header line sits between two bodies
+                    bodies.append((index, decode_body(chunk[start:end])))
+                run_start = run_end + 1
+        finally:
+            os.close(fd)
+
+        return bodies
+
+
+def sidecar_path(path):
+    """Where the index of a story file is persisted: .<name>.idx beside it"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f'.{name}.idx')
+
+
+def read_sidecar(path, signature):
+    """scan_story() state saved for this exact mtime and size, or None"""
+    try:
+        with open(sidecar_path(path), 'r', encoding='utf-8') as f:
+            sidecar = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if sidecar.get('format') != SIDECAR_FORMAT or sidecar.get('signature') != list(signature):
+        return None
+    return sidecar['state']
+
+
+def write_sidecar(path, signature, state):
+    """Persist an index next to its story; a read-only games folder just goes without"""
+    target = sidecar_path(path)
+    temp_path = f'{target}.{os.getpid()}.tmp'
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'format': SIDECAR_FORMAT, 'signature': list(signature), 'state': state}, f)
+        os.replace(temp_path, target)
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+
+class StoryIndexCache:
+    """StoryIndex per story file, rebuilt when the file's mtime or size changes.
+
+    Each index is also saved to a sidecar file beside the story, so after a
+    restart an unchanged story is indexed without reading it at all. With
+    a ParseCache, rebuilding a file whose content was indexed before (an
+    edit that was undone) skips the scan.
+    """
+
+    def __init__(self, parse_cache=None):
+        self.parse_cache = parse_cache
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        path = str(path)
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            index = self.entries.get(path)
+            if index is not None and index.signature == signature:
+                self.hits += 1
+                return index
+            self.misses += 1
+
+        state = read_sidecar(path, signature)
+        if state is None:
+            with open(path, 'rb') as f:
+                source = f.read()
+            if self.parse_cache is None:
+                state = scan_story(source)
+            else:
+                state = json.loads(self.parse_cache.get('story', source, index_source))
+            # The file may have changed while it was read; only a scan of
+            # what is still on disk is worth persisting
+            stat = os.stat(path)
+            if (stat.st_mtime_ns, stat.st_size) == signature and len(source) == stat.st_size:
+                write_sidecar(path, signature, state)
+
+        index = StoryIndex(path, signature, state)
+        with self.lock:
+            self.entries[path] = index
+        return index
@@ -0,0 +1,152 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# Memory budget for cached parse results
+PARSE_CACHE_BYTES = int(os.environ.get('BRANCHED_PARSE_CACHE_MB', 64)) * 1024 * 1024
+
+# Directory for the on-disk tier; unset keeps the cache in memory only
+PARSE_CACHE_DIR = os.environ.get('BRANCHED_PARSE_CACHE_DIR')
+PARSE_CACHE_DISK_BYTES = int(os.environ.get('BRANCHED_PARSE_CACHE_DISK_MB', 512)) * 1024 * 1024
+
+# Bump when a parser's output changes so old disk entries stop matching
+CACHE_FORMAT = 1
+
+
+class ParseCache:
+    """Serialized parse results keyed by a hash of the source bytes.
+
+    Identical bytes parse to identical results, so a file is only parsed
+    again when its content actually changes, however it arrives. Results
+    are kept as bytes in an LRU bounded by max_bytes and, when a directory
+    is configured, written to disk so they outlive restarts. Disk entries
+    are touched on every hit and the least recently used are pruned once
+    the directory grows past disk_max_bytes.
+    """
+
+    def __init__(self, max_bytes=PARSE_CACHE_BYTES, directory=PARSE_CACHE_DIR,
+                 disk_max_bytes=PARSE_CACHE_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.disk_size = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def key(self, kind, digest):
+        """Cache key for a hex SHA-256 digest of the source bytes"""
+        return f'{kind}-{CACHE_FORMAT}-{digest}'
+
+    def get(self, kind, source, build):
+        """Cached result for source, calling build(source) -> bytes on a miss"""
+        key = self.key(kind, hashlib.sha256(source).hexdigest())
+        body = self.lookup(key)
+        if body is None:
+            body = build(source)
+            self.store(key, body)
+        return body
+
+    def lookup(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return body
+
+        body = self.read_disk(key)
+        if body is not None:
+            with self.lock:
+                self.hits += 1
+            self.remember(key, body)
+            return body
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def store(self, key, body):
+        self.remember(key, body)
+        self.write_disk(key, body)
+
+    def remember(self, key, body):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+
+            if len(body) <= self.max_bytes:
+                self.entries[key] = body
+                self.size += len(body)
+
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def disk_path(self, key):
+        return os.path.join(self.directory, key[-2:], key)
+
+    def read_disk(self, key):
+        if not self.directory:
+            return None
+        path = self.disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return body
+
+    def write_disk(self, key, body):
+        if not self.directory:
+            return
+        path = self.disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(body)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Error writing parse cache entry {path}: {e}")
+            return
+
+        with self.lock:
+            if self.disk_size is not None:
+                self.disk_size += len(body)
+            prune = self.disk_size is None or self.disk_size > self.disk_max_bytes
+        if prune:
+            self.prune_disk()
+
+    def prune_disk(self):
+        """Delete the least recently used disk entries until under budget"""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime_ns, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+        with self.lock:
+            self.disk_size = total
+
+
+parse_cache = ParseCache()
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Story preview runtime - renders passages the way the editor's preview does
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+from model import passage_record
+from twee import TweeParser
+
+# Same patterns as renderPreviewPassage()/processConditionals() in static/app.js
+IF_BLOCK_REGEX = re.compile(r'<<if\s+((?:(?!>>).)+)>>([\s\S]*?)<<endif>>')
+IF_OPEN_REGEX = re.compile(r'^<<if\s+')
+ELSEIF_REGEX = re.compile(r'^<<else\s*if\s+((?:(?!>>).)+)>>')
+SET_REGEX = re.compile(r'<<set\s+[^>]+>>')
+PRINT_REGEX = re.compile(r'<<print\s+([^>]+)>>')
+DISPLAY_REGEX = re.compile(r'<<display\s+"([^"]+)">>')
+CLICK_REGEX = re.compile(r'<<click\s+"([^"]+)">>')
+CLICK_CLOSE_REGEX = re.compile(r'<</?click>>')
+MACRO_REGEX = re.compile(r'<<[^>]+>>')
+LINK_REGEX = re.compile(r'\[\[([^\]]+)\]\]')
+BOLD_REGEX = re.compile(r'\*\*([^*]+)\*\*')
+ITALIC_REGEX = re.compile(r'//([^/]+)//')
+
+# Same patterns as scanAndPopulateVariables()
+VARIABLE_REGEX = re.compile(r'\$([A-Za-z_][A-Za-z0-9_]*)')
+SET_TARGET_REGEX = re.compile(r'<<set\s+\$([A-Za-z_][A-Za-z0-9_]*)')
+SET_VALUE_REGEX = re.compile(r'<<set\s+\$([A-Za-z_][A-Za-z0-9_]*)\s*=\s*(.+?)>>')
+NUMBER_REGEX = re.compile(r'^[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?$|^0[xX][0-9a-fA-F]+$')
+
+# Checked in this order, like evaluateCondition()
+OPERATORS = ('==', '!=', '>=', '<=', '>', '<', 'is', 'isnt')
+
+MAX_CACHED_PROGRAMS = 4096
+MAX_CACHED_RENDERS = 16384
+
+
+def parse_literal(text):
+    """Turn a macro argument into a value the way the editor does"""
+    if NUMBER_REGEX.match(text):
+        return int(text, 16) if text[:2].lower() == '0x' else float(text) if any(c in text for c in '.eE') else int(text)
+    if text == 'true':
+        return True
+    if text == 'false':
+        return False
+    if len(text) >= 2 and text.startswith('"') and text.endswith('"'):
+        return text[1:-1]
+    return text
+
+
+def to_number(value):
+    """JavaScript ToNumber for the value types variables can hold"""
+    if isinstance(value, bool):
+        return 1 if value else 0
+    if isinstance(value, (int, float)):
+        return value
+    text = str(value).strip()
+    if text == '':
+        return 0
+    return parse_literal(text) if NUMBER_REGEX.match(text) else float('nan')
+
+
+def loose_equals(a, b):
+    """JavaScript ==, which the preview uses for ==/is"""
+    if isinstance(a, str) and isinstance(b, str):
+        return a == b
+    return to_number(a) == to_number(b)
+
+
+def compare(a, op, b):
+    if op in ('==', 'is'):
+        return loose_equals(a, b)
+    if op in ('!=', 'isnt'):
+        return not loose_equals(a, b)
+    if not (isinstance(a, str) and isinstance(b, str)):
+        a, b = to_number(a), to_number(b)
+    if op == '>=':
+        return a >= b
+    if op == '<=':
+        return a <= b
+    if op == '>':
+        return a > b
+    return a < b
+
+
+def is_truthy(value):
+    if value is None or value is False or value == '':
+        return False
+    return not (isinstance(value, (int, float)) and not isinstance(value, bool) and value == 0)
+
+
+def compile_condition(condition):
+    """Compile an <<if>> condition into ('truthy', var) or ('compare', var, op, value)"""
+    condition = condition.strip()
+    for op in OPERATORS:
+        separator = f' {op} '
+        if separator in condition:
+            parts = condition.split(separator)
+            if len(parts) != 2:
+                return ('false',)
+            return ('compare', parts[0].strip(), op, parse_literal(parts[1].strip()))
+    return ('truthy', condition)
+
+
+def evaluate_condition(compiled, variables):
+    kind = compiled[0]
+    if kind == 'truthy':
+        return is_truthy(variables.get(compiled[1]))
+    if kind == 'compare':
+        _, name, op, value = compiled
+        if variables.get(name) is None:
+            return False
+        return compare(variables[name], op, value)
+    return False
+
+
+def segment(text):
+    """Static text plus the <<set>> assignments it contains"""
+    sets = [(f'${name}', parse_literal(value.strip())) for name, value in SET_VALUE_REGEX.findall(text)]
+    return SET_REGEX.sub('', text), sets
+
+
+def split_sections(condition, block):
+    """Split an <<if>> body into (condition, text, sets) sections.
+
+    Nested <<if>>s are skipped over the same way processConditionals()
+    does, and a None condition marks the <<else>> section.
+    """
+    sections = []
+    current = compile_condition(condition)
+    buffer = []
+    depth = 0
+    i = 0
+
+    while True:
+        start = block.find('<<', i)
+        end = block.find('>>', start) if start != -1 else -1
+        if end == -1:
+            buffer.append(block[i:])
+            break
+
+        buffer.append(block[i:start])
+        macro = block[start:end + 2]
+        i = end + 2
+
+        if IF_OPEN_REGEX.match(macro):
+            depth += 1
+            buffer.append(macro)
+        elif macro == '<<endif>>' and depth > 0:
+            depth -= 1
+            buffer.append(macro)
+        elif depth == 0:
+            elseif = ELSEIF_REGEX.match(macro)
+            if elseif or macro == '<<else>>':
+                sections.append((current,) + segment(''.join(buffer)))
+                current = compile_condition(elseif.group(1)) if elseif else None
+                buffer = []
+            else:
+                buffer.append(macro)
+        else:
+            buffer.append(macro)
+
+    sections.append((current,) + segment(''.join(buffer)))
+    return sections
+
+
+class Program:
+    """A passage compiled into static text and branch instructions"""
+
+    __slots__ = ('instructions', 'reads', 'writes')
+
+    def __init__(self, content):
+        self.instructions = []
+        position = 0
+        for match in IF_BLOCK_REGEX.finditer(content):
+            self.instructions.append(('text',) + segment(content[position:match.start()]))
+            self.instructions.append(('branch', split_sections(match.group(1), match.group(2))))
+            position = match.end()
+        self.instructions.append(('text',) + segment(content[position:]))
+
+        self.writes = sorted({f'${name}' for name in SET_TARGET_REGEX.findall(content)})
+        read_text = SET_TARGET_REGEX.sub('<<set ', content)
+        self.reads = sorted({f'${name}' for name in VARIABLE_REGEX.findall(read_text)})
+
+    def run(self, variables, apply_sets=False):
+        """Pick a section for each branch; returns the path taken and the chosen text"""
+        path = []
+        parts = []
+        for instruction in self.instructions:
+            if instruction[0] == 'text':
+                _, text, sets = instruction
+            else:
+                chosen = -1
+                for index, (condition, _, _) in enumerate(instruction[1]):
+                    if condition is None or evaluate_condition(condition, variables):
+                        chosen = index
+                        break
+                path.append(chosen)
+                if chosen == -1:
+                    continue
+                _, text, sets = instruction[1][chosen]
+
+            parts.append(text)
+            if apply_sets:
+                variables.update(sets)
+        return tuple(path), ''.join(parts)
+
+
+def render_link(match):
+    link = match.group(1)
+    display_text = target_title = link
+    if '|' in link:
+        parts = link.split('|')
+        display_text, target_title = parts[0].strip(), parts[1].strip()
+    elif '<-' in link:
+        parts = link.split('<-')
+        target_title, display_text = parts[0].strip(), parts[1].strip()
+    elif '->' in link:
+        parts = link.split('->')
+        display_text, target_title = parts[0].strip(), parts[1].strip()
+
+    return (f'<span class="preview-link" data-target="{target_title}" '
+            f'style="color: #0066cc; cursor: pointer; text-decoration: underline;">{display_text}</span>')
+
+
+def render_text(content):
+    """The formatting steps renderPreviewPassage() applies after conditionals"""
+    content = PRINT_REGEX.sub(r'<em>[value: \1]</em>', content)
+    content = DISPLAY_REGEX.sub(r'<em>[includes: \1]</em>', content)
+    content = CLICK_REGEX.sub(r'<span class="preview-action" style="color: #0066cc; cursor: pointer;">[\1]</span>', content)
+    content = CLICK_CLOSE_REGEX.sub('', content)
+    content = MACRO_REGEX.sub('', content)
+    content = LINK_REGEX.sub(render_link, content)
+    content = content.replace('\n', '<br>')
+    content = BOLD_REGEX.sub(r'<strong>\1</strong>', content)
+    content = ITALIC_REGEX.sub(r'<em>\1</em>', content)
+    return f'<div class="preview-passage"><div class="preview-text">{content}</div></div>'
+
+
+def initial_variables(passages):
+    """Initial values from a StoryVariables passage tagged $metadata"""
+    variables = {}
+    for passage in passages:
+        if passage.get('title') == 'StoryVariables' and '$metadata' in (passage.get('tags') or ''):
+            for name, value in SET_VALUE_REGEX.findall(passage.get('content') or ''):
+                variables[f'${name}'] = parse_literal(value.strip())
+    return variables
+
+
+class PreviewRuntime:
+    """Compiles passages once and renders them against a variable state.
+
+    Programs are cached by a hash of the passage text, so editing one
+    passage recompiles only that passage. A render only depends on the
+    text and which section each <<if>> picked, so the HTML is cached by
+    that pair as well and most renders skip formatting altogether.
+    """
+
+    def __init__(self, max_programs=MAX_CACHED_PROGRAMS, max_renders=MAX_CACHED_RENDERS):
+        self.max_programs = max_programs
+        self.max_renders = max_renders
+        self.programs = OrderedDict()
+        self.renders = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def cached(self, cache, key, limit, build):
+        with self.lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        value = build()
+        with self.lock:
+            cache[key] = value
+            while len(cache) > limit:
+                cache.popitem(last=False)
+        return value
+
+    def compile(self, content):
+        """Return (content hash, Program) for a passage's text"""
+        content = content or ''
+        key = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        return key, self.cached(self.programs, key, self.max_programs, lambda: Program(content))
+
+    def render(self, passage, variables, apply_sets=False):
+        """Render one passage to preview HTML.
+
+        The editor's preview strips <<set>> without running it; pass
+        apply_sets=True to have the chosen sections' assignments update
+        `variables` in place.
+        """
+        key, program = self.compile(passage.get('content'))
+        path, text = program.run(variables, apply_sets)
+        return self.cached(self.renders, (key, path), self.max_renders, lambda: render_text(text))
+
+    def render_all(self, data, variables=None):
+        """Render every passage of a story against the same variable state"""
+        passages = [passage_record(item) for item in data.get('passages', [])]
+        state = initial_variables(passages)
+        state.update(variables or {})
+        return {passage['id']: self.render(passage, dict(state)) for passage in passages}
+
+    def variable_index(self, data):
+        """Map each variable to the passages that read or write it"""
+        passages = [passage_record(item) for item in data.get('passages', [])]
+        initial = initial_variables(passages)
+        index = {}
+
+        for passage in passages:
+            _, program = self.compile(passage.get('content'))
+            for kind, names in (('reads', program.reads), ('writes', program.writes)):
+                for name in names:
+                    entry = index.setdefault(name, {'initial': initial.get(name, 0), 'reads': [], 'writes': []})
+                    entry[kind].append(passage['id'])
+
+        for name, value in initial.items():
+            index.setdefault(name, {'initial': value, 'reads': [], 'writes': []})
+        return dict(sorted(index.items()))
+
+
+def parse_assignment(text):
+    name, _, value = text.partition('=')
+    name = name.strip()
+    return (name if name.startswith('$') else f'${name}'), parse_literal(value.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render Twee passages the way the editor preview does')
+    parser.add_argument('file', help='.twee file to render')
+    parser.add_argument('-p', '--passage', action='append', help='title of a passage to render (default: all)')
+    parser.add_argument('--var', action='append', default=[], metavar='$NAME=VALUE',
+                        help='set a variable before rendering')
+    parser.add_argument('--variables', action='store_true', help='print the variable index instead')
+    parser.add_argument('-o', '--output', help='write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    with open(args.file, 'r', encoding='utf-8') as f:
+        story = TweeParser().parse_story(f)
+
+    runtime = PreviewRuntime()
+    if args.variables:
+        result = runtime.variable_index(story)
+    else:
+        # Story is read-only, so the selection goes into a plain dict
+        passages = story['passages']
+        if args.passage:
+            passages = [p for p in passages if p['title'] in args.passage]
+        data = {'lanes': story['lanes'], 'passages': passages}
+        rendered = runtime.render_all(data, dict(parse_assignment(text) for text in args.var))
+        titles = {p['id']: p['title'] for p in passages}
+        result = {titles[passage_id]: html for passage_id, html in rendered.items()}
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+import bisect
+import re
+import threading
+
+from model import passage_record
+
+TOKEN_REGEX = re.compile(r'\w+')
+QUERY_REGEX = re.compile(r'"([^"]*)"|(\S+)')
+
+# Same weights as performSearch() in static/search.js
+FIELD_WEIGHTS = {'title': 10, 'tags': 7, 'content': 3}
+LANE_WEIGHT = 5
+
+DEFAULT_PER_PAGE = 50
+
+
+def tokenize(text):
+    return TOKEN_REGEX.findall((text or '').lower())
+
+
+def parse_query(query):
+    """Split a query into term groups and filters.
+
+    Bare words match whole tokens, `word*` matches a token prefix and
+    "quoted words" must appear next to each other in the same field.
+    `tag:name` and `$lane:name` (or `lane:name`) filter the results.
+    """
+    terms = []
+    tags = []
+    lanes = []
+
+    for match in QUERY_REGEX.finditer(query or ''):
+        phrase, word = match.groups()
+        if phrase is not None:
+            tokens = tokenize(phrase)
+            if tokens:
+                terms.append(('phrase', tokens))
+            continue
+
+        lowered = word.lower()
+        if lowered.startswith('tag:'):
+            tags.append(lowered[4:])
+        elif lowered.startswith('$lane:'):
+            lanes.append(lowered[6:])
+        elif lowered.startswith('lane:'):
+            lanes.append(lowered[5:])
+        elif lowered.endswith('*'):
+            for token in tokenize(lowered[:-1]):
+                terms.append(('prefix', [token]))
+        else:
+            for token in tokenize(lowered):
+                terms.append(('word', [token]))
+
+    return terms, tags, lanes
+
+
+class SearchIndex:
+    """Inverted index over passage titles, tags and content.
+
+    postings maps token -> {passage_id: {field: [positions]}}. Each passage
+    remembers its own tokens so it can be re-indexed on its own when it
+    changes.
+    """
+
+    def __init__(self, data=None):
+        self.postings = {}
+        self.passages = {}
+        self.passage_tokens = {}
+        self.order = {}
+        self.lane_names = {}
+        self.lane_members = {}
+        self.vocabulary = []
+        self.vocabulary_dirty = False
+        self.next_order = 0
+        self.lock = threading.RLock()
+
+        if data:
+            self.set_lanes(data.get('lanes', []))
+            for item in data.get('passages', []):
+                self.update_passage(passage_record(item))
+
+    def set_lanes(self, lanes):
+        with self.lock:
+            self.lane_names = {lane['id']: (lane.get('name') or '').lower() for lane in lanes}
+
+    def update_passage(self, passage):
+        with self.lock:
+            passage_id = passage['id']
+            self.remove_passage(passage_id, keep_order=True)
+
+            self.passages[passage_id] = passage
+            if passage_id not in self.order:
+                self.order[passage_id] = self.next_order
+                self.next_order += 1
+            self.lane_members.setdefault(passage.get('laneId'), set()).add(passage_id)
+
+            entries = {}
+            for field in FIELD_WEIGHTS:
+                for position, token in enumerate(tokenize(passage.get(field))):
+                    entry = entries.get(token)
+                    if entry is None:
+                        entry = entries[token] = {}
+                    positions = entry.get(field)
+                    if positions is None:
+                        entry[field] = [position]
+                    else:
+                        positions.append(position)
+
+            for token, entry in entries.items():
+                fields = self.postings.get(token)
+                if fields is None:
+                    fields = self.postings[token] = {}
+                    self.vocabulary_dirty = True
+                fields[passage_id] = entry
+            self.passage_tokens[passage_id] = entries.keys()
+
+    def remove_passage(self, passage_id, keep_order=False):
+        with self.lock:
+            passage = self.passages.pop(passage_id, None)
+            if passage is None:
+                return
+            if not keep_order:
+                self.order.pop(passage_id, None)
+            self.lane_members.get(passage.get('laneId'), set()).discard(passage_id)
+
+            for token in self.passage_tokens.pop(passage_id, ()):
+                fields = self.postings[token]
+                fields.pop(passage_id, None)
+                if not fields:
+                    del self.postings[token]
+                    self.vocabulary_dirty = True
+
+    def apply_delta(self, delta, lanes=None):
+        """Re-index only the passages a ProjectStore delta touched"""
+        with self.lock:
+            if lanes is not None:
+                self.set_lanes(lanes)
+            for passage_id in delta.get('remove', []):
+                self.remove_passage(passage_id)
+            for item in delta.get('put', {}).values():
+                self.update_passage(passage_record(item))
+
+    def expand_prefix(self, prefix):
+        if self.vocabulary_dirty:
+            self.vocabulary = sorted(self.postings)
+            self.vocabulary_dirty = False
+
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        tokens = []
+        for token in self.vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            tokens.append(token)
+        return tokens
+
+    def match_term(self, kind, tokens):
+        """Return {passage_id: {field: hit_count}} for one query term"""
+        if kind == 'word':
+            candidates = [tokens[0]]
+        elif kind == 'prefix':
+            candidates = self.expand_prefix(tokens[0])
+        else:
+            return self.match_phrase(tokens)
+
+        hits = {}
+        for token in candidates:
+            for passage_id, fields in self.postings.get(token, {}).items():
+                passage_hits = hits.setdefault(passage_id, {})
+                for field, positions in fields.items():
+                    passage_hits[field] = passage_hits.get(field, 0) + len(positions)
+        return hits
+
+    def match_phrase(self, tokens):
+        first = self.postings.get(tokens[0], {})
+        rest = [self.postings.get(token, {}) for token in tokens[1:]]
+
+        hits = {}
+        for passage_id, fields in first.items():
+            if not all(passage_id in postings for postings in rest):
+                continue
+            for field, positions in fields.items():
+                following = [set(postings[passage_id].get(field, ())) for postings in rest]
+                count = sum(
+                    1 for start in positions
+                    if all(start + offset + 1 in later for offset, later in enumerate(following))
+                )
+                if count:
+                    hits.setdefault(passage_id, {})[field] = count
+        return hits
+
+    def lane_matches(self, kind, tokens):
+        phrase = ' '.join(tokens)
+        matched = set()
+        for lane_id, name in self.lane_names.items():
+            lane_tokens = tokenize(name)
+            if kind == 'prefix':
+                found = any(token.startswith(phrase) for token in lane_tokens)
+            elif kind == 'word':
+                found = phrase in lane_tokens
+            else:
+                found = phrase in ' '.join(lane_tokens)
+            if found:
+                matched.update(self.lane_members.get(lane_id, ()))
+        return matched
+
+    def passes_filters(self, passage, tags, lanes):
+        if tags:
+            passage_tags = set(tag.lower() for tag in (passage.get('tags') or '').split())
+            if not all(tag in passage_tags for tag in tags):
+                return False
+        if lanes:
+            lane_name = self.lane_names.get(passage.get('laneId'), '')
+            if lane_name not in lanes:
+                return False
+        return True
+
+    def search(self, query, page=1, per_page=DEFAULT_PER_PAGE):
+        """Ranked, paginated search; passages matching any term are returned"""
+        with self.lock:
+            terms, tags, lanes = parse_query(query)
+
+            if terms:
+                scores = {}
+                matches = {}
+                for kind, tokens in terms:
+                    term = ' '.join(tokens)
+                    for passage_id, fields in self.match_term(kind, tokens).items():
+                        score = 0
+                        for field, count in fields.items():
+                            score += FIELD_WEIGHTS[field]
+                            if field == 'content':
+                                score += count
+                            matches.setdefault(passage_id, []).append(
+                                {'type': field, 'term': term, 'count': count})
+                        scores[passage_id] = scores.get(passage_id, 0) + score
+
+                    for passage_id in self.lane_matches(kind, tokens):
+                        scores[passage_id] = scores.get(passage_id, 0) + LANE_WEIGHT
+                        matches.setdefault(passage_id, []).append({'type': 'lane', 'term': term})
+            else:
+                scores = dict.fromkeys(self.passages, 0)
+                matches = {}
+
+            ranked = [
+                (score, passage_id) for passage_id, score in scores.items()
+                if self.passes_filters(self.passages[passage_id], tags, lanes)
+            ]
+            ranked.sort(key=lambda item: (-item[0], self.order[item[1]]))
+
+            start = (max(page, 1) - 1) * per_page
+            results = []
+            for score, passage_id in ranked[start:start + per_page]:
+                passage = self.passages[passage_id]
+                results.append({
+                    'id': passage_id,
+                    'title': passage.get('title'),
+                    'laneId': passage.get('laneId'),
+                    'tags': passage.get('tags', ''),
+                    'score': score,
+                    'matches': matches.get(passage_id, [])
+                })
+
+            return {
+                'total': len(ranked),
+                'page': max(page, 1),
+                'perPage': per_page,
+                'results': results
+            }
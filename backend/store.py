@@ -0,0 +1,313 @@
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Seconds between fsyncs of journals that have pending writes
+FSYNC_INTERVAL = 0.5
+
+# A journal is compacted into the snapshot once it grows past this size
+# or past the size of the snapshot itself, whichever is larger
+COMPACT_MIN_BYTES = 256 * 1024
+
+
+def passage_key(passage):
+    """Passages are dicts with an 'id', or [id, passage] pairs from the client"""
+    if isinstance(passage, dict):
+        return passage.get('id')
+    return passage[0]
+
+
+def dumps(data):
+    return json.dumps(data, separators=(',', ':'))
+
+
+def diff_project(old, new):
+    """Passage-level delta that turns project `old` into project `new`"""
+    delta = {}
+
+    fields = {key: value for key, value in new.items()
+              if key != 'passages' and old.get(key) != value}
+    dropped = [key for key in old if key != 'passages' and key not in new]
+    if fields:
+        delta['fields'] = fields
+    if dropped:
+        delta['drop'] = dropped
+
+    old_passages = {passage_key(p): p for p in old.get('passages', [])}
+    new_order = [passage_key(p) for p in new.get('passages', [])]
+
+    put = {}
+    for passage in new.get('passages', []):
+        key = passage_key(passage)
+        if old_passages.get(key) != passage:
+            put[key] = passage
+    if put:
+        delta['put'] = put
+
+    new_keys = set(new_order)
+    removed = [key for key in old_passages if key not in new_keys]
+    if removed:
+        delta['remove'] = removed
+
+    if new_order != list(old_passages):
+        delta['order'] = new_order
+
+    return delta
+
+
+def apply_delta(project, delta):
+    """Apply a delta from diff_project(); replaying one twice is harmless"""
+    for key in delta.get('drop', []):
+        project.pop(key, None)
+    project.update(delta.get('fields', {}))
+
+    passages = {passage_key(p): p for p in project.get('passages', [])}
+    for key in delta.get('remove', []):
+        passages.pop(key, None)
+    for key, passage in delta.get('put', {}).items():
+        passages[key] = passage
+
+    order = delta.get('order', passages.keys())
+    project['passages'] = [passages[key] for key in order if key in passages]
+    return project
+
+
+def write_atomic(path, text):
+    """Write via a temp file and rename so readers never see a partial file"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+class ProjectStore:
+    """Project storage as a snapshot plus an append-only journal of deltas.
+
+    uploads/<id>.json holds the last compacted snapshot and
+    uploads/<id>.journal holds one JSON line per save with only the
+    passages and fields that changed. Journals are fsynced in batches by a
+    background thread and folded back into the snapshot once they grow.
+    """
+
+    def __init__(self, folder, fsync_interval=FSYNC_INTERVAL, compact_min_bytes=COMPACT_MIN_BYTES):
+        self.folder = folder
+        self.fsync_interval = fsync_interval
+        self.compact_min_bytes = compact_min_bytes
+
+        self.projects = {}
+        self.journals = {}
+        self.snapshot_sizes = {}
+        self.dirty = set()
+        self.compacting = set()
+        self.lock = threading.RLock()
+
+        self.compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='compact')
+        self.flusher = threading.Thread(target=self.flush_loop, daemon=True)
+        self.flusher.start()
+
+    def snapshot_path(self, project_id):
+        return os.path.join(self.folder, f'{project_id}.json')
+
+    def journal_path(self, project_id):
+        return os.path.join(self.folder, f'{project_id}.journal')
+
+    def old_journal_path(self, project_id):
+        return os.path.join(self.folder, f'{project_id}.journal.old')
+
+    def read_project(self, project_id):
+        """Rebuild a project from its snapshot and any journals"""
+        snapshot_path = self.snapshot_path(project_id)
+        journal_paths = [self.old_journal_path(project_id), self.journal_path(project_id)]
+
+        if not os.path.exists(snapshot_path) and not any(os.path.exists(p) for p in journal_paths):
+            return None
+
+        project = {}
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, 'r') as f:
+                project = json.load(f)
+            self.snapshot_sizes[project_id] = os.path.getsize(snapshot_path)
+
+        for path in journal_paths:
+            if os.path.exists(path):
+                self.replay_journal(path, project)
+
+        return project
+
+    def replay_journal(self, path, project):
+        """Apply a journal's deltas to project and cut off a torn final line.
+
+        Only newline-terminated lines are complete, since each delta is
+        written with its newline in one write. Whatever follows the last
+        good line was interrupted by a crash. It is truncated so the next
+        append starts a fresh line instead of extending the torn one, which
+        would make every later save unreadable.
+        """
+        good = 0
+        with open(path, 'r+b') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    delta = json.loads(line)
+                except ValueError:
+                    break
+                apply_delta(project, delta)
+                good += len(line)
+
+            if good < os.fstat(f.fileno()).st_size:
+                f.truncate(good)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def get_project(self, project_id):
+        with self.lock:
+            if project_id not in self.projects:
+                project = self.read_project(project_id)
+                if project is None:
+                    return None
+                self.projects[project_id] = project
+            return self.projects[project_id]
+
+    def load(self, project_id):
+        """Return the stored project, or None; callers must not mutate it"""
+        return self.get_project(project_id)
+
+    def save(self, project_id, data):
+        """Append the passage-level changes between the stored project and data.
+
+        The store keeps a reference to data, so callers must not mutate it
+        afterwards.
+        """
+        with self.lock:
+            old = self.get_project(project_id) or {}
+            delta = diff_project(old, data)
+            self.projects[project_id] = data
+
+            if delta:
+                self.write_journal(project_id, delta)
+            return delta
+
+    def append(self, project_id, delta):
+        """Journal a delta built by the caller instead of diffing whole projects.
+
+        For writers that already know what changed, such as the
+        collaboration server. Returns the updated project, which callers
+        must not mutate.
+        """
+        with self.lock:
+            project = self.get_project(project_id)
+            if not delta:
+                return project
+            if project is None:
+                project = self.projects[project_id] = {}
+            apply_delta(project, delta)
+            self.write_journal(project_id, delta)
+            return project
+
+    def write_journal(self, project_id, delta):
+        """Append one delta line and compact once the journal is big enough; needs the lock"""
+        journal = self.journals.get(project_id)
+        if journal is None:
+            journal = open(self.journal_path(project_id), 'ab')
+            self.journals[project_id] = journal
+        journal.write((dumps(delta) + '\n').encode('utf-8'))
+        journal.flush()
+        self.dirty.add(project_id)
+
+        size = journal.tell()
+
+        threshold = max(self.compact_min_bytes, self.snapshot_sizes.get(project_id, 0))
+        if size > threshold and project_id not in self.compacting:
+            self.compacting.add(project_id)
+            self.compactor.submit(self.compact, project_id)
+
+    def flush_loop(self):
+        while True:
+            time.sleep(self.fsync_interval)
+            self.flush()
+
+    def flush(self):
+        """fsync every journal written since the last flush"""
+        with self.lock:
+            dirty = [self.journals[project_id] for project_id in self.dirty
+                     if project_id in self.journals]
+            self.dirty.clear()
+
+        for journal in dirty:
+            try:
+                os.fsync(journal.fileno())
+            except (ValueError, OSError):
+                # Closed by a compaction, which fsyncs it first
+                pass
+
+    def close_journal(self, project_id):
+        journal = self.journals.pop(project_id, None)
+        if journal is not None:
+            journal.flush()
+            os.fsync(journal.fileno())
+            journal.close()
+        self.dirty.discard(project_id)
+
+    def rotate_journal(self, project_id):
+        """Move the journal aside, appending to a leftover old journal if any"""
+        journal_path = self.journal_path(project_id)
+        old_journal_path = self.old_journal_path(project_id)
+        if not os.path.exists(journal_path):
+            return
+
+        if not os.path.exists(old_journal_path):
+            os.replace(journal_path, old_journal_path)
+            return
+
+        with open(old_journal_path, 'ab') as dst, open(journal_path, 'rb') as src:
+            shutil.copyfileobj(src, dst)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.remove(journal_path)
+
+    def compact(self, project_id):
+        """Fold the journal into a fresh snapshot.
+
+        The journal is renamed aside under the lock so saves can keep
+        appending to a new one while the snapshot is written. A crash at any
+        point leaves snapshot + old journal + journal, which replays to the
+        same project.
+        """
+        try:
+            with self.lock:
+                project = self.projects.get(project_id)
+                if project is None:
+                    return
+                self.close_journal(project_id)
+                self.rotate_journal(project_id)
+                text = dumps(project)
+
+            write_atomic(self.snapshot_path(project_id), text)
+
+            with self.lock:
+                if os.path.exists(self.old_journal_path(project_id)):
+                    os.remove(self.old_journal_path(project_id))
+                self.snapshot_sizes[project_id] = len(text)
+        finally:
+            with self.lock:
+                self.compacting.discard(project_id)
+
+    def close(self):
+        """Compact every open project and release journal handles"""
+        self.compactor.shutdown(wait=True)
+        with self.lock:
+            for project_id in list(self.projects):
+                self.compacting.add(project_id)
+                self.compact(project_id)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Synthetic Twee story generator for benchmarks
+"""
+
+import argparse
+import random
+import sys
+
+WORDS = (
+    'the door opens onto a narrow corridor lit by flickering lamps and somewhere '
+    'ahead a voice calls your name while the floor creaks beneath careful steps '
+    'you remember the map the key the promise made at dawn before the storm'
+).split()
+
+
+def passage_title(index):
+    return 'Start' if index == 0 else f'Passage_{index}'
+
+
+def iter_story(passages=1000, lanes=5, fanout=2, cycle_ratio=0.1, length=40, seed=1):
+    """Yield a deterministic story one passage of Twee text at a time.
+
+    Each passage links to `fanout` others: mostly to passages a little
+    further on, and with probability `cycle_ratio` back to an earlier one,
+    which closes a cycle. `length` is the number of words of prose.
+    """
+    rng = random.Random(seed)
+
+    for index in range(passages):
+        if index == 0:
+            header = ':: Start'
+        else:
+            header = f':: {passage_title(index)} [Lane_{index % lanes + 1}]'
+
+        words = [rng.choice(WORDS) for _ in range(length)]
+        links = []
+        for _ in range(fanout):
+            if index > 0 and rng.random() < cycle_ratio:
+                target = rng.randrange(index)
+            else:
+                target = index + 1 + rng.randrange(max(1, min(10, passages - index - 1)))
+            if target < passages:
+                links.append(f'[[{passage_title(target)}]]')
+
+        yield f"{header}\n{' '.join(words)}\n\n{' '.join(links)}\n\n"
+
+
+def generate_story(**kwargs):
+    return ''.join(iter_story(**kwargs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic Twee story')
+    parser.add_argument('-n', '--passages', type=int, default=1000)
+    parser.add_argument('--lanes', type=int, default=5)
+    parser.add_argument('--fanout', type=int, default=2, help='links per passage')
+    parser.add_argument('--cycle-ratio', type=float, default=0.1,
+                        help='fraction of links pointing back to an earlier passage')
+    parser.add_argument('--length', type=int, default=40, help='words of prose per passage')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-o', '--output', help='file to write (default: stdout)')
+    args = parser.parse_args()
+
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for chunk in iter_story(args.passages, args.lanes, args.fanout,
+                                args.cycle_ratio, args.length, args.seed):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,60 +1,146 @@
 import re
 
+from model import Story
+
+HEADER_PREFIX = ':: '
+HEADER_REGEX = re.compile(r'^([^\[]+?)\s*(?:\[([^\]]*)\])?\s*$')
+
+
+def iter_lines(source):
+    """Yield lines without their line endings from a string or file object"""
+    if isinstance(source, str):
+        start = 0
+        length = len(source)
+        while start < length:
+            end = source.find('\n', start)
+            if end == -1:
+                end = length
+            line = source[start:end]
+            start = end + 1
+            yield line[:-1] if line.endswith('\r') else line
+        return
+
+    for line in source:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.rstrip('\n')
+        yield line[:-1] if line.endswith('\r') else line
+
+
+def parse_header(line):
+    """Split a ':: Title [tags]' line into (title, tags), or None"""
+    if not line.startswith(HEADER_PREFIX):
+        return None
+
+    match = HEADER_REGEX.match(line[len(HEADER_PREFIX):])
+    if not match:
+        return None
+
+    title = match.group(1).strip()
+    tags = match.group(2).strip() if match.group(2) else ''
+    return title, tags
+
+
 class TweeParser:
-    def parse(self, content):
-        passages = []
-        lanes = [{'id': 'metadata', 'name': 'Metadata', 'isMetadata': True}]
-        lane_map = {}
-
-        passage_regex = r':: ([^\[]+)(?:\[([^\]]*)\])?\n([\s\S]*?)(?=\n:: |\n*$)'
-        matches = re.finditer(passage_regex, content)
-
-        passage_id = 1
-        lane_id = 1
-
-        for match in matches:
-            title = match.group(1).strip()
-            tags = match.group(2).strip() if match.group(2) else ''
-            passage_content = match.group(3).strip()
-
-            is_metadata = title == 'Start' or 'info' in tags
-
-            if is_metadata:
-                lane_name = 'Metadata'
-            else:
-                lane_name = tags if tags else 'Main'
-
-                if lane_name not in lane_map:
-                    lane = {
-                        'id': f'lane_{lane_id}',
-                        'name': lane_name,
-                        'isMetadata': False
-                    }
-                    lanes.append(lane)
-                    lane_map[lane_name] = f'lane_{lane_id}'
-                    lane_id += 1
-
-            passage = {
-                'id': f'passage_{passage_id}',
-                'title': title,
-                'content': passage_content,
-                'laneId': 'metadata' if is_metadata else lane_map.get(lane_name)
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lanes = [{'id': 'metadata', 'name': 'Metadata', 'isMetadata': True}]
+        self.lane_map = {}
+        self.passage_id = 1
+        self.lane_id = 1
+
+    def iter_sections(self, source):
+        """Yield ((title, tags), lines) for each passage as it closes.
+
+        `source` may be a string or a text/binary file object. Only the lines
+        of the passage currently being read are held in memory.
+        """
+        header = None
+        lines = []
+
+        for line in iter_lines(source):
+            parsed = parse_header(line)
+            if parsed is None:
+                if header is not None:
+                    lines.append(line)
+                continue
+
+            if header is not None:
+                yield header, lines
+            header = parsed
+            lines = []
+
+        if header is not None:
+            yield header, lines
+
+    def iter_passages(self, source):
+        """Yield passage dicts one at a time; lanes are collected on `self.lanes`"""
+        self.reset()
+        for header, lines in self.iter_sections(source):
+            yield self.build_passage(header, lines)
+
+    def lane_name(self, title, tags):
+        """Lane a passage belongs in, or None for the metadata lane"""
+        if title == 'Start' or 'info' in tags:
+            return None
+        return tags if tags else 'Main'
+
+    def build_passage(self, header, lines):
+        title, tags = header
+        passage_content = '\n'.join(lines).strip()
+
+        lane_name = self.lane_name(title, tags)
+        is_metadata = lane_name is None
+
+        if not is_metadata and lane_name not in self.lane_map:
+            lane = {
+                'id': f'lane_{self.lane_id}',
+                'name': lane_name,
+                'isMetadata': False
             }
-            passages.append(passage)
-            passage_id += 1
+            self.lanes.append(lane)
+            self.lane_map[lane_name] = f'lane_{self.lane_id}'
+            self.lane_id += 1
+
+        passage = {
+            'id': f'passage_{self.passage_id}',
+            'title': title,
+            'content': passage_content,
+            'laneId': 'metadata' if is_metadata else self.lane_map.get(lane_name)
+        }
+        self.passage_id += 1
+        return passage
+
+    def parse_story(self, source):
+        """Parse into the compact columnar Story model (see model.py)"""
+        story = Story()
+        for (title, tags), lines in self.iter_sections(source):
+            lane_name = self.lane_name(title, tags)
+            lane = 0 if lane_name is None else story.lane_for_name(lane_name)
+            story.append(title, '\n'.join(lines).strip(), lane)
+        return story
+
+    def parse(self, content):
+        passages = list(self.iter_passages(content))
 
         return {
             'passages': passages,
-            'lanes': lanes
+            'lanes': self.lanes
         }
 
 
 class TweeExporter:
-    def export(self, data):
-        twee_content = []
+    def iter_export(self, data):
+        """Yield the Twee text one passage at a time"""
+        if isinstance(data, Story):
+            yield from self.iter_export_story(data)
+            return
 
         passages = data.get('passages', [])
         lanes = {lane['id']: lane for lane in data.get('lanes', [])}
+        separator = ''
 
         for passage in passages:
             lane = lanes.get(passage.get('laneId', ''))
@@ -66,6 +152,27 @@ class TweeExporter:
             title = passage.get('title', 'Untitled')
             content = passage.get('content', '')
 
-            twee_content.append(f":: {title}{tags}\n{content}\n")
+            yield f"{separator}:: {title}{tags}\n{content}\n"
+            separator = '\n'
 
-        return '\n'.join(twee_content)
\ No newline at end of file
+    def iter_export_story(self, story):
+        """Same output as iter_export, read straight from a Story's columns"""
+        lane_tags = ['' if lane.get('isMetadata', False) else f"[{lane['name']}]" for lane in story.lanes]
+        separator = ''
+
+        for index, (title, content, lane) in enumerate(zip(story.titles, story.contents, story.lane_of)):
+            if index in story.extras:
+                passage = story.get('passages')[index]
+                title, content = passage.get('title', 'Untitled'), passage.get('content', '')
+            tags = lane_tags[lane] if lane >= 0 else ''
+
+            yield f"{separator}:: {title}{tags}\n{content}\n"
+            separator = '\n'
+
+    def export_to(self, data, fileobj):
+        """Write the Twee text to a file object without building it in memory"""
+        for chunk in self.iter_export(data):
+            fileobj.write(chunk)
+
+    def export(self, data):
+        return ''.join(self.iter_export(data))
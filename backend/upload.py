@@ -0,0 +1,162 @@
+import codecs
+import hashlib
+import io
+import json
+import os
+
+# Largest story /api/import accepts
+MAX_IMPORT_BYTES = int(os.environ.get('BRANCHED_MAX_IMPORT_MB', 64)) * 1024 * 1024
+
+# Bytes read from the upload stream at a time
+READ_CHUNK = 64 * 1024
+
+
+class UploadError(ValueError):
+    """An upload that can't be read, with the byte offset and line where it failed"""
+
+    def __init__(self, reason, offset, line):
+        super().__init__(f'{reason} at byte {offset} (line {line})')
+        self.reason = reason
+        self.offset = offset
+        self.line = line
+
+    def to_dict(self):
+        return {'message': self.reason, 'offset': self.offset, 'line': self.line}
+
+
+class DecodedLines:
+    """Lines of a binary stream, decoded incrementally as UTF-8.
+
+    Only one read chunk and the current partial line are held at a time.
+    Bytes read are hashed on the way through (`digest`), and reading past
+    max_bytes or hitting invalid UTF-8 raises UploadError. A scanner (an
+    outline.StoryScanner) is fed each line with its line ending as it is
+    yielded, so the upload can be indexed without keeping its bytes.
+    """
+
+    def __init__(self, stream, max_bytes=MAX_IMPORT_BYTES, scanner=None):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.scanner = scanner
+        self.bytes_read = 0
+        self.lines = 0
+        self.digest = hashlib.sha256()
+        self.complete = False
+
+    def __iter__(self):
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        pending = ''
+
+        while True:
+            chunk = self.stream.read(READ_CHUNK)
+            if self.bytes_read + len(chunk) > self.max_bytes:
+                raise UploadError(f'Upload is larger than {self.max_bytes} bytes', self.max_bytes, self.lines + 1)
+
+            buffered = decoder.getstate()[0]
+            try:
+                text = decoder.decode(chunk, final=not chunk)
+            except UnicodeDecodeError as e:
+                data = buffered + chunk
+                error = UploadError('Invalid UTF-8', self.bytes_read - len(buffered) + e.start,
+                                    self.lines + 1 + data[:e.start].count(b'\n'))
+                # Hand over the whole lines before the bad bytes first
+                lines = (pending + data[:e.start].decode('utf-8')).split('\n')
+                lines.pop()
+                for line in lines:
+                    self.lines += 1
+                    yield line
+                raise error
+            self.bytes_read += len(chunk)
+            self.digest.update(chunk)
+
+            if not chunk:
+                break
+
+            lines = (pending + text).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                self.lines += 1
+                if self.scanner is not None:
+                    self.scanner.feed(line + '\n')
+                yield line
+
+        self.complete = True
+        if pending:
+            self.lines += 1
+            if self.scanner is not None:
+                self.scanner.feed(pending)
+            yield pending
+
+
+def iter_import_json(lines, parser):
+    """Yield the /api/import JSON for a DecodedLines as passages are parsed.
+
+    The body has the usual {"passages", "lanes"} shape. Lanes come last
+    since they are only known at the end. An upload that fails part way
+    still closes the JSON, keeping the passages parsed so far and adding
+    an "error" with the byte offset and line.
+    """
+    error = None
+    separator = b''
+
+    yield b'{"passages": ['
+    try:
+        for passage in parser.iter_passages(lines):
+            yield separator + json.dumps(passage).encode()
+            separator = b', '
+    except UploadError as e:
+        error = e
+
+    tail = b'], "lanes": ' + json.dumps(parser.lanes).encode()
+    if error is not None:
+        tail += b', "error": ' + json.dumps(error.to_dict()).encode()
+    yield tail + b'}'
+
+
+def iter_indexed_import_json(source, index, parser):
+    """Yield the /api/import JSON for source bytes already indexed by scan_story().
+
+    `index` is the cached index entry (see outline.index_source). Its byte
+    ranges cut the bodies straight out of the source, so nothing is split
+    into lines or matched against the header pattern again.
+    """
+    state = json.loads(index)
+    separator = b''
+
+    parser.reset()
+    yield b'{"passages": ['
+    for title, tags, start, end in zip(state['titles'], state['tags'], state['starts'], state['ends']):
+        body = source[start:end].decode('utf-8').replace('\r\n', '\n')
+        yield separator + json.dumps(parser.build_passage((title, tags), [body])).encode()
+        separator = b', '
+    yield b'], "lanes": ' + json.dumps(parser.lanes).encode() + b'}'
+
+
+def hash_stream(stream):
+    """Hex SHA-256 of a seekable stream, rewinding it afterwards"""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(READ_CHUNK), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def detach_upload(stream):
+    """A copy of an uploaded file's stream that stays readable after the request.
+
+    Werkzeug closes request.files as soon as the view returns, before a
+    streamed response body is generated. Uploads spooled to disk are
+    reopened through a duplicate of their descriptor; ones still held in
+    memory (under Werkzeug's 500 KB spool size) are copied. The caller
+    closes the returned stream.
+    """
+    stream.seek(0)
+    if getattr(stream, '_rolled', True):
+        try:
+            detached = os.fdopen(os.dup(stream.fileno()), 'rb')
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            pass
+        else:
+            detached.seek(0)
+            return detached
+    return io.BytesIO(stream.read())
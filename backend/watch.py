@@ -0,0 +1,294 @@
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+from twee import TweeParser
+
+# Seconds between stat() sweeps of the games directory
+POLL_INTERVAL = float(os.environ.get('BRANCHED_WATCH_INTERVAL', 0.5))
+
+# Recent events kept so reconnecting clients can catch up
+EVENT_HISTORY = 1000
+
+# Seconds an event stream's client may take to accept a write before it is dropped
+SEND_TIMEOUT = 5
+
+WATCHED_SUFFIXES = ('.twee', '.tw')
+CONFIG_FILE = 'game_config.json'
+
+
+def read_passages(path):
+    """{title: {'title', 'tags', 'content'}} for a Twee file, or None if titles repeat"""
+    passages = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for (title, tags), lines in TweeParser().iter_sections(f):
+            if title in passages:
+                return None
+            passages[title] = {'title': title, 'tags': tags, 'content': '\n'.join(lines).strip()}
+    return passages
+
+
+def passage_digests(passages):
+    """{title: digest of tags and content} for a read_passages() result"""
+    return {title: hashlib.blake2b(f"{passage['tags']}\0{passage['content']}".encode('utf-8'),
+                                   digest_size=16).digest()
+            for title, passage in passages.items()}
+
+
+def diff_passages(old, new):
+    """Passage-level changes from passage_digests() `old` to read_passages() `new`"""
+    digests = passage_digests(new)
+    return {
+        'added': [passage for title, passage in new.items() if title not in old],
+        'changed': [passage for title, passage in new.items() if title in old and old[title] != digests[title]],
+        'removed': [title for title in old if title not in new]
+    }
+
+
+class GamesWatcher:
+    """Polls the games directory with stat() and publishes passage diffs.
+
+    Each sweep costs one scandir per game folder. A game's story files are
+    first read when a client starts watching that game, and only a digest
+    of each passage is kept. After that, only files whose mtime or size
+    moved are re-read and compared against those digests. Events carry an
+    increasing version number so clients can ask for everything after the
+    last one they saw.
+    """
+
+    def __init__(self, games_dir, interval=POLL_INTERVAL):
+        self.games_dir = games_dir
+        self.interval = interval
+        self.signatures = {}
+        self.digests = {}
+        self.tracked = set()
+        self.lock = threading.Lock()
+        self.events = deque(maxlen=EVENT_HISTORY)
+        self.version = 0
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def ensure_started(self):
+        """Start polling on first use so servers nobody watches pay nothing"""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.signatures = self.scan()
+            self.thread = threading.Thread(target=self.run, name='branched-watch', daemon=True)
+            self.thread.start()
+
+    def track(self, game_id):
+        """Read a game's story files once so later changes to them go out as diffs"""
+        with self.lock:
+            if game_id in self.tracked or not os.path.isdir(os.path.join(self.games_dir, game_id)):
+                return
+            self.tracked.add(game_id)
+            for key in self.signatures:
+                if key[0] == game_id and key[1].endswith(WATCHED_SUFFIXES):
+                    self.read_digests(key)
+
+    def read_digests(self, key):
+        """Re-read one story file; returns its passages, or None when it can't be diffed"""
+        game_id, name = key
+        try:
+            passages = read_passages(os.path.join(self.games_dir, game_id, name))
+        except (OSError, UnicodeDecodeError):
+            passages = None
+        if passages is None:
+            self.digests.pop(key, None)
+        else:
+            self.digests[key] = passage_digests(passages)
+        return passages
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Error watching {self.games_dir}: {e}")
+
+    def scan(self):
+        """(game_id, file name) -> (mtime_ns, size) for every watched file"""
+        signatures = {}
+        try:
+            games = list(os.scandir(self.games_dir))
+        except OSError:
+            return signatures
+
+        for game in games:
+            if not game.is_dir():
+                continue
+            try:
+                entries = list(os.scandir(game.path))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name == CONFIG_FILE or entry.name.endswith(WATCHED_SUFFIXES):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    signatures[(game.name, entry.name)] = (stat.st_mtime_ns, stat.st_size)
+        return signatures
+
+    def poll(self):
+        with self.lock:
+            signatures = self.scan()
+            changed = [key for key, signature in signatures.items() if self.signatures.get(key) != signature]
+            removed = [key for key in self.signatures if key not in signatures]
+            self.signatures = signatures
+
+            events = []
+            for key in changed + removed:
+                game_id, name = key
+                old = self.digests.get(key)
+                if name == CONFIG_FILE or key in removed or game_id not in self.tracked:
+                    # Nobody has watched an untracked game yet, so there is nothing to diff against
+                    self.digests.pop(key, None)
+                    events.append({'type': 'reload', 'game': game_id, 'file': name})
+                    continue
+
+                new = self.read_digests(key)
+                if new is None or old is None:
+                    events.append({'type': 'reload', 'game': game_id, 'file': name})
+                    continue
+
+                diff = diff_passages(old, new)
+                if diff['added'] or diff['changed'] or diff['removed']:
+                    events.append(dict(diff, type='diff', game=game_id, file=name))
+
+        if events:
+            self.publish(events)
+
+    def publish(self, events):
+        with self.condition:
+            for event in events:
+                self.version += 1
+                event['version'] = self.version
+                self.events.append(event)
+            self.condition.notify_all()
+
+    def wait(self, game_id, since, timeout):
+        """Events for a game newer than `since`, waiting up to timeout seconds.
+
+        `since` of None means "from now". Returns (events, version); a client
+        too far behind for the history gets a single reload event.
+        """
+        self.ensure_started()
+        self.track(game_id)
+        deadline = time.monotonic() + timeout
+
+        with self.condition:
+            if since is None or since > self.version:
+                since = self.version
+
+            while True:
+                events = self.events_since(game_id, since)
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    return events, self.version
+                self.condition.wait(remaining)
+
+    def events_since(self, game_id, since):
+        """Events for a game newer than `since`; the caller holds the condition"""
+        if self.events and self.events[0]['version'] > since + 1:
+            return [{'type': 'reload', 'game': game_id, 'version': self.version}]
+        return [event for event in self.events if event['version'] > since and event['game'] == game_id]
+
+
+class EventStream:
+    def __init__(self, game_id, since, connection):
+        self.game_id = game_id
+        self.since = since
+        self.connection = connection
+        self.last_sent = time.monotonic()
+
+
+class EventStreams:
+    """Server-sent event streams of a GamesWatcher, all written by one thread.
+
+    The request handler sends the response head and hands its socket over,
+    so an open editor doesn't hold a request worker. The thread wakes on
+    new events and writes each stream the events for its game. It also
+    sends a keep-alive comment to streams idle for `keepalive` seconds, and
+    drops streams whose client hung up or stopped reading.
+    """
+
+    def __init__(self, watcher, keepalive, send_timeout=SEND_TIMEOUT):
+        self.watcher = watcher
+        self.keepalive = keepalive
+        self.send_timeout = send_timeout
+        self.streams = []
+        self.added = []
+        self.version = 0
+        self.thread = None
+
+    def add(self, game_id, since, connection):
+        """Take over a connection; events after `since` follow, or only new ones if since is None"""
+        self.watcher.ensure_started()
+        self.watcher.track(game_id)
+        connection.settimeout(self.send_timeout)
+
+        with self.watcher.condition:
+            if since is None or since > self.watcher.version:
+                since = self.watcher.version
+            self.added.append(EventStream(game_id, since, connection))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='branched-events', daemon=True)
+                self.thread.start()
+            self.watcher.condition.notify_all()
+
+    def run(self):
+        condition = self.watcher.condition
+        while True:
+            with condition:
+                while not self.added and self.watcher.version == self.version:
+                    if not self.streams:
+                        condition.wait()
+                        continue
+                    remaining = min(stream.last_sent for stream in self.streams) + self.keepalive - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    condition.wait(remaining)
+
+                self.streams.extend(self.added)
+                self.added = []
+                self.version = self.watcher.version
+                pending = [(stream, self.watcher.events_since(stream.game_id, stream.since))
+                           for stream in self.streams]
+
+            now = time.monotonic()
+            for stream, events in pending:
+                stream.since = self.version
+                if events:
+                    chunk = b''.join(format_sse(event) for event in events)
+                elif now - stream.last_sent >= self.keepalive:
+                    chunk = b': keep-alive\n\n'
+                else:
+                    continue
+                try:
+                    stream.connection.sendall(chunk)
+                    stream.last_sent = now
+                except OSError:
+                    self.drop(stream)
+
+    def drop(self, stream):
+        with self.watcher.condition:
+            self.streams.remove(stream)
+        try:
+            stream.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        stream.connection.close()
+
+
+def format_sse(event):
+    return f"id: {event['version']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n".encode('utf-8')
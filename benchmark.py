@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+BranchEd Performance Benchmarks
+Times the parser, exporter and HTTP endpoints on synthetic stories
+"""
+
+import argparse
+import http.client
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).parent
+sys.path.insert(0, str(ROOT / "backend"))
+
+from twee import TweeParser, TweeExporter
+from storygen import generate_story
+from test_runner import Colors, log
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+DEFAULT_BASELINE = ROOT / "benchmark_baseline.json"
+
+# A result this much slower (or bigger) than its baseline fails the run
+DEFAULT_THRESHOLD = 0.25
+
+# Requests per size for the HTTP endpoints
+HTTP_REQUESTS = 20
+
+
+def repeats_for(size):
+    if size <= 10000:
+        return 5
+    if size <= 100000:
+        return 3
+    return 1
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def time_calls(fn, repeats):
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def peak_memory(fn):
+    """Peak bytes allocated by Python while fn runs"""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class BenchmarkSuite:
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self.results = {}
+        self.flask_client = None
+        self.game_server = None
+
+    def record(self, name, size, samples, passages, nbytes, peak=None):
+        p50 = percentile(samples, 50)
+        result = {
+            'p50': p50,
+            'p95': percentile(samples, 95),
+            'p99': percentile(samples, 99),
+            'passagesPerSec': passages / p50 if p50 else 0,
+            'mbPerSec': nbytes / p50 / 1e6 if p50 else 0,
+            'samples': len(samples)
+        }
+        if peak is not None:
+            result['peakBytes'] = peak
+        self.results[f'{name}@{size}'] = result
+
+        memory = f"  peak {peak / 1e6:8.1f} MB" if peak is not None else ''
+        log(f"{name:<16} {size:>8} passages  p50 {p50 * 1000:9.1f} ms  "
+            f"p95 {result['p95'] * 1000:9.1f} ms  {result['passagesPerSec']:>10.0f} passages/s{memory}", "pass")
+
+    def bench_parser(self, size, story):
+        samples = time_calls(lambda: TweeParser().parse(story), repeats_for(size))
+        peak = peak_memory(lambda: TweeParser().parse(story))
+        self.record('parse', size, samples, size, len(story), peak)
+
+        samples = time_calls(lambda: TweeParser().parse_story(story), repeats_for(size))
+        peak = peak_memory(lambda: TweeParser().parse_story(story))
+        self.record('parse compact', size, samples, size, len(story), peak)
+
+    def bench_exporter(self, size, data, nbytes):
+        samples = time_calls(lambda: TweeExporter().export(data), repeats_for(size))
+        peak = peak_memory(lambda: TweeExporter().export(data))
+        self.record('export', size, samples, size, nbytes, peak)
+
+    def start_flask(self):
+        """Flask test client, or None when Flask isn't installed"""
+        try:
+            cwd = os.getcwd()
+            os.chdir(self.workdir)
+            try:
+                import app as flask_app
+            finally:
+                os.chdir(cwd)
+        except ImportError:
+            log("Flask not installed, skipping /api/import and /api/export", "skip")
+            return None
+        return flask_app.app.test_client()
+
+    def bench_flask(self, size, story, data):
+        if self.flask_client is None:
+            return
+
+        payload = story.encode('utf-8')
+        passages = len(data['passages'])
+
+        # The import body streams, so it is read in full for the parse to be timed
+        def import_story():
+            response = self.flask_client.post(
+                '/api/import', data={'file': (io.BytesIO(payload), 'story.twee')},
+                content_type='multipart/form-data')
+            body = json.loads(response.get_data())
+            assert response.status_code == 200, response.status_code
+            assert len(body['passages']) == passages, (len(body['passages']), passages)
+
+        def export_story():
+            response = self.flask_client.post('/api/export', json=data)
+            content = response.get_json()['content']
+            assert response.status_code == 200, response.status_code
+            headers = sum(1 for line in content.splitlines() if line.startswith(':: '))
+            assert headers == passages, (headers, passages)
+
+        self.record('POST /api/import', size, time_calls(import_story, repeats_for(size)), size, len(payload))
+        self.record('POST /api/export', size, time_calls(export_story, repeats_for(size)), size, len(payload))
+
+    def start_game_server(self):
+        import server
+
+        class QuietHandler(server.BranchEdHandler):
+            def log_message(self, format, *args):
+                pass
+
+        server.GAMES_DIR = Path(self.workdir) / "games"
+        httpd = server.ThreadPoolHTTPServer(('127.0.0.1', 0), QuietHandler, workers=4)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        return httpd
+
+    def bench_game_endpoint(self, size, story):
+        game_id = f'bench_{size}'
+        game_dir = Path(self.workdir) / "games" / game_id
+        game_dir.mkdir(parents=True, exist_ok=True)
+        (game_dir / "story.twee").write_text(story, encoding='utf-8')
+        (game_dir / "game_config.json").write_text(json.dumps({
+            'title': game_id,
+            'story_settings': {'main_story_file': 'story.twee'}
+        }))
+
+        # Files newer than the request start aren't cached; age them
+        old = time.time() - 60
+        for path in game_dir.iterdir():
+            os.utime(path, (old, old))
+
+        port = self.game_server.server_address[1]
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+
+        def fetch():
+            connection.request('GET', f'/api/game/{game_id}')
+            response = connection.getresponse()
+            response.read()
+            assert response.status == 200, response.status
+
+        samples = time_calls(fetch, 1)
+        self.record('GET /api/game cold', size, samples, size, len(story))
+        samples = time_calls(fetch, HTTP_REQUESTS)
+        self.record('GET /api/game', size, samples, size, len(story))
+        connection.close()
+
+    def run(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            self.workdir = workdir
+            self.flask_client = self.start_flask()
+            self.game_server = self.start_game_server()
+
+            try:
+                for size in self.sizes:
+                    log(f"Generating {size} passages...", "suite")
+                    story = generate_story(passages=size)
+                    data = TweeParser().parse(story)
+
+                    self.bench_parser(size, story)
+                    self.bench_exporter(size, data, len(story))
+                    self.bench_flask(size, story, data)
+                    self.bench_game_endpoint(size, story)
+            finally:
+                self.game_server.server_close()
+
+        return self.results
+
+
+def compare(results, baseline, threshold):
+    """Return the list of regressions against a saved baseline"""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        for metric in ('p50', 'peakBytes'):
+            if metric in result and base.get(metric):
+                ratio = result[metric] / base[metric]
+                if ratio > 1 + threshold:
+                    regressions.append((key, metric, base[metric], result[metric], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BranchEd performance benchmarks')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help='comma-separated passage counts (default: %(default)s)')
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE),
+                        help='baseline file to compare against (default: %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='write this run as the new baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed slowdown before failing, as a fraction (default: %(default)s)')
+    parser.add_argument('-o', '--output', help='also write this run\'s results as JSON')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+
+    print(f"\n{Colors.BOLD}{Colors.BLUE}{'═' * 50}{Colors.RESET}")
+    print(f"{Colors.BOLD}   BranchEd Performance Benchmarks{Colors.RESET}")
+    print(f"{Colors.BOLD}{Colors.BLUE}{'═' * 50}{Colors.RESET}\n")
+
+    results = BenchmarkSuite(sizes).run()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        log(f"Saved baseline to {baseline_path}", "info")
+        return 0
+
+    if not baseline_path.exists():
+        log(f"No baseline at {baseline_path}; run with --save-baseline to create one", "skip")
+        return 0
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n{Colors.BOLD}{Colors.RED}{'═' * 50}{Colors.RESET}")
+        print(f"{Colors.BOLD}{Colors.RED}   PERFORMANCE REGRESSIONS{Colors.RESET}")
+        print(f"{Colors.BOLD}{Colors.RED}{'═' * 50}{Colors.RESET}")
+        for key, metric, before, after, ratio in regressions:
+            log(f"{key} {metric}: {before:.6g} -> {after:.6g} ({(ratio - 1) * 100:+.0f}%)", "fail")
+        return 1
+
+    log(f"No regressions beyond {args.threshold * 100:.0f}% of {baseline_path}", "pass")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
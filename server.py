@@ -5,32 +5,512 @@ BranchEd Server - Serves the story editor with game data access
 
 import os
 import json
+import gzip
+import selectors
 import signal
+import socket
 import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
 from http.server import HTTPServer, SimpleHTTPRequestHandler
 import urllib.parse
 
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+from bundle import ASSET_PREFIX, IMMUTABLE_CACHE_CONTROL, BundleCache
+from metrics import metrics, profiler, endpoint_label
+from games import find_story_file, game_name, iter_games
+from outline import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, StoryIndexCache, editor_lane
+from parsecache import parse_cache
+from watch import EventStreams, GamesWatcher
+
 # Version number
 VERSION = "1.5.11"
 
+# Directory holding one folder per game
+GAMES_DIR = Path(os.environ.get('BRANCHED_GAMES_DIR', Path(__file__).parent.parent / "games"))
+
+# Number of worker threads handling requests concurrently
+DEFAULT_WORKERS = int(os.environ.get('BRANCHED_WORKERS', 16))
+
+# Seconds an idle keep-alive connection is kept open, and the longest a
+# worker waits on a client that stops sending halfway through a request
+KEEP_ALIVE_TIMEOUT = 15
+
+# Content types worth compressing on the fly
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+GZIP_MIN_SIZE = 512
+
+# Longest a /changes long-poll or an idle event stream waits before answering
+WATCH_TIMEOUT = 25
+
+# Serve index.html with the minified, hashed bundles from backend/bundle.py;
+# BRANCHED_BUNDLE=0 serves the individual files as written
+BUNDLE_ENABLED = os.environ.get('BRANCHED_BUNDLE', '1') != '0'
+
+# Memory budget for cached game listings and payloads
+CACHE_MAX_BYTES = int(os.environ.get('BRANCHED_CACHE_MB', 256)) * 1024 * 1024
+
+
+class GzipCache:
+    """Compressed copies of static files, keyed by path and invalidated by mtime/size"""
+
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path, stat):
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry and entry[0] == key:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        with open(path, 'rb') as f:
+            body = gzip.compress(f.read(), compresslevel=6)
+
+        with self.lock:
+            self.entries[path] = (key, body)
+        return body
+
+
+gzip_cache = GzipCache()
+bundles = BundleCache()
+
+
+def stat_signature(paths):
+    """(mtime, size) of each path, None for paths that don't exist"""
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+class PayloadCache:
+    """LRU cache of serialized JSON responses built from files on disk.
+
+    Each entry remembers the files it was built from along with their
+    mtime and size; a hit only costs a stat() of those files. Entries are
+    evicted least recently used first once the cached bodies exceed
+    max_bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+
+        if entry is not None:
+            paths, signature, body = entry
+            if stat_signature(paths) == signature:
+                with self.lock:
+                    if key in self.entries:
+                        self.entries.move_to_end(key)
+                    self.hits += 1
+                return body
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, paths, body, started):
+        """Cache body against the current state of paths and return it.
+
+        `started` is time.time_ns() from before the files were read. A file
+        modified after that may have changed mid-read, so the body is
+        returned without being cached.
+        """
+        signature = stat_signature(paths)
+        if any(entry is not None and entry[0] >= started for entry in signature):
+            return body
+
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[2])
+
+            if len(body) <= self.max_bytes:
+                self.entries[key] = (paths, signature, body)
+                self.size += len(body)
+
+            while self.size > self.max_bytes:
+                _, (_, _, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+        return body
+
+
+payload_cache = PayloadCache(CACHE_MAX_BYTES)
+
+story_indexes = StoryIndexCache(parse_cache)
+
+watcher = GamesWatcher(GAMES_DIR)
+event_streams = EventStreams(watcher, WATCH_TIMEOUT)
+
+metrics.register_cache('gzip', gzip_cache)
+metrics.register_cache('bundle', bundles)
+metrics.register_cache('payload', payload_cache)
+metrics.register_cache('story_index', story_indexes)
+metrics.register_cache('parse', parse_cache)
+
+
+class IdleConnections:
+    """Connections waiting for their next request, watched by one selector thread.
+
+    New connections and keep-alive connections between requests wait here
+    rather than on a worker. A connection goes back to the pool once it is
+    readable, and is closed after KEEP_ALIVE_TIMEOUT without a request, so
+    idle browser connections never tie up workers.
+    """
+
+    def __init__(self, server, timeout=KEEP_ALIVE_TIMEOUT):
+        self.server = server
+        self.timeout = timeout
+        self.selector = selectors.DefaultSelector()
+        self.added = []
+        self.closed = False
+        self.lock = threading.Lock()
+
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        self.selector.register(self.wake_reader, selectors.EVENT_READ)
+
+        self.thread = threading.Thread(target=self.run, name='branched-idle', daemon=True)
+        self.thread.start()
+
+    def add(self, request, client_address, handler=None):
+        """Wait for the next request on a connection; handler is the parked one, if any"""
+        with self.lock:
+            self.added.append((request, client_address, handler, time.monotonic() + self.timeout))
+        self.wake()
+
+    def wake(self):
+        try:
+            self.wake_writer.send(b'\0')
+        except OSError:
+            # Already full of wake-ups, or closed
+            pass
+
+    def run(self):
+        while True:
+            with self.lock:
+                added, self.added = self.added, []
+                closed = self.closed
+            if closed:
+                break
+            for request, client_address, handler, deadline in added:
+                self.selector.register(request, selectors.EVENT_READ, (client_address, handler, deadline))
+
+            for key, _ in self.selector.select(1.0):
+                if key.fileobj is self.wake_reader:
+                    try:
+                        while self.wake_reader.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                self.selector.unregister(key.fileobj)
+                client_address, handler, _ = key.data
+                self.server.submit(key.fileobj, client_address, handler)
+
+            now = time.monotonic()
+            for key in list(self.selector.get_map().values()):
+                if key.data is not None and key.data[2] <= now:
+                    self.selector.unregister(key.fileobj)
+                    self.server.close_connection(key.fileobj, key.data[1])
+
+        for key in list(self.selector.get_map().values()):
+            if key.data is not None:
+                self.server.close_connection(key.fileobj, key.data[1])
+        self.selector.close()
+        self.wake_reader.close()
+        self.wake_writer.close()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            added, self.added = self.added, []
+        self.wake()
+        for request, _, handler, _ in added:
+            self.server.close_connection(request, handler)
+
+
+class ThreadPoolHTTPServer(HTTPServer):
+    """HTTPServer that hands each request to a fixed-size thread pool.
+
+    A worker only holds a connection while it is handling requests; between
+    requests the connection waits in IdleConnections.
+    """
+
+    def __init__(self, server_address, handler_class, workers=DEFAULT_WORKERS):
+        # Before binding: HTTPServer.__init__ calls server_close() if bind fails
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='branched')
+        self.idle = IdleConnections(self)
+        super().__init__(server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        # Browsers open connections they may not use for a while, so even the
+        # first request is waited for off the pool
+        self.idle.add(request, client_address)
+
+    def submit(self, request, client_address, handler=None):
+        try:
+            self.executor.submit(self.process_request_thread, request, client_address, handler)
+        except RuntimeError:
+            # Shutting down
+            self.close_connection(request, handler)
+
+    def process_request_thread(self, request, client_address, handler=None):
+        try:
+            if handler is None:
+                handler = self.RequestHandlerClass(request, client_address, self)
+            else:
+                handler.resume()
+        except Exception:
+            self.handle_error(request, client_address)
+        else:
+            if handler.parked:
+                self.idle.add(request, client_address, handler)
+                return
+            if handler.detached:
+                return
+        self.shutdown_request(request)
+
+    def close_connection(self, request, handler=None):
+        """Close a connection that is not being handled"""
+        if handler is not None:
+            handler.parked = False
+            try:
+                handler.finish()
+            except OSError:
+                pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.idle.close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
 class BranchEdHandler(SimpleHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive; every response must carry Content-Length
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEP_ALIVE_TIMEOUT
+
     def __init__(self, *args, **kwargs):
+        self.parked = False
+        # Set once the connection has been handed to another thread for good
+        self.detached = False
         # Set the directory to serve from
         super().__init__(*args, directory="static", **kwargs)
 
+    def handle(self):
+        """Handle requests while they keep coming, then park the connection.
+
+        Once a keep-alive client has nothing more buffered or on the socket,
+        the connection is left for the server's IdleConnections instead of
+        blocking this worker until the client's next request.
+        """
+        self.parked = False
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            if not self.has_pending_request():
+                self.parked = True
+                return
+            self.handle_one_request()
+
+    def has_pending_request(self):
+        """Whether more request bytes are already buffered or on the socket, without blocking"""
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def resume(self):
+        """Handle the next requests on a parked connection"""
+        try:
+            self.handle()
+        finally:
+            self.finish()
+
+    def finish(self):
+        # A parked connection keeps its reader, which may hold buffered bytes
+        if not self.parked:
+            super().finish()
+
+    def send_body(self, body, content_type, extra_headers=None):
+        """Send a 200 response with an in-memory body"""
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.bytes_sent += len(body)
+
+    def send_response(self, code, message=None):
+        self.status_code = code
+        super().send_response(code, message)
+
+    def send_json(self, data):
+        self.send_body(json.dumps(data).encode(), 'application/json',
+                       {'Access-Control-Allow-Origin': '*'})
+
+    def is_not_modified(self, etag, mtime):
+        """Check the request's validators against the file's ETag and mtime"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def accepts_gzip(self):
+        accept_encoding = self.headers.get('Accept-Encoding', '')
+        return any(part.split(';')[0].strip() == 'gzip' for part in accept_encoding.split(','))
+
+    def send_static_file(self):
+        """Serve a file from static/ with ETag/Last-Modified validation and gzip"""
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            index = os.path.join(path, 'index.html')
+            if not self.path.split('?', 1)[0].endswith('/') or not os.path.isfile(index):
+                # Let SimpleHTTPRequestHandler redirect or list the directory
+                super().do_GET()
+                return
+            path = index
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+        content_type = self.guess_type(path)
+
+        if self.is_not_modified(etag, stat.st_mtime):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.end_headers()
+            return
+
+        headers = {
+            'ETag': etag,
+            'Last-Modified': last_modified,
+            'Cache-Control': 'no-cache',
+            'Vary': 'Accept-Encoding'
+        }
+
+        compressible = content_type.startswith(COMPRESSIBLE_TYPES) and stat.st_size >= GZIP_MIN_SIZE
+        if compressible and self.accepts_gzip():
+            body = gzip_cache.get(path, stat)
+            headers['Content-Encoding'] = 'gzip'
+        else:
+            with open(path, 'rb') as f:
+                body = f.read()
+
+        self.send_body(body, content_type, headers)
+
+    def send_bundled(self, body, body_gzip, content_type, etag, cache_control):
+        """Send an in-memory asset, or a 304 when the client's copy has this ETag"""
+        if_none_match = self.headers.get('If-None-Match', '')
+        if etag in [tag.strip() for tag in if_none_match.split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', cache_control)
+            self.end_headers()
+            return
+
+        headers = {'ETag': etag, 'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+        if self.accepts_gzip():
+            body = body_gzip
+            headers['Content-Encoding'] = 'gzip'
+        self.send_body(body, content_type, headers)
+
+    def send_bundle_index(self):
+        """index.html pointing at the current bundles; revalidated on every load so new builds show up"""
+        try:
+            bundle = bundles.get()
+        except (OSError, ValueError) as e:
+            print(f"Error building static bundle, serving individual files: {e}")
+            self.send_static_file()
+            return
+        self.send_bundled(bundle.index, bundle.index_gzip, 'text/html; charset=utf-8',
+                          bundle.index_etag, 'no-cache')
+
+    def send_bundle_asset(self, path):
+        """A hashed bundle; its name changes with its content, so it is cached for good"""
+        try:
+            asset = bundles.asset(path)
+        except (OSError, ValueError):
+            asset = None
+        if asset is None:
+            self.send_error(404, "File not found")
+            return
+        body, body_gzip, content_type = asset
+        etag = f'"{path.rsplit(".", 2)[1]}"'
+        self.send_bundled(body, body_gzip, content_type, etag, IMMUTABLE_CACHE_CONTROL)
+
     def do_GET(self):
+        """Dispatch the request, timing it for /api/metrics and the optional profiler"""
+        self.status_code = None
+        self.bytes_sent = 0
+        endpoint = endpoint_label(urllib.parse.urlparse(self.path).path)
+
+        started = time.perf_counter()
+        request_profiler = None
+        try:
+            request_profiler = profiler.start(self.headers)
+            self.route_get()
+        finally:
+            elapsed = time.perf_counter() - started
+            profiler.finish(request_profiler, elapsed, f'GET {endpoint}')
+            metrics.observe_request(endpoint, 'GET', self.status_code or 500, elapsed,
+                                    int(self.headers.get('Content-Length') or 0), self.bytes_sent)
+
+    def route_get(self):
         parsed_path = urllib.parse.urlparse(self.path)
 
         # Handle favicon specially
         if parsed_path.path == '/favicon.ico':
             favicon_path = Path(__file__).parent.parent / "favicon.ico"
             if favicon_path.exists():
-                self.send_response(200)
-                self.send_header('Content-type', 'image/x-icon')
-                self.end_headers()
                 with open(favicon_path, 'rb') as f:
-                    self.wfile.write(f.read())
+                    self.send_body(f.read(), 'image/x-icon')
             else:
                 self.send_error(404, "Favicon not found")
             return
@@ -38,56 +518,211 @@ class BranchEdHandler(SimpleHTTPRequestHandler):
         # Handle API endpoints
         if parsed_path.path == '/api/version':
             # Return server version
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'version': VERSION}).encode())
+            self.send_json({'version': VERSION})
+            return
+
+        if parsed_path.path == '/api/metrics':
+            self.send_body(metrics.render().encode(), 'text/plain; version=0.0.4; charset=utf-8')
             return
 
         if parsed_path.path == '/api/games':
             self.send_games_list()
+        elif parsed_path.path.startswith('/api/game/') and parsed_path.path.endswith('/events'):
+            self.send_game_events(parsed_path.path.split('/')[-2])
+        elif parsed_path.path.startswith('/api/game/') and parsed_path.path.endswith('/changes'):
+            self.send_game_changes(parsed_path.path.split('/')[-2], urllib.parse.parse_qs(parsed_path.query))
+        elif parsed_path.path.startswith('/api/game/') and parsed_path.path.endswith('/outline'):
+            self.send_game_outline(parsed_path.path.split('/')[-2])
+        elif parsed_path.path.startswith('/api/game/') and parsed_path.path.endswith('/passages'):
+            self.send_game_passages(parsed_path.path.split('/')[-2], urllib.parse.parse_qs(parsed_path.query))
+        elif parsed_path.path.startswith('/api/game/') and parsed_path.path.endswith('/passage'):
+            self.send_game_passage(parsed_path.path.split('/')[-2], urllib.parse.parse_qs(parsed_path.query))
         elif parsed_path.path.startswith('/api/game/'):
             self.send_game_data(parsed_path.path)
+        elif BUNDLE_ENABLED and parsed_path.path in ('/', '/index.html'):
+            self.send_bundle_index()
+        elif BUNDLE_ENABLED and parsed_path.path.startswith(ASSET_PREFIX):
+            self.send_bundle_asset(parsed_path.path)
         else:
             # Serve static files
-            super().do_GET()
+            self.send_static_file()
 
     def send_games_list(self):
         """List all games in the ../games/ directory"""
-        games_dir = Path(__file__).parent.parent / "games"
+        body = payload_cache.get('games')
+        if body is None:
+            started = time.time_ns()
+            games, paths = self.build_games_list()
+            body = payload_cache.put('games', paths, json.dumps(games).encode(), started)
+
+        self.send_body(body, 'application/json', {'Access-Control-Allow-Origin': '*'})
+
+    def build_games_list(self):
+        """Read every game config; returns the listing and the paths it depends on"""
+        games_dir = GAMES_DIR
         games = []
+        paths = [games_dir]
 
-        if games_dir.exists():
-            for game_dir in games_dir.iterdir():
-                if game_dir.is_dir():
-                    config_file = game_dir / "game_config.json"
-                    if config_file.exists():
-                        try:
-                            with open(config_file, 'r') as f:
-                                config = json.load(f)
-                                games.append({
-                                    'id': game_dir.name,
-                                    'name': config.get('title', config.get('game_name', game_dir.name)),
-                                    'version': config.get('version', 'Unknown'),
-                                    'path': str(game_dir.relative_to(games_dir.parent))
-                                })
-                        except Exception as e:
-                            print(f"Error reading {config_file}: {e}")
+        for game_dir, config_file, config in iter_games(games_dir):
+            paths.extend([game_dir, config_file])
+            if config is not None:
+                games.append({
+                    'id': game_dir.name,
+                    'name': game_name(game_dir, config),
+                    'version': config.get('version', 'Unknown'),
+                    'path': str(game_dir.relative_to(games_dir.parent))
+                })
 
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps(games).encode())
+        return games, paths
 
     def send_game_data(self, path):
         """Send game configuration and data files"""
         game_id = path.split('/')[-1]
-        games_dir = Path(__file__).parent.parent / "games" / game_id
+        cache_key = f'game:{game_id}'
 
-        if not games_dir.exists():
-            self.send_error(404, "Game not found")
+        body = payload_cache.get(cache_key)
+        if body is None:
+            started = time.time_ns()
+            result = self.build_game_data(game_id)
+            if result is None:
+                self.send_error(404, "Game not found")
+                return
+            game_data, paths = result
+            body = payload_cache.put(cache_key, paths, json.dumps(game_data).encode(), started)
+
+        self.send_body(body, 'application/json', {'Access-Control-Allow-Origin': '*'})
+
+    def send_game_events(self, game_id):
+        """Start a server-sent event stream of passage diffs and hand it to event_streams"""
+        last_event_id = self.headers.get('Last-Event-ID')
+        since = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        # No Content-Length, so the stream ends when the connection does
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        try:
+            self.wfile.write(b'retry: 1000\n\n')
+            self.wfile.flush()
+        except OSError:
             return
+        self.bytes_sent += len(b'retry: 1000\n\n')
+
+        # The stream thread writes from here on, so the worker is free again
+        event_streams.add(game_id, since, self.connection)
+        self.detached = True
+
+    def send_game_changes(self, game_id, query):
+        """Long-poll for passage diffs after ?since=<version>"""
+        since = query.get('since', [''])[0]
+        try:
+            timeout = float(query.get('timeout', [WATCH_TIMEOUT])[0])
+            if not timeout >= 0:
+                # Negative or NaN
+                raise ValueError(timeout)
+        except ValueError:
+            self.send_error(400, "Invalid timeout")
+            return
+        events, version = watcher.wait(game_id, int(since) if since.isdigit() else None, min(timeout, WATCH_TIMEOUT))
+        self.send_json({'version': version, 'events': events})
+
+    def send_game_outline(self, game_id):
+        """Send a game's config plus its lanes, passage titles and links without bodies"""
+        cache_key = f'outline:{game_id}'
+
+        body = payload_cache.get(cache_key)
+        if body is None:
+            started = time.time_ns()
+            result = self.build_game_data(game_id, include_story=False)
+            if result is None:
+                self.send_error(404, "Game not found")
+                return
+            game_data, paths = result
+            del game_data['storyContent']
+
+            story_file = find_story_file(GAMES_DIR / game_id, game_data['config'])
+            if story_file is None:
+                game_data['outline'] = None
+            else:
+                index = story_indexes.get(story_file)
+                game_data['outline'] = dict(index.outline(), file=story_file.name, count=len(index))
+            body = payload_cache.put(cache_key, paths, json.dumps(game_data).encode(), started)
+
+        self.send_body(body, 'application/json', {'Access-Control-Allow-Origin': '*'})
+
+    def game_story_index(self, game_id):
+        """StoryIndex of a game's main story, or None after sending a 404"""
+        config = None
+        config_file = GAMES_DIR / game_id / "game_config.json"
+        if config_file.exists():
+            with open(config_file, 'r') as f:
+                config = json.load(f)
+
+        story_file = find_story_file(GAMES_DIR / game_id, config)
+        if story_file is None:
+            self.send_error(404, "Story file not found")
+            return None
+        return story_indexes.get(story_file)
+
+    def send_game_passages(self, game_id, query):
+        """Send passage bodies by ?lane=<name> or by page (?offset=&limit=)"""
+        index = self.game_story_index(game_id)
+        if index is None:
+            return
+
+        try:
+            if 'lane' in query:
+                indexes = index.lane_indexes(query['lane'][0])
+            else:
+                offset = int(query.get('offset', ['0'])[0])
+                limit = min(int(query.get('limit', [DEFAULT_PAGE_SIZE])[0]), MAX_PAGE_SIZE)
+                indexes = range(max(offset, 0), min(offset + limit, len(index)))
+        except ValueError:
+            self.send_error(400, "Invalid offset or limit")
+            return
+
+        self.send_json({
+            'count': len(index),
+            'passages': [{'index': i, 'title': index.titles[i], 'content': content}
+                         for i, content in index.read(indexes)]
+        })
+
+    def send_game_passage(self, game_id, query):
+        """Send one passage by ?title=<title>, optionally narrowed by &lane=<name>"""
+        if 'title' not in query:
+            self.send_error(400, "Missing title")
+            return
+
+        index = self.game_story_index(game_id)
+        if index is None:
+            return
+
+        position = index.find(query['title'][0], query.get('lane', [None])[0])
+        if position is None:
+            self.send_error(404, "Passage not found")
+            return
+
+        lane, _ = editor_lane(index.tags[position])
+        [(_, content)] = index.read([position])
+        self.send_json({
+            'index': position,
+            'title': index.titles[position],
+            'tags': index.tags[position],
+            'lane': lane,
+            'content': content
+        })
+
+    def build_game_data(self, game_id, include_story=True):
+        """Read a game's config and story; returns the payload and the paths it depends on"""
+        games_dir = GAMES_DIR / game_id
+
+        if not games_dir.exists():
+            return None
 
         game_data = {
             'id': game_id,
@@ -96,21 +731,20 @@ class BranchEdHandler(SimpleHTTPRequestHandler):
             'files': []
         }
 
-        # Read game config
+        # The directory mtime covers files being added, removed or renamed
         config_file = games_dir / "game_config.json"
+        paths = [games_dir, config_file]
+
+        # Read game config
         if config_file.exists():
             with open(config_file, 'r') as f:
                 game_data['config'] = json.load(f)
 
             # Read the story file if specified
-            story_file_path = game_data['config'].get('story_settings', {}).get('main_story_file')
-            if story_file_path:
-                # Handle both absolute and relative paths
-                if story_file_path.startswith('data/'):
-                    story_file_path = story_file_path[5:]  # Remove 'data/' prefix
-
-                story_file = games_dir / story_file_path
-                if story_file.exists() and story_file.suffix == '.twee':
+            story_file = find_story_file(GAMES_DIR / game_id, game_data['config'])
+            if story_file:
+                paths.append(story_file)
+                if include_story:
                     with open(story_file, 'r', encoding='utf-8') as f:
                         game_data['storyContent'] = f.read()
 
@@ -121,15 +755,16 @@ class BranchEdHandler(SimpleHTTPRequestHandler):
         for file_path in games_dir.glob("*.twee"):
             game_data['files'].append(file_path.name)
 
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        self.wfile.write(json.dumps(game_data).encode())
+        return game_data, paths
 
-def run_server(port=8000):
+def run_server(port=8000, workers=DEFAULT_WORKERS):
     server_address = ('', port)
-    httpd = HTTPServer(server_address, BranchEdHandler)
+    try:
+        httpd = ThreadPoolHTTPServer(server_address, BranchEdHandler, workers=workers)
+    except OSError as e:
+        print(f"Error: cannot listen on port {port}: {e}")
+        return 1
+    watcher.games_dir = GAMES_DIR
 
     # Set up signal handler for immediate shutdown
     def signal_handler(signum, frame):
@@ -142,9 +777,16 @@ def run_server(port=8000):
     signal.signal(signal.SIGINT, signal_handler)  # Ctrl+C
     signal.signal(signal.SIGTERM, signal_handler)  # Termination signal
 
-    print(f"BranchEd Server v{VERSION} running on http://localhost:{port}")
+    print(f"BranchEd Server v{VERSION} running on http://localhost:{port} ({workers} workers)")
     print(f"Serving from: {Path(__file__).parent / 'static'}")
-    print(f"Games directory: {Path(__file__).parent.parent / 'games'}")
+    if BUNDLE_ENABLED:
+        try:
+            started = time.perf_counter()
+            bundle = bundles.get()
+            print(f"Static bundle: {', '.join(bundle.assets)} ({time.perf_counter() - started:.2f}s)")
+        except (OSError, ValueError) as e:
+            print(f"Static bundle unavailable, serving individual files: {e}")
+    print(f"Games directory: {GAMES_DIR}")
     print("Press Ctrl+C to stop the server")
 
     try:
@@ -164,5 +806,6 @@ def run_server(port=8000):
 
 if __name__ == "__main__":
     port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
-    exit_code = run_server(port)
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_WORKERS
+    exit_code = run_server(port, workers)
     sys.exit(exit_code if exit_code is not None else 0)
\ No newline at end of file
@@ -82,7 +82,8 @@ const App = {
         PASSAGE_PADDING: 10,
         VERTICAL_SPACING: 15,
         CHOICE_INDENT: 180,
-        TOGGLE_SIZE: 16
+        TOGGLE_SIZE: 16,
+        PASSAGE_PAGE_SIZE: 500 // Passage bodies fetched per request after the outline
     },
 
     async fetchVersion() {
@@ -1765,6 +1766,10 @@ const App = {
             }
 
             Object.assign(passage, updates);
+            if (updates.content !== undefined) {
+                // An edit wins over a body still being fetched
+                delete passage.outlineLinks;
+            }
 
             // Only do expensive operations if content or title changed (might affect links)
             if (updates.content !== undefined || updates.title !== undefined) {
@@ -1778,6 +1783,14 @@ const App = {
         }
     },
 
+    passageLinkTexts(passage) {
+        // Passages loaded from an outline carry their links until the body arrives
+        if (passage.outlineLinks) {
+            return passage.outlineLinks;
+        }
+        return Array.from(passage.content.matchAll(/\[\[([^\]]+)\]\]/g), match => match[1]);
+    },
+
     extractLinks() {
         this.state.links = [];
         this.state.loopPassages = new Map(); // Store special LOOP passages
@@ -1785,11 +1798,7 @@ const App = {
 
         // First pass: collect all normal links
         for (const passage of this.state.passages.values()) {
-            const linkRegex = /\[\[([^\]]+)\]\]/g;
-            let match;
-
-            while ((match = linkRegex.exec(passage.content)) !== null) {
-                const linkText = match[1];
+            for (const linkText of this.passageLinkTexts(passage)) {
                 let targetTitle;
 
                 // Handle both [[passage]] and [[display|passage]] formats
@@ -1912,12 +1921,9 @@ const App = {
     },
 
     autoCreateLinkedPassages(sourcePassage) {
-        const linkRegex = /\[\[([^\]]+)\]\]/g;
-        let match;
         const passagesToCreate = [];
 
-        while ((match = linkRegex.exec(sourcePassage.content)) !== null) {
-            const linkText = match[1];
+        for (const linkText of this.passageLinkTexts(sourcePassage)) {
             let targetTitle;
 
             // Handle both [[passage]] and [[display|passage]] formats
@@ -2830,9 +2836,12 @@ const App = {
 
     async loadProjectFromServer(gameId) {
         try {
-            // Fetch game data from server
-            const response = await fetch(`/api/game/${gameId}`);
-            const gameData = await response.json();
+            // Fetch the outline first so lanes can be drawn before passage bodies arrive;
+            // servers without it send the whole story in one response
+            const outlineResponse = await fetch(`/api/game/${gameId}/outline`);
+            const gameData = outlineResponse.ok
+                ? await outlineResponse.json()
+                : await (await fetch(`/api/game/${gameId}`)).json();
 
             if (!gameData.config) {
                 this.showNotification('No game configuration found', 'error');
@@ -2848,9 +2857,13 @@ const App = {
             }
 
             // Check if story content was loaded
-            if (gameData.storyContent) {
-                // Parse the story content directly
-                this.parseTwee(gameData.storyContent);
+            if (gameData.outline || gameData.storyContent) {
+                if (gameData.outline) {
+                    this.parseOutline(gameData.outline);
+                } else {
+                    // Parse the story content directly
+                    this.parseTwee(gameData.storyContent);
+                }
                 this.render();
                 this.saveToStorage();
 
@@ -2858,6 +2871,13 @@ const App = {
 
                 // Update dropdown to show selected project
                 this.updateProjectDropdownSelection(gameData.config.title || gameData.config.game_name);
+
+                // Follow edits made to the story file outside BranchEd
+                this.watchProject(gameId);
+
+                if (gameData.outline) {
+                    await this.loadPassageBodies(gameId);
+                }
             } else {
                 // Story file not found on server
                 const storyFile = gameData.config.story_settings?.main_story_file;
@@ -2874,6 +2894,98 @@ const App = {
         }
     },
 
+    watchProject(gameId) {
+        if (this.projectEvents) {
+            this.projectEvents.close();
+            this.projectEvents = null;
+        }
+        // Only server.py provides the event stream
+        if (!window.EventSource) return;
+
+        this.projectEvents = new EventSource(`/api/game/${gameId}/events`);
+        this.projectEvents.addEventListener('diff', (event) => {
+            this.applyStoryDiff(JSON.parse(event.data));
+        });
+        this.projectEvents.addEventListener('reload', (event) => {
+            const data = JSON.parse(event.data);
+            if (!data.file || data.file === 'game_config.json' || this.isMainStoryFile(data.file)) {
+                this.loadProjectFromServer(gameId);
+            }
+        });
+        this.projectEvents.onerror = () => {
+            // A 404 (static hosting) closes the stream for good; otherwise the browser retries
+            if (this.projectEvents && this.projectEvents.readyState === EventSource.CLOSED) {
+                this.projectEvents = null;
+            }
+        };
+    },
+
+    isMainStoryFile(fileName) {
+        const storyFile = this.currentProjectConfig?.story_settings?.main_story_file || '';
+        return storyFile.split('/').pop() === fileName;
+    },
+
+    applyStoryDiff(diff) {
+        // Apply passage-level changes to the story file made outside BranchEd
+        if (!this.isMainStoryFile(diff.file)) return;
+
+        const findByTitle = (title) => Array.from(this.state.passages.values()).find(p => p.title === title);
+
+        diff.removed.forEach(title => {
+            const passage = findByTitle(title);
+            if (!passage) return;
+            const lane = this.state.lanes.find(l => l.id === passage.laneId);
+            if (lane) {
+                lane.passages = lane.passages.filter(id => id !== passage.id);
+            }
+            this.state.passages.delete(passage.id);
+            if (Editor.currentPassage === passage) {
+                Editor.close();
+            }
+        });
+
+        const touched = [];
+        diff.changed.forEach(({ title, tags, content }) => {
+            const passage = findByTitle(title);
+            if (!passage) {
+                touched.push(this.addTweePassage(title, tags, content));
+                return;
+            }
+            // Re-create to pick up lane and tag changes the same way an import would
+            const lane = this.state.lanes.find(l => l.id === passage.laneId);
+            if (lane) {
+                lane.passages = lane.passages.filter(id => id !== passage.id);
+            }
+            this.state.passages.delete(passage.id);
+            const updated = this.addTweePassage(title, tags, content);
+            this.state.passages.delete(updated.id);
+            const newLane = this.state.lanes.find(l => l.id === updated.laneId);
+            newLane.passages[newLane.passages.length - 1] = passage.id;
+            Object.assign(passage, { tags: updated.tags, content: updated.content, laneId: updated.laneId });
+            delete passage.outlineLinks;
+            this.state.passages.set(passage.id, passage);
+            touched.push(passage);
+            if (Editor.currentPassage === passage) {
+                Editor.open(passage);
+            }
+        });
+
+        diff.added.forEach(({ title, tags, content }) => {
+            touched.push(this.addTweePassage(title, tags, content));
+        });
+
+        this.extractLinks();
+        touched.forEach(passage => this.autoCreateLinkedPassages(passage));
+        this.createOrphanageIfNeeded();
+        this.sortLanes();
+        this.updateAllLanePositions();
+        this.render();
+        this.saveToStorage();
+
+        const count = diff.added.length + diff.changed.length + diff.removed.length;
+        this.showNotification(`Updated ${count} passage${count !== 1 ? 's' : ''} from ${diff.file}`, 'success');
+    },
+
     promptForProjectFiles(gameId, config, availableFiles) {
         const storyFileName = config.story_settings.main_story_file.split('/').pop();
 
@@ -3334,8 +3446,60 @@ Use Ctrl/Cmd+click to select multiple files`;
         }
     },
 
+    addTweePassage(title, tagString, passageContent) {
+        // Parse tags - look for $lane: prefix for lane assignment
+        const tagArray = tagString.split(/\s+/).filter(t => t);
+        let laneName = 'Main';
+        const passageTags = [];
+
+        // Check for lane assignment and separate from regular tags
+        tagArray.forEach(tag => {
+            if (tag.startsWith('$lane:')) {
+                laneName = tag.substring(6);
+            } else {
+                passageTags.push(tag);
+            }
+        });
+
+        // Determine if it's metadata - check for $metadata tag
+        const isMetadata = passageTags.includes('$metadata');
+
+        let lane = isMetadata ? this.state.lanes.find(l => l.isMetadata) : null;
+
+        if (!isMetadata) {
+            lane = this.state.lanes.find(l => l.name === laneName);
+
+            if (!lane) {
+                lane = {
+                    id: `lane_${this.state.nextLaneId++}`,
+                    name: laneName,
+                    isMetadata: false,
+                    passages: [],
+                    collapsed: false
+                };
+                this.state.lanes.push(lane);
+            }
+        }
+
+        const passage = {
+            id: `passage_${this.state.nextPassageId++}`,
+            title: title,
+            tags: passageTags.join(' '),
+            content: passageContent,
+            laneId: lane.id,
+            x: 0,
+            y: 0,
+            relativeY: 0
+        };
+
+        this.state.passages.set(passage.id, passage);
+        lane.passages.push(passage.id);
+        return passage;
+    },
+
     parseTwee(content) {
         this.state.passages.clear();
+        this.state.pendingBodies = null;
         // Start with just metadata lane, orphanage will be added if needed
         this.state.lanes = [
             { id: 'metadata', name: 'Metadata', isMetadata: true, passages: [], collapsed: false }
@@ -3361,56 +3525,113 @@ Use Ctrl/Cmd+click to select multiple files`;
             // Everything after the first line is content
             const passageContent = lines.slice(1).join('\n').trim();
 
-            // Parse tags - look for $lane: prefix for lane assignment
-            const tagArray = tagString.split(/\s+/).filter(t => t);
-            let laneName = 'Main';
-            const passageTags = [];
+            this.addTweePassage(title, tagString, passageContent);
+        });
 
-            // Check for lane assignment and separate from regular tags
-            tagArray.forEach(tag => {
-                if (tag.startsWith('$lane:')) {
-                    laneName = tag.substring(6);
-                } else {
-                    passageTags.push(tag);
-                }
-            });
+        this.finishTweeImport();
+    },
 
-            // Determine if it's metadata - check for $metadata tag
-            const isMetadata = passageTags.includes('$metadata');
+    parseOutline(outline) {
+        // Same lanes and passages as parseTwee, with bodies left for loadPassageBodies()
+        this.state.passages.clear();
+        this.state.lanes = [
+            { id: 'metadata', name: 'Metadata', isMetadata: true, passages: [], collapsed: false }
+        ];
+        this.state.pendingBodies = new Map();
 
-            let lane = isMetadata ? this.state.lanes[0] : null;
+        outline.passages.forEach(({ index, title, tags, links }) => {
+            const passage = this.addTweePassage(title, tags, '');
+            passage.outlineLinks = links;
+            this.state.pendingBodies.set(index, passage.id);
+        });
 
-            if (!isMetadata) {
-                lane = this.state.lanes.find(l => l.name === laneName);
+        this.finishTweeImport();
+    },
 
-                if (!lane) {
-                    lane = {
-                        id: `lane_${this.state.nextLaneId++}`,
-                        name: laneName,
-                        isMetadata: false,
-                        passages: [],
-                        collapsed: false
-                    };
-                    this.state.lanes.push(lane);
+    async loadPassageBodies(gameId) {
+        const pending = this.state.pendingBodies;
+        pending.gameId = gameId;
+        const total = pending.size;
+        const pageSize = this.CONSTANTS.PASSAGE_PAGE_SIZE;
+        let stale = false;
+
+        try {
+            for (let offset = 0; offset < total; offset += pageSize) {
+                const response = await fetch(`/api/game/${gameId}/passages?offset=${offset}&limit=${pageSize}`);
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
                 }
+                const page = await response.json();
+
+                // Another project (or a reload of this one) replaced the story meanwhile
+                if (this.state.pendingBodies !== pending) return;
+
+                page.passages.forEach(({ index, title, content }) => {
+                    const passage = this.state.passages.get(pending.get(index));
+                    pending.delete(index);
+                    if (!passage || !passage.outlineLinks) return;
+                    if (passage.title !== title) {
+                        // The file changed since the outline was read
+                        stale = true;
+                        return;
+                    }
+                    delete passage.outlineLinks;
+                    passage.content = content;
+                    if (Editor.currentPassage === passage) {
+                        Editor.open(passage);
+                    }
+                });
+                this.render();
             }
+        } catch (error) {
+            console.error('Error loading passages:', error);
+            this.showNotification(`Error loading passages: ${error.message}`, 'error');
+            return;
+        }
 
-            const passage = {
-                id: `passage_${this.state.nextPassageId++}`,
-                title: title,
-                tags: passageTags.join(' '),
-                content: passageContent,
-                laneId: lane.id,
-                x: 0,
-                y: 0,
-                relativeY: 0
-            };
+        if (this.state.pendingBodies !== pending) return;
+        this.state.pendingBodies = null;
 
+        if (stale) {
+            this.loadProjectFromServer(gameId);
+            return;
+        }
+        this.extractLinks();
+        this.render();
+        this.saveToStorage();
+    },
 
-            this.state.passages.set(passage.id, passage);
-            lane.passages.push(passage.id);
-        });
+    async loadPassageBody(passage) {
+        // Fetch one body ahead of the pages, e.g. for a passage opened in the editor
+        const pending = this.state.pendingBodies;
+        if (!pending || !pending.gameId || !passage.outlineLinks || passage.loadingBody) return;
+
+        const lane = this.state.lanes.find(l => l.id === passage.laneId);
+        const laneName = lane && lane.isMetadata ? '$metadata' : (lane ? lane.name : 'Main');
+        const query = `title=${encodeURIComponent(passage.title)}&lane=${encodeURIComponent(laneName)}`;
+
+        passage.loadingBody = true;
+        try {
+            const response = await fetch(`/api/game/${pending.gameId}/passage?${query}`);
+            if (!response.ok) return;
+            const { content } = await response.json();
+            if (this.state.pendingBodies !== pending || !passage.outlineLinks) return;
+
+            delete passage.outlineLinks;
+            passage.content = content;
+            if (Editor.currentPassage === passage) {
+                Editor.open(passage);
+            }
+            this.render();
+        } catch (error) {
+            // The page loader still fills it in
+            console.error('Error loading passage:', error);
+        } finally {
+            delete passage.loadingBody;
+        }
+    },
 
+    finishTweeImport() {
         this.extractLinks();
 
         // Auto-create linked passages for imported content
@@ -3427,6 +3648,10 @@ Use Ctrl/Cmd+click to select multiple files`;
     },
 
     exportTwee() {
+        if (this.state.pendingBodies) {
+            this.showNotification('Passages are still loading, try again in a moment', 'error');
+            return;
+        }
         let twee = '';
 
         for (const passage of this.state.passages.values()) {
@@ -3460,6 +3685,9 @@ Use Ctrl/Cmd+click to select multiple files`;
     },
 
     saveToStorage() {
+        // A story still loading its passage bodies would be saved without them
+        if (this.state.pendingBodies) return;
+
         const data = {
             lanes: this.state.lanes,
             passages: Array.from(this.state.passages.entries()),
@@ -102,6 +102,11 @@ const Editor = {
         tagsInput.value = tagArray.join(' ');
         contentInput.value = passage.content || '';
 
+        // Projects opened from an outline fill bodies in the background
+        if (passage.outlineLinks) {
+            this.app.loadPassageBody(passage);
+        }
+
         // Hide the old parent button since we'll add it to link buttons
         parentBtn.style.display = 'none';
 
@@ -9,9 +9,34 @@ import time
 import sys
 import json
 import subprocess
+import shutil
+import tempfile
+from contextlib import contextmanager
 from pathlib import Path
-from urllib.request import urlopen
-from urllib.error import URLError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError, URLError
+
+# Backend modules are tested in-process
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+# Start -> Hall <-> Cellar -> Out, a broken link from Hall, and an unreachable Attic
+SAMPLE_STORY = """:: Start
+You wake up. <<set $gold to 1>>
+[[Hall]]
+
+:: Hall [Main]
+A door creaks. [[Cellar]] or [[Nowhere]]
+
+:: Cellar [Main]
+Back to the [[Hall]], or [[Out]].
+
+:: Out [Main]
+The end.
+
+:: Attic [Main]
+Dusty and forgotten.
+"""
 
 # Colors for terminal output
 class Colors:
@@ -43,6 +68,8 @@ class BranchEdTester:
         self.skip_count = 0
         self.server_process = None
         self.base_url = "http://localhost:8000"
+        self.flask_app = None
+        self.flask_dir = None
 
     def start_server(self):
         """Check if server is running, start if needed"""
@@ -84,6 +111,66 @@ class BranchEdTester:
         except:
             return False
 
+    def check(self, name, condition):
+        """Count and log one check"""
+        if condition:
+            log(f"✓ {name}", "pass")
+            self.pass_count += 1
+        else:
+            log(f"✗ {name} failed", "fail")
+            self.fail_count += 1
+
+    def flask_client(self):
+        """Test client for backend/app.py, or None when Flask isn't installed"""
+        try:
+            import flask  # noqa: F401
+        except ImportError:
+            log("⊘ Flask not installed", "skip")
+            self.skip_count += 1
+            return None
+
+        if self.flask_app is None:
+            self.flask_dir = tempfile.mkdtemp(prefix='branched-test-')
+            with self.flask_folder():
+                import app
+            self.flask_app = app.app
+        return self.flask_app.test_client()
+
+    @contextmanager
+    def flask_folder(self):
+        """app.py keeps its uploads folder relative to the working directory"""
+        cwd = os.getcwd()
+        os.chdir(self.flask_dir)
+        try:
+            yield
+        finally:
+            os.chdir(cwd)
+
+    def get_during_save(self, client, url, project, edited):
+        """GET url while a save of edited lands inside the endpoint's store.load(); returns a GET made after it"""
+        import threading
+        import app
+
+        client.post('/api/save', json=project)
+        real_load = app.store.load
+        saver = threading.Thread(target=client.post, args=('/api/save',), kwargs={'json': edited})
+
+        def load_then_save(project_id):
+            data = real_load(project_id)
+            del app.store.load
+            saver.start()
+            saver.join(0.5)
+            return data
+
+        app.store.load = load_then_save
+        try:
+            client.get(url)
+        finally:
+            app.store.__dict__.pop('load', None)
+            if saver.ident is not None:
+                saver.join()
+        return client.get(url)
+
     def stop_server(self):
         """Stop the server if we started it"""
         if self.server_process:
@@ -255,6 +342,1345 @@ class BranchEdTester:
                 log(f"✗ {name} missing", "fail")
                 self.fail_count += 1
 
+    def test_twee_parser(self):
+        """Test that the streaming parser matches parse()"""
+        log("Testing Twee Parser...", "suite")
+
+        try:
+            from twee import TweeParser
+            import io
+
+            source = SAMPLE_STORY + ":: Windows\r\nline endings  \r\n\r\n"
+            parsed = TweeParser().parse(source)
+            parser = TweeParser()
+            streamed = list(parser.iter_passages(io.StringIO(source)))
+
+            checks = [
+                ("Passages parsed in file order",
+                 [p['title'] for p in parsed['passages']] == ['Start', 'Hall', 'Cellar', 'Out', 'Attic', 'Windows']),
+                ("Start goes in the metadata lane", parsed['passages'][0]['laneId'] == 'metadata'),
+                ("Tags become lanes", [lane['name'] for lane in parsed['lanes']] == ['Metadata', 'Main']),
+                ("CRLF is stripped", parsed['passages'][5]['content'] == 'line endings'),
+                ("Streaming a file matches parse()", streamed == parsed['passages'] and parser.lanes == parsed['lanes']),
+                ("Bytes stream the same", list(TweeParser().iter_passages(io.BytesIO(source.encode())))
+                 == parsed['passages'])
+            ]
+
+            for check_name, condition in checks:
+                self.check(f"Parser: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Parser test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_story_graph(self):
+        """Test the link graph behind /api/graph"""
+        log("Testing Story Graph...", "suite")
+
+        try:
+            from graph import StoryGraph
+            from twee import TweeParser
+
+            project = TweeParser().parse(SAMPLE_STORY)
+            graph = StoryGraph(project).to_dict()
+            checks = [
+                ("Links resolve by title", [(link['from'], link['to']) for link in graph['links']]
+                 == [('passage_1', 'passage_2'), ('passage_2', 'passage_3'),
+                     ('passage_3', 'passage_2'), ('passage_3', 'passage_4')]),
+                ("Broken links are left out", all(link['to'] != 'Nowhere' for link in graph['links'])),
+                ("Links out of the metadata lane cross lanes",
+                 graph['crossLaneLinks'] == [{'from': 'passage_1', 'to': 'passage_2'}])
+            ]
+
+            client = self.flask_client()
+            if client is not None:
+                with self.flask_folder():
+                    response = client.post('/api/graph', json=project)
+                checks.append(("/api/graph matches StoryGraph", response.get_json() == graph))
+
+            for check_name, condition in checks:
+                self.check(f"Graph: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Graph test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_http_caching(self):
+        """Test conditional requests and gzip for static files"""
+        log("Testing HTTP Caching...", "suite")
+
+        try:
+            import gzip
+
+            response = urlopen(f"{self.base_url}/style.css")
+            body = response.read()
+            etag = response.headers.get('ETag')
+            self.check("Static file has an ETag", bool(etag))
+
+            try:
+                urlopen(Request(f"{self.base_url}/style.css", headers={'If-None-Match': etag}))
+                status = 200
+            except HTTPError as e:
+                status = e.code
+            self.check("Matching If-None-Match returns 304", status == 304)
+
+            response = urlopen(Request(f"{self.base_url}/style.css", headers={'Accept-Encoding': 'gzip'}))
+            self.check("Gzip response decompresses to the file",
+                       response.headers.get('Content-Encoding') == 'gzip'
+                       and gzip.decompress(response.read()) == body)
+
+            # Idle keep-alive connections wait off the pool, so they can't
+            # starve a two-worker server
+            import socket
+            import threading
+            from server import BranchEdHandler, ThreadPoolHTTPServer
+
+            httpd = ThreadPoolHTTPServer(('127.0.0.1', 0), BranchEdHandler, workers=2)
+            threading.Thread(target=httpd.serve_forever, daemon=True).start()
+            port = httpd.server_address[1]
+            idle = [socket.create_connection(('127.0.0.1', port)) for _ in range(4)]
+            try:
+                started = time.perf_counter()
+                status = urlopen(f"http://127.0.0.1:{port}/style.css", timeout=5).status
+                elapsed = time.perf_counter() - started
+            finally:
+                for connection in idle:
+                    connection.close()
+                httpd.shutdown()
+                httpd.server_close()
+            self.check("Idle connections don't hold workers", status == 200 and elapsed < 2)
+        except Exception as e:
+            log(f"✗ HTTP caching test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_payload_cache(self):
+        """Test the stat-validated payload cache behind /api/games"""
+        log("Testing Payload Cache...", "suite")
+
+        try:
+            from server import PayloadCache
+
+            with tempfile.TemporaryDirectory() as folder:
+                path = os.path.join(folder, 'game_config.json')
+                with open(path, 'w') as f:
+                    f.write('{}')
+                started = time.time_ns() - 10**9
+                os.utime(path, ns=(started - 10**9, started - 10**9))
+
+                cache = PayloadCache(max_bytes=8)
+                cache.put('a', [path], b'1234', started)
+                self.check("Cache: Unchanged file hits", cache.get('a') == b'1234')
+
+                os.utime(path, ns=(started - 2 * 10**9, started - 2 * 10**9))
+                self.check("Cache: Touched file misses", cache.get('a') is None)
+
+                os.utime(path, ns=(started - 10**9, started - 10**9))
+                cache.put('b', [path], b'5678', started)
+                cache.put('c', [path], b'9', started)
+                self.check("Cache: Least recently used entry is evicted",
+                           cache.get('a') is None and cache.get('c') == b'9')
+
+                cache.put('d', [path], b'late', os.stat(path).st_mtime_ns)
+                self.check("Cache: File modified mid-read is not cached", cache.get('d') is None)
+
+            first = urlopen(f"{self.base_url}/api/games").read()
+            second = urlopen(f"{self.base_url}/api/games").read()
+            self.check("Cache: Repeated /api/games is identical", first == second)
+        except Exception as e:
+            log(f"✗ Payload cache test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_twee_export(self):
+        """Test streaming export and its round trip through the parser"""
+        log("Testing Twee Export...", "suite")
+
+        try:
+            from io import StringIO
+            from twee import TweeExporter, TweeParser
+
+            project = TweeParser().parse(SAMPLE_STORY)
+            exporter = TweeExporter()
+            exported = ''.join(exporter.iter_export(project))
+            buffer = StringIO()
+            exporter.export_to(project, buffer)
+            reparsed = TweeParser().parse(exported)
+
+            checks = [
+                ("iter_export matches export", exported == exporter.export(project)),
+                ("export_to matches export", buffer.getvalue() == exported),
+                ("Round trip keeps passages",
+                 [(p['title'], p['content']) for p in reparsed['passages']]
+                 == [(p['title'], p['content']) for p in project['passages']])
+            ]
+
+            client = self.flask_client()
+            if client is not None:
+                with self.flask_folder():
+                    response = client.post('/api/export?format=twee', json=project)
+                    body = response.get_data(as_text=True)
+                checks.append(("/api/export streams the same text", body == exported))
+
+            for check_name, condition in checks:
+                self.check(f"Export: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Export test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_project_store(self):
+        """Test journal replay and compaction in ProjectStore"""
+        log("Testing Project Store...", "suite")
+
+        try:
+            import copy
+            from store import ProjectStore
+            from twee import TweeParser
+
+            project = TweeParser().parse(SAMPLE_STORY)
+            edited = copy.deepcopy(project)
+            edited['passages'][1]['content'] = 'The door is open. [[Cellar]]'
+            del edited['passages'][4]
+
+            with tempfile.TemporaryDirectory() as folder:
+                store = ProjectStore(folder, compact_min_bytes=1 << 30)
+                store.save('story', project)
+                delta = store.save('story', edited)
+                store.flush()
+                replayed = ProjectStore(folder, compact_min_bytes=1 << 30).load('story')
+
+                store.compact('story')
+                compacted = ProjectStore(folder, compact_min_bytes=1 << 30).load('story')
+                checks = [
+                    ("Save journals only the changes",
+                     list(delta['put']) == ['passage_2'] and delta['remove'] == ['passage_5']),
+                    ("Journal replays to the saved project", replayed == edited),
+                    ("Compaction keeps the project", compacted == edited),
+                    ("Compaction empties the journal", not os.path.exists(store.journal_path('story'))),
+                    ("Unknown project loads as None", store.load('missing') is None)
+                ]
+                store.close()
+
+                # A crash mid-append leaves a torn line; saves after it must still
+                # replay. Neither store is closed, since closing compacts.
+                crashed = ProjectStore(folder, compact_min_bytes=1 << 30)
+                crashed.save('torn', project)
+                crashed.save('torn', edited)
+                crashed.flush()
+                with open(crashed.journal_path('torn'), 'ab') as f:
+                    f.write(b'{"put": {"passage_1"')
+                reopened = ProjectStore(folder, compact_min_bytes=1 << 30)
+                reopened.save('torn', project)
+                reopened.flush()
+                checks.append(("Saves after a torn journal line replay",
+                               ProjectStore(folder, compact_min_bytes=1 << 30).load('torn') == project))
+
+            client = self.flask_client()
+            if client is not None:
+                saved = dict(edited, id='store-test')
+                with self.flask_folder():
+                    client.post('/api/save', json=saved)
+                    loaded = client.get('/api/load/store-test').get_json()
+                checks.append(("/api/save then /api/load round trips", loaded == saved))
+
+            for check_name, condition in checks:
+                self.check(f"Store: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Store test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_layout_engine(self):
+        """Test server-side layout and its per-lane cache"""
+        log("Testing Layout Engine...", "suite")
+
+        try:
+            import copy
+            from layout import LayoutEngine
+            from twee import TweeParser
+
+            project = TweeParser().parse(SAMPLE_STORY)
+            engine = LayoutEngine()
+            first = engine.layout(project)
+            misses = engine.misses
+
+            edited = copy.deepcopy(project)
+            edited['passages'][4]['content'] = 'Still dusty.'
+            second = engine.layout(edited)
+
+            checks = [
+                ("Every passage is positioned",
+                 set(first['passages']) == {p['id'] for p in project['passages']}),
+                ("Every lane gets an offset", set(first['lanes']) == {lane['id'] for lane in project['lanes']}),
+                ("Text-only edit hits the lane cache", engine.misses == misses and engine.hits >= misses),
+                ("Cached layout is unchanged", second == first)
+            ]
+
+            client = self.flask_client()
+            if client is not None:
+                with self.flask_folder():
+                    response = client.post('/api/layout', json=project)
+                checks.append(("/api/layout matches LayoutEngine", response.get_json() == first))
+
+            for check_name, condition in checks:
+                self.check(f"Layout: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Layout test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_search_index(self):
+        """Test search queries and incremental re-indexing"""
+        log("Testing Search Index...", "suite")
+
+        try:
+            import copy
+            from search import SearchIndex
+            from store import diff_project
+            from twee import TweeParser
+
+            project = TweeParser().parse(SAMPLE_STORY)
+            index = SearchIndex(project)
+
+            def titles(result):
+                return [item['title'] for item in result['results']]
+
+            edited = copy.deepcopy(project)
+            edited['passages'][1]['content'] = 'The door is open. [[Cellar]]'
+            edited['passages'][3]['title'] = 'Outside'
+            del edited['passages'][4]
+            index.apply_delta(diff_project(project, edited), edited['lanes'])
+            fresh = SearchIndex(edited)
+            queries = ['door', 'out*', '"door is open"', 'dusty', 'hall lane:main', '']
+
+            checks = [
+                ("Word query ranks the title match first",
+                 titles(SearchIndex(project).search('hall'))[0] == 'Hall'),
+                ("Prefix query matches", titles(SearchIndex(project).search('cell*')) == ['Cellar', 'Hall']),
+                ("Phrase query needs adjacent words",
+                 titles(SearchIndex(project).search('"door creaks"')) == ['Hall']
+                 and titles(SearchIndex(project).search('"creaks door"')) == []),
+                ("apply_delta matches a fresh index",
+                 all(index.search(q) == fresh.search(q) for q in queries)),
+                ("Pagination", SearchIndex(project).search('', page=2, per_page=2)['total'] == 5
+                 and len(SearchIndex(project).search('', page=3, per_page=2)['results']) == 1)
+            ]
+
+            client = self.flask_client()
+            if client is not None:
+                with self.flask_folder():
+                    client.post('/api/save', json=dict(project, id='search-test'))
+                    before = client.get('/api/search/search-test?q=door').get_json()
+                    client.post('/api/save', json=dict(edited, id='search-test'))
+                    after = client.get('/api/search/search-test?q=door').get_json()
+                    missing = client.get('/api/search/no-such-project?q=door')
+                    raced = self.get_during_save(client, '/api/search/search-race?q=open',
+                                                    dict(project, id='search-race'), dict(edited, id='search-race'))
+                checks.extend([
+                    ("/api/search finds passages", titles(before) == ['Hall']),
+                    ("/api/search follows saves", after == fresh.search('door')),
+                    ("/api/search 404s unknown projects", missing.status_code == 404),
+                    ("A save while the index is built still reaches it", raced.get_json() == fresh.search('open'))
+                ])
+
+            for check_name, condition in checks:
+                self.check(f"Search: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Search test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_bulk_import(self):
+        """Test that bulk import merges files as if they were read back to back"""
+        log("Testing Bulk Import...", "suite")
+
+        try:
+            from io import BytesIO
+            from bulk import bulk_import
+            from twee import TweeParser
+
+            second = ":: Garden [Side]\nRoses. [[Start]]\n\n:: Shed [Main]\nTools.\n"
+            sources = [('a.twee', SAMPLE_STORY.encode()), ('b.twee', second.encode())]
+            merged = bulk_import(sources, workers=1)
+            combined = TweeParser().parse(SAMPLE_STORY + second)
+            failed = bulk_import(sources + [('bad.twee', b'\xff')], workers=1)
+
+            checks = [
+                ("Merged passages match a single parse", merged['passages'] == combined['passages']),
+                ("Lanes are shared by name", merged['lanes'] == combined['lanes']),
+                ("Per-file passage counts",
+                 [report['passages'] for report in merged['files']] == [5, 2]),
+                ("Unreadable file is reported, others still merge",
+                 failed['files'][2]['error'] is not None and len(failed['passages']) == 7)
+            ]
+
+            client = self.flask_client()
+            if client is not None:
+                with self.flask_folder():
+                    response = client.post('/api/import/bulk?workers=1', data={
+                        'files': [(BytesIO(source), name) for name, source in sources]
+                    }, content_type='multipart/form-data')
+                checks.append(("/api/import/bulk merges uploads",
+                               response.get_json()['passages'] == combined['passages']))
+
+            for check_name, condition in checks:
+                self.check(f"Bulk: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Bulk import test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_story_generator(self):
+        """Test the benchmark story generator and regression check"""
+        log("Testing Story Generator...", "suite")
+
+        try:
+            from storygen import generate_story
+            from twee import TweeParser
+            from benchmark import compare
+
+            story = generate_story(passages=50, lanes=3, seed=7)
+            data = TweeParser().parse(story)
+            baseline = {'parse 1000': {'p50': 1.0, 'peakBytes': 100}}
+
+            checks = [
+                ("Same seed, same story", story == generate_story(passages=50, lanes=3, seed=7)),
+                ("Requested passage count", len(data['passages']) == 50),
+                ("Requested lane count", len(data['lanes']) == 4),
+                ("Slowdown past the threshold is a regression",
+                 [r[:2] for r in compare({'parse 1000': {'p50': 1.5, 'peakBytes': 100}}, baseline, 0.25)]
+                 == [('parse 1000', 'p50')]),
+                ("Slowdown within the threshold passes",
+                 compare({'parse 1000': {'p50': 1.2, 'peakBytes': 110}}, baseline, 0.25) == [])
+            ]
+
+            for check_name, condition in checks:
+                self.check(f"Storygen: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Story generator test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_metrics(self):
+        """Test the Prometheus metrics registry and /api/metrics"""
+        log("Testing Metrics...", "suite")
+
+        try:
+            from io import BytesIO
+            from metrics import MetricsRegistry, RequestProfiler, endpoint_label
+
+            registry = MetricsRegistry(prefix='test')
+            registry.observe_request('/api/games', 'GET', 200, 0.003, bytes_out=10)
+            registry.observe_request('/api/games', 'GET', 200, 0.2, bytes_out=5)
+            registry.observe_operation('parse', 0.01, passages=5)
+            text = registry.render()
+
+            checks = [
+                ("Per-item paths collapse", endpoint_label('/api/game/abc') == '/api/game/{id}'
+                 and endpoint_label('/style.css') == 'static'),
+                ("Request counter",
+                 'test_requests_total{endpoint="/api/games",method="GET",status="200"} 2' in text),
+                ("Histogram buckets are cumulative",
+                 'test_request_duration_seconds_bucket{endpoint="/api/games",method="GET",le="0.005"} 1' in text
+                 and 'test_request_duration_seconds_bucket{endpoint="/api/games",method="GET",le="+Inf"} 2' in text),
+                ("Bytes counter", 'test_bytes_total{endpoint="/api/games",direction="out"} 15' in text),
+                ("Operation passages", 'test_operation_passages_total{operation="parse"} 5' in text)
+            ]
+
+            asked = {'X-BranchEd-Profile': '1'}
+            with tempfile.TemporaryDirectory() as folder:
+                gated = RequestProfiler(slow_ms=None, directory=folder, header_enabled=False)
+                profiler = RequestProfiler(slow_ms=None, directory=folder, header_enabled=True)
+                first = profiler.start(asked)
+                second = profiler.start(asked)
+                dump = profiler.finish(first, 0.001, 'GET /api/games')
+                again = profiler.start(asked)
+                profiler.finish(again, 0.001, 'GET /api/games')
+                checks += [
+                    ("Profile header is ignored unless enabled", gated.start(asked) is None),
+                    ("One request is profiled at a time", first is not None and second is None
+                     and profiler.skipped == 1),
+                    ("Profile dump is written", dump is not None and os.path.exists(dump)),
+                    ("Profiling is free again after a request", again is not None)
+                ]
+
+            urlopen(f"{self.base_url}/api/games").read()
+            served = urlopen(f"{self.base_url}/api/metrics").read().decode()
+            checks.append(("Server /api/metrics counts requests",
+                           'branched_requests_total{endpoint="/api/games",method="GET",status="200"}' in served))
+
+            client = self.flask_client()
+            if client is not None:
+                with self.flask_folder():
+                    # The import body streams, so it has to be read for the parse to run
+                    client.post('/api/import', data={'file': (BytesIO(SAMPLE_STORY.encode()), 'story.twee')},
+                                content_type='multipart/form-data').get_data()
+                    response = client.get('/api/metrics')
+                checks.append(("Flask /api/metrics records parses",
+                               'branched_operation_passages_total{operation="parse"}' in response.get_data(as_text=True)))
+
+            for check_name, condition in checks:
+                self.check(f"Metrics: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Metrics test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_story_linter(self):
+        """Test lint findings and incremental updates"""
+        log("Testing Story Linter...", "suite")
+
+        try:
+            import copy
+            from lint import StoryLinter
+            from store import diff_project
+            from storygen import generate_story
+            from twee import TweeParser
+
+            project = TweeParser().parse(SAMPLE_STORY)
+            report = StoryLinter(project).lint()
+
+            def findings(result):
+                return {key: value for key, value in result.items() if key != 'stats'}
+
+            # Renaming the Attic to Nowhere fixes the broken link and makes it reachable
+            edited = copy.deepcopy(project)
+            edited['passages'][4]['title'] = 'Nowhere'
+            edited['passages'][3]['content'] = 'The end, or back to the [[Start]].'
+            linter = StoryLinter(project)
+            linter.apply_delta(diff_project(project, edited), edited['lanes'])
+            fresh = StoryLinter(edited).lint()
+
+            # One delta that renames passages and adds ones linking to the new titles
+            bulk = TweeParser().parse(generate_story(passages=300, lanes=3, seed=5))
+            bulk_edited = copy.deepcopy(bulk)
+            for passage in bulk_edited['passages'][10:40]:
+                passage['title'] += ' Renamed'
+            for passage in bulk_edited['passages'][40:50]:
+                passage['content'] += f" [[{passage['title']} Renamed]]"
+            bulk_linter = StoryLinter(bulk)
+            bulk_linter.apply_delta(diff_project(bulk, bulk_edited), bulk_edited['lanes'])
+
+            checks = [
+                ("Broken links", report['brokenLinks'] == [{'from': 'passage_2', 'target': 'Nowhere'}]),
+                ("Unreachable passages", report['unreachable'] == ['passage_5']),
+                ("Dead ends", report['deadEnds'] == ['passage_4', 'passage_5']),
+                ("Cycles", report['cycles'] == [['passage_2', 'passage_3']]),
+                ("Errors sort first", report['issues'][0]['type'] == 'broken-link'),
+                ("apply_delta matches a fresh linter", findings(linter.lint()) == findings(fresh)),
+                ("Rename resolves the broken link", fresh['brokenLinks'] == [] and fresh['unreachable'] == []),
+                ("Bulk delta matches a fresh linter",
+                 findings(bulk_linter.lint()) == findings(StoryLinter(bulk_edited).lint()))
+            ]
+
+            client = self.flask_client()
+            if client is not None:
+                with self.flask_folder():
+                    posted = client.post('/api/lint', json=project).get_json()
+                    client.post('/api/save', json=dict(project, id='lint-test'))
+                    client.get('/api/lint/lint-test')
+                    client.post('/api/save', json=dict(edited, id='lint-test'))
+                    saved = client.get('/api/lint/lint-test').get_json()
+                    raced = self.get_during_save(client, '/api/lint/lint-race',
+                                                 dict(project, id='lint-race'), dict(edited, id='lint-race'))
+                checks.extend([
+                    ("/api/lint matches StoryLinter", findings(posted) == findings(report)),
+                    ("/api/lint/<id> follows saves", findings(saved) == findings(fresh)),
+                    ("A save while the linter is built still reaches it", findings(raced.get_json()) == findings(fresh))
+                ])
+
+            for check_name, condition in checks:
+                self.check(f"Lint: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Lint test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_preview_runtime(self):
+        """Test conditional rendering and the variable index"""
+        log("Testing Preview Runtime...", "suite")
+
+        try:
+            from preview import PreviewRuntime
+            from twee import TweeParser
+
+            runtime = PreviewRuntime()
+            passage = {'id': 'p', 'content': '<<if $gold > 0>>Rich [[Shop]]<<else>>Poor<<endif>> and **bold**'}
+            rich = runtime.render(passage, {'$gold': 2})
+            poor = runtime.render(passage, {'$gold': 0})
+            misses = runtime.misses
+            runtime.render(passage, {'$gold': 5})
+            cached = runtime.misses == misses
+
+            variables = {'$gold': 0}
+            runtime.render({'id': 'q', 'content': '<<set $gold = 3>>'}, variables, apply_sets=True)
+            project = TweeParser().parse(SAMPLE_STORY)
+
+            checks = [
+                ("<<if>> picks the true section", 'Rich' in rich and 'Poor' not in rich),
+                ("<<else>> when the condition fails", 'Poor' in poor and 'Rich' not in poor),
+                ("Links and bold are formatted",
+                 'data-target="Shop"' in rich and '<strong>bold</strong>' in rich),
+                ("Same text and branch hits the cache", cached),
+                ("apply_sets updates variables", variables == {'$gold': 3}),
+                ("Variable index", runtime.variable_index(project)
+                 == {'$gold': {'initial': 0, 'reads': [], 'writes': ['passage_1']}})
+            ]
+
+            client = self.flask_client()
+            if client is not None:
+                with self.flask_folder():
+                    response = client.post('/api/preview', json=dict(project, passageIds=['passage_2']))
+                checks.append(("/api/preview renders the requested passages",
+                               list(response.get_json()['passages']) == ['passage_2']))
+
+            for check_name, condition in checks:
+                self.check(f"Preview: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Preview test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_coverage(self):
+        """Test path counting and simulated playthroughs"""
+        log("Testing Coverage...", "suite")
+
+        try:
+            from coverage import analyze
+            from twee import TweeParser
+
+            branching = TweeParser().parse(
+                ":: Start\n[[A]] [[B]]\n\n:: A [Main]\n[[End]]\n\n"
+                ":: B [Main]\n<<if $key > 0>>[[End]]<<else>>[[Fail]]<<endif>>\n\n"
+                ":: End [Main]\nYou escape.\n\n:: Fail [Main]\nYou are caught.\n")
+            report = analyze(branching, playthroughs=400, workers=1)
+            with_key = analyze(branching, playthroughs=400, variables={'$key': 1}, workers=1)
+            sample = analyze(TweeParser().parse(SAMPLE_STORY), playthroughs=200, workers=1)
+
+            checks = [
+                ("Routes are counted per ending",
+                 report['paths']['total'] == '3'
+                 and report['paths']['endings'] == {'passage_4': '2', 'passage_5': '1'}),
+                ("Cycles collapse to one route", sample['paths']['total'] == '1'),
+                ("Playthroughs follow the <<if>> that holds",
+                 report['simulation']['visits']['passage_3'] == report['simulation']['endings']['passage_5']),
+                ("Variables change the outcome", with_key['simulation']['endings'] == {'passage_4': 1.0}),
+                ("Same seed, same simulation",
+                 analyze(branching, playthroughs=400, workers=1)['simulation'] == report['simulation'])
+            ]
+
+            client = self.flask_client()
+            if client is not None:
+                with self.flask_folder():
+                    response = client.post('/api/coverage?workers=1', json=dict(branching, playthroughs=400))
+                    no_start = client.post('/api/coverage', json={'passages': [], 'lanes': []})
+                checks.extend([
+                    ("/api/coverage matches analyze",
+                     response.get_json()['simulation'] == report['simulation']),
+                    ("/api/coverage without a start is a 400", no_start.status_code == 400)
+                ])
+
+            for check_name, condition in checks:
+                self.check(f"Coverage: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Coverage test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_story_model(self):
+        """Test the columnar Story model against the dict format"""
+        log("Testing Story Model...", "suite")
+
+        try:
+            from lint import StoryLinter
+            from model import Story
+            from twee import TweeExporter, TweeParser
+
+            project = TweeParser().parse(SAMPLE_STORY)
+            story = TweeParser().parse_story(SAMPLE_STORY)
+            custom = {
+                'lanes': project['lanes'],
+                'passages': [dict(p, id=f"custom_{i}") for i, p in enumerate(project['passages'])]
+            }
+            custom['passages'][0]['x'] = 40
+            custom['passages'][1]['tags'] = ['Main']
+            lint_story = StoryLinter(story).lint()
+            lint_dict = StoryLinter(project).lint()
+
+            checks = [
+                ("parse_story matches parse", story.to_dict() == project),
+                ("from_dict round trips ids and extra fields", Story.from_dict(custom).to_dict() == custom),
+                ("Passages read like dicts",
+                 story['passages'][1]['title'] == 'Hall' and story['passages'][1].get('laneId') == 'lane_1'),
+                ("Export reads the columns directly",
+                 TweeExporter().export(story) == TweeExporter().export(project)),
+                ("Backend modules accept a Story",
+                 lint_story['brokenLinks'] == lint_dict['brokenLinks'] and lint_story['cycles'] == lint_dict['cycles'])
+            ]
+
+            # The CLIs parse into a read-only Story too
+            with tempfile.TemporaryDirectory() as folder:
+                path = os.path.join(folder, 'story.twee')
+                with open(path, 'w') as f:
+                    f.write(SAMPLE_STORY)
+                result = subprocess.run(
+                    [sys.executable, str(Path(__file__).parent / 'backend' / 'preview.py'), path, '-p', 'Hall'],
+                    capture_output=True, text=True, timeout=30)
+            checks.append(("preview.py -p renders the selected passage",
+                           result.returncode == 0 and list(json.loads(result.stdout)) == ['Hall']))
+
+            for check_name, condition in checks:
+                self.check(f"Model: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Story model test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_game_watcher(self):
+        """Test passage diffs from the games directory watcher"""
+        log("Testing Game Watcher...", "suite")
+
+        try:
+            import http.client
+            from watch import GamesWatcher, diff_passages, passage_digests
+
+            old = {'A': {'title': 'A', 'tags': '', 'content': '1'}, 'B': {'title': 'B', 'tags': '', 'content': '2'},
+                   'D': {'title': 'D', 'tags': '', 'content': '4'}}
+            new = {'A': {'title': 'A', 'tags': '', 'content': '1!'}, 'C': {'title': 'C', 'tags': '', 'content': '3'},
+                   'D': {'title': 'D', 'tags': '', 'content': '4'}}
+            checks = [
+                ("diff_passages", diff_passages(passage_digests(old), new) == {
+                    'added': [new['C']], 'changed': [new['A']], 'removed': ['B']})
+            ]
+
+            with tempfile.TemporaryDirectory() as games_dir:
+                os.makedirs(os.path.join(games_dir, 'demo'))
+                story_path = os.path.join(games_dir, 'demo', 'story.twee')
+                with open(story_path, 'w') as f:
+                    f.write(SAMPLE_STORY)
+
+                watcher = GamesWatcher(games_dir, interval=0.05)
+                _, version = watcher.wait('demo', None, 0)
+                with open(story_path, 'a') as f:
+                    f.write(':: Garden [Main]\nRoses.\n')
+                events, latest = watcher.wait('demo', version, 5)
+                watcher.stop()
+
+                checks.extend([
+                    ("Edits publish a diff event",
+                     len(events) == 1 and events[0]['type'] == 'diff'
+                     and [p['title'] for p in events[0]['added']] == ['Garden']),
+                    ("Versions increase", latest > version and events[0]['version'] == latest),
+                    ("Other games see nothing", watcher.wait('other', version, 0)[0] == [])
+                ])
+
+            data = json.loads(urlopen(f"{self.base_url}/api/game/demo/changes?timeout=0").read())
+            checks.append(("/changes answers with the current version",
+                           data['events'] == [] and isinstance(data['version'], int)))
+
+            connection = http.client.HTTPConnection('localhost', 8000, timeout=5)
+            connection.request('GET', '/api/game/demo/events')
+            response = connection.getresponse()
+            checks.append(("/events opens an event stream",
+                           response.getheader('Content-Type') == 'text/event-stream'
+                           and response.read(len(b'retry: 1000\n\n')) == b'retry: 1000\n\n'))
+            connection.close()
+
+            statuses = []
+            for timeout in ('-1', 'nan', 'soon'):
+                try:
+                    urlopen(f"{self.base_url}/api/game/demo/changes?timeout={timeout}")
+                    statuses.append(200)
+                except HTTPError as e:
+                    statuses.append(e.code)
+            checks.append(("/changes refuses bad timeouts", statuses == [400, 400, 400]))
+
+            # Open streams are written by EventStreams, not by a pool worker
+            import threading
+            from server import BranchEdHandler, ThreadPoolHTTPServer
+
+            httpd = ThreadPoolHTTPServer(('127.0.0.1', 0), BranchEdHandler, workers=2)
+            threading.Thread(target=httpd.serve_forever, daemon=True).start()
+            port = httpd.server_address[1]
+            streams = []
+            try:
+                for _ in range(3):
+                    stream = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+                    stream.request('GET', '/api/game/demo/events')
+                    stream.getresponse()
+                    streams.append(stream)
+                status = urlopen(f"http://127.0.0.1:{port}/style.css", timeout=5).status
+            finally:
+                for stream in streams:
+                    stream.close()
+                httpd.shutdown()
+                httpd.server_close()
+            checks.append(("Event streams don't hold workers", len(streams) == 3 and status == 200))
+
+            for check_name, condition in checks:
+                self.check(f"Watch: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Watcher test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_story_outline(self):
+        """Test the byte-offset story index behind /outline and /passages"""
+        log("Testing Story Outline...", "suite")
+
+        try:
+            from outline import StoryIndexCache
+            from twee import TweeParser
+
+            project = TweeParser().parse(SAMPLE_STORY)
+            with tempfile.TemporaryDirectory() as folder:
+                path = os.path.join(folder, 'story.twee')
+                with open(path, 'w', newline='') as f:
+                    f.write((SAMPLE_STORY + ":: Notes [$metadata]\nTodo.\n\n:: Cave [$lane:Caves]\nDark.\n")
+                            .replace('\n', '\r\n'))
+                index = StoryIndexCache().get(path)
+                outline = index.outline()
+                bodies = dict(index.read([4, 1, 2, 9]))
+                caves = index.lane_indexes('Caves')
+
+            checks = [
+                ("Outline titles", [p['title'] for p in outline['passages']]
+                 == [p['title'] for p in project['passages']] + ['Notes', 'Cave']),
+                ("Outline links", outline['passages'][1]['links'] == ['Cellar', 'Nowhere']),
+                ("Outline lanes follow $lane and $metadata tags",
+                 outline['lanes'] == ['Main', 'Caves'] and outline['passages'][5]['lane'] is None),
+                ("Bodies read by offset match the parser",
+                 bodies == {i: project['passages'][i]['content'] for i in (1, 2, 4)}),
+                ("Lane lookup", caves == [6])
+            ]
+
+            games = json.loads(urlopen(f"{self.base_url}/api/games").read())
+            if games:
+                game_id = games[0]['id']
+                outline = json.loads(urlopen(f"{self.base_url}/api/game/{game_id}/outline").read())
+                page = json.loads(urlopen(f"{self.base_url}/api/game/{game_id}/passages?offset=0&limit=2").read())
+                checks.extend([
+                    ("/outline leaves out bodies",
+                     'storyContent' not in outline and outline['outline']['count'] == page['count']),
+                    ("/passages pages bodies", [p['index'] for p in page['passages']] == [0, 1][:page['count']])
+                ])
+
+            for check_name, condition in checks:
+                self.check(f"Outline: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Outline test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_parse_cache(self):
+        """Test the content-hash parse cache and its disk tier"""
+        log("Testing Parse Cache...", "suite")
+
+        try:
+            from io import BytesIO
+            from outline import StoryScanner, index_source, scan_story
+            from parsecache import ParseCache
+            from twee import TweeParser
+            from upload import DecodedLines, iter_indexed_import_json
+
+            builds = []
+
+            def build(source):
+                builds.append(source)
+                return source.upper()
+
+            with tempfile.TemporaryDirectory() as folder:
+                cache = ParseCache(max_bytes=8, directory=folder)
+                first = cache.get('test', b'abc', build)
+                second = cache.get('test', b'abc', build)
+                cache.get('test', b'defghi', build)
+                cache.get('test', b'jkl', build)
+                restarted = ParseCache(max_bytes=8, directory=folder)
+                from_disk = restarted.get('test', b'abc', build)
+
+            checks = [
+                ("Same bytes hit the cache", first == second == b'ABC' and builds.count(b'abc') == 1),
+                ("Memory tier stays under budget", cache.size <= 8 and cache.key('test', b'abc') not in cache.entries),
+                ("Disk tier outlives a restart", from_disk == b'ABC' and builds.count(b'abc') == 1),
+                ("Hits and misses are counted", (cache.hits, cache.misses) == (1, 3) and restarted.hits == 1)
+            ]
+
+            # A hit rebuilds the import from the scan_story() index instead of parsing
+            source = SAMPLE_STORY + ":: Notes [$metadata]\nTodo.\n\n:: Caf\u00e9 [$lane:Caves]\nD\u00e9j\u00e0.\n"
+            source = source.replace('\n', '\r\n').encode()
+            indexed = json.loads(b''.join(iter_indexed_import_json(source, index_source(source), TweeParser())))
+            checks.append(("Indexed import matches a full parse", indexed == TweeParser().parse(source.decode())))
+
+            # Uploads are indexed line by line as they are parsed, without keeping their bytes
+            uploaded = source * 40 + b':: Last\r\n[[Start]] without a newline'
+            scanner = StoryScanner()
+            list(DecodedLines(BytesIO(uploaded), scanner=scanner))
+            checks.append(("Scanning uploaded lines matches scan_story", scanner.finish() == scan_story(uploaded)))
+
+            client = self.flask_client()
+            if client is not None:
+                def upload():
+                    return client.post('/api/import', data={'file': (BytesIO(SAMPLE_STORY.encode()), 'story.twee')},
+                                       content_type='multipart/form-data').get_json()
+
+                from parsecache import parse_cache
+                with self.flask_folder():
+                    cold = upload()
+                    hits = parse_cache.hits
+                    warm = upload()
+                checks.append(("Repeated /api/import is served from the cache",
+                               warm == cold and parse_cache.hits == hits + 1
+                               and len(warm['passages']) == 5))
+
+            for check_name, condition in checks:
+                self.check(f"Parse cache: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Parse cache test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_streaming_upload(self):
+        """Test incremental decoding of uploads and the streamed /api/import body"""
+        log("Testing Streaming Upload...", "suite")
+
+        try:
+            import hashlib
+            from io import BytesIO
+            from twee import TweeParser
+            from upload import DecodedLines, UploadError, iter_import_json
+
+            # Multi-byte characters straddle the read chunk boundaries
+            source = (SAMPLE_STORY + ''.join(f":: Café {i} [Ünïcode]\n{'é' * 30000}\n\n" for i in range(4))).encode()
+            lines = DecodedLines(BytesIO(source))
+            decoded = '\n'.join(lines)
+
+            bad = DecodedLines(BytesIO(b':: Start\nok\nbad \xff here\n'))
+            bad_lines = []
+            try:
+                bad_lines.extend(bad)
+                error = None
+            except UploadError as e:
+                error = e
+
+            try:
+                list(DecodedLines(BytesIO(source), max_bytes=100))
+                too_large = False
+            except UploadError:
+                too_large = True
+
+            partial = json.loads(b''.join(iter_import_json(
+                DecodedLines(BytesIO(b':: Start\nok\n\n:: Next\nbad \xff\n')), TweeParser())))
+
+            checks = [
+                ("Decoded lines match the source", decoded + '\n' == source.decode()),
+                ("Digest and size of the bytes read",
+                 lines.digest.digest() == hashlib.sha256(source).digest()
+                 and lines.bytes_read == len(source) and lines.complete),
+                ("Invalid UTF-8 reports byte offset and line",
+                 error is not None and (error.offset, error.line) == (16, 3) and bad_lines == [':: Start', 'ok']),
+                ("Uploads over the limit are refused", too_large),
+                ("A failed upload still closes the JSON",
+                 [p['title'] for p in partial['passages']] == ['Start']
+                 and partial['error'] == {'message': 'Invalid UTF-8', 'offset': 25, 'line': 5})
+            ]
+
+            client = self.flask_client()
+            if client is not None:
+                # Fresh content so the parse cache is cold; the larger upload spools to disk
+                small = source + b':: Small cold upload\n'
+                large = source * 4 + b':: Large cold upload\n'
+                with self.flask_folder():
+                    response = client.post('/api/import', data=source, content_type='text/plain')
+                    uploads = [
+                        client.post('/api/import', data={'file': (BytesIO(upload), 'story.twee')},
+                                    content_type='multipart/form-data').get_json()
+                        for upload in (small, large)
+                    ]
+                checks.extend([
+                    ("Raw body import streams the parse",
+                     response.get_json() == TweeParser().parse(source.decode())),
+                    ("Cold multipart import returns every passage",
+                     [len(data['passages']) for data in uploads]
+                     == [len(TweeParser().parse(upload.decode())['passages']) for upload in (small, large)]
+                     and 'error' not in uploads[0] and 'error' not in uploads[1])
+                ])
+
+            for check_name, condition in checks:
+                self.check(f"Upload: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Upload test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_story_merge(self):
+        """Test three-way passage merges and story diffs"""
+        log("Testing Story Merge...", "suite")
+
+        try:
+            from merge import diff_stories, format_story, merge_stories, read_story
+
+            base = ":: A\none\ntwo\nthree\n\n:: B\nsame\n\n:: C\ngone soon\n"
+            ours = ":: A\nONE\ntwo\nthree\n\n:: B\nours\n"
+            theirs = ":: A\none\ntwo\nTHREE\n\n:: B\ntheirs\n\n:: C\ngone soon\n\n:: D [$lane:Side]\nnew\n"
+            result = merge_stories(read_story(base), read_story(ours), read_story(theirs))
+            merged = {p.title: p for p in result['passages']}
+
+            clean = merge_stories(read_story(base), read_story(ours.replace('ours', 'same')), read_story(theirs))
+            diff = diff_stories(read_story(base), read_story(ours))
+
+            checks = [
+                ("Edits to different lines merge", merged['A'].content == 'ONE\ntwo\nTHREE'),
+                ("Passages added by theirs are kept", merged['D'].tags == '$lane:Side'),
+                ("Passages deleted by ours stay deleted", 'C' not in merged),
+                ("Conflicting edits are reported",
+                 [(c['title'], c['type'], c['change']) for c in result['conflicts']]
+                 == [('B', 'content', 'modify/modify')] and '<<<<<<<' in merged['B'].content),
+                ("Clean merge has no conflicts", clean['conflicts'] == []
+                 and format_story(clean['passages']).startswith(':: A\nONE\ntwo\nTHREE\n\n:: B\ntheirs\n')),
+                ("Diff reports passage changes",
+                 diff['stats'] == {'added': 0, 'removed': 1, 'changed': 2, 'unchanged': 0}
+                 and '+ONE' in diff['changed'][0]['diff'])
+            ]
+
+            client = self.flask_client()
+            if client is not None:
+                with self.flask_folder():
+                    response = client.post('/api/merge', json={'base': base, 'ours': ours, 'theirs': theirs})
+                    diffed = client.post('/api/diff', json={'old': base, 'new': ours})
+                    invalid = client.post('/api/merge', json={'base': base, 'ours': ours})
+                checks.extend([
+                    ("/api/merge", response.get_json()['twee'] == format_story(result['passages'])
+                     and response.get_json()['conflicts'] == result['conflicts']),
+                    ("/api/diff", diffed.get_json()['stats'] == diff['stats']),
+                    ("/api/merge needs all three stories", invalid.status_code == 400)
+                ])
+
+            for check_name, condition in checks:
+                self.check(f"Merge: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Merge test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_batch_analysis(self):
+        """Test analyze_games and its mtime/size result cache"""
+        log("Testing Batch Analysis...", "suite")
+
+        try:
+            from analyze import analyze_games
+
+            with tempfile.TemporaryDirectory() as folder:
+                games_dir = Path(folder) / 'games'
+                for game_id, story in (('alpha', SAMPLE_STORY), ('beta', None)):
+                    (games_dir / game_id).mkdir(parents=True)
+                    config = {'title': game_id.title(), 'story_settings': {'main_story_file': 'data/story.twee'}}
+                    (games_dir / game_id / 'game_config.json').write_text(json.dumps(config))
+                    if story is not None:
+                        (games_dir / game_id / 'story.twee').write_text(story)
+                cache_path = os.path.join(folder, 'cache.json')
+
+                first = analyze_games(games_dir, cache_path, workers=1)
+                second = analyze_games(games_dir, cache_path, workers=1)
+                with open(games_dir / 'alpha' / 'story.twee', 'a') as f:
+                    f.write(':: Garden [Main]\nRoses. [[Start]]\n')
+                third = analyze_games(games_dir, cache_path, workers=1)
+
+                # Subcommands skip the banner, so the JSON report can be piped
+                script = Path(__file__).parent / 'branched'
+                piped = subprocess.run([str(script), 'analyze', str(games_dir), '--json', '--no-cache'],
+                                       capture_output=True, text=True, timeout=60)
+
+            alpha = first['games'][0]
+            checks = [
+                ("Games are parsed and linted",
+                 (alpha['id'], alpha['passages'], alpha['links']) == ('alpha', 5, 4)
+                 and alpha['brokenLinks'] == [{'title': 'Hall', 'target': 'Nowhere'}]),
+                ("Missing story files are errors",
+                 first['games'][1]['error'] == 'story file not found' and first['totals']['errors'] == 1),
+                ("Unchanged stories come from the cache",
+                 (second['totals']['analyzed'], second['totals']['cached']) == (0, 1)
+                 and second['games'][0]['passages'] == 5),
+                ("Edited stories are re-analyzed with a trend",
+                 third['totals']['analyzed'] == 1 and third['games'][0]['passagesTrend']['previous'] == 1),
+                ("./branched analyze --json prints only JSON",
+                 json.loads(piped.stdout)['totals']['errors'] == 1)
+            ]
+
+            for check_name, condition in checks:
+                self.check(f"Analyze: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Analyze test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_project_history(self):
+        """Test content-addressed version history, retention and gc"""
+        log("Testing Project History...", "suite")
+
+        try:
+            import copy
+            from history import ProjectHistory
+            from store import diff_project
+            from twee import TweeParser
+
+            project = TweeParser().parse(SAMPLE_STORY)
+            edited = copy.deepcopy(project)
+            edited['passages'][1]['content'] = 'The door is open. [[Cellar]]'
+
+            with tempfile.TemporaryDirectory() as folder:
+                history = ProjectHistory(folder, keep_versions=1)
+                first = history.record('story', project)
+                blobs = len(history.offsets)
+                second = history.record('story', edited, diff_project(project, edited))
+                unchanged = history.record('story', edited, {})
+                checks = [
+                    ("Versions are numbered", (first, second, unchanged) == (1, 2, None)),
+                    ("Only changed passages add blobs", len(history.offsets) == blobs + 1),
+                    ("Each version loads as saved",
+                     history.load('story', 1) == project and history.load('story', 2) == edited),
+                    ("History lists versions newest first",
+                     [v['version'] for v in history.history('story')] == [2, 1]
+                     and history.history('story')[0]['changes'] == 1)
+                ]
+
+                history.keep_days = 0
+                collected = history.gc()
+                history.pack.write(b'torn')
+                history.pack.flush()
+                reopened = ProjectHistory(folder)
+                checks.extend([
+                    ("gc drops expired versions and their blobs",
+                     collected['removed'] == 1 and history.versions('story') == [2]),
+                    ("Torn pack tail is dropped on open", reopened.load('story', 2) == edited)
+                ])
+
+            # Loads run on request threads while gc() swaps the pack
+            import threading
+
+            with tempfile.TemporaryDirectory() as folder:
+                history = ProjectHistory(folder, keep_versions=1, keep_days=0)
+                history.record('race', project)
+                errors = []
+                done = threading.Event()
+
+                def load_latest():
+                    while not done.is_set():
+                        try:
+                            version = history.versions('race')[-1]
+                            loaded = history.load('race', version)
+                            if loaded is not None and len(loaded['passages']) != len(project['passages']):
+                                errors.append(version)
+                        except Exception as e:
+                            errors.append(e)
+
+                readers = [threading.Thread(target=load_latest) for _ in range(4)]
+                for reader in readers:
+                    reader.start()
+                racing = copy.deepcopy(project)
+                for i in range(40):
+                    racing['passages'][0]['content'] = f'Version {i}'
+                    history.record('race', racing)
+                    history.gc()
+                done.set()
+                for reader in readers:
+                    reader.join()
+                checks.append(("Loads during gc see whole versions", errors == []))
+
+            client = self.flask_client()
+            if client is not None:
+                with self.flask_folder():
+                    saved = [client.post('/api/save', json=dict(data, id='history-test')).get_json()['version']
+                             for data in (project, edited)]
+                    listed = client.get('/api/history/history-test').get_json()
+                    old = client.get(f'/api/load/history-test?version={saved[0]}').get_json()
+                    gc = client.post('/api/history/gc')
+
+                    # The command line goes through the backend that owns the pack
+                    import threading
+                    from werkzeug.serving import make_server
+
+                    backend = make_server('127.0.0.1', 0, self.flask_app, threaded=True)
+                    threading.Thread(target=backend.serve_forever, daemon=True).start()
+                    script = str(Path(__file__).parent / 'backend' / 'history.py')
+                    url = f'http://127.0.0.1:{backend.port}'
+                    try:
+                        logged = subprocess.run(
+                            [sys.executable, script, 'log', 'history-test', '--server', url],
+                            capture_output=True, text=True, timeout=30)
+                    finally:
+                        backend.shutdown()
+                    unreachable = subprocess.run(
+                        [sys.executable, script, 'gc', '--server', url],
+                        capture_output=True, text=True, timeout=30)
+                checks.extend([
+                    ("/api/save returns the version", saved[1] == saved[0] + 1),
+                    ("/api/history lists saves", listed['versions'][0]['version'] == saved[1]),
+                    ("/api/load?version= loads an old version", old == dict(project, id='history-test')),
+                    ("/api/history/gc", gc.status_code == 200),
+                    ("history.py log asks the backend",
+                     logged.returncode == 0 and len(logged.stdout.splitlines()) == len(listed['versions'])),
+                    ("history.py reports an unreachable backend",
+                     unreachable.returncode == 1 and 'cannot reach' in unreachable.stderr)
+                ])
+
+            for check_name, condition in checks:
+                self.check(f"History: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ History test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_story_sidecar(self):
+        """Test the persisted story index and single passage lookups"""
+        log("Testing Story Sidecar...", "suite")
+
+        try:
+            from outline import StoryIndexCache, read_sidecar, sidecar_path
+
+            with tempfile.TemporaryDirectory() as folder:
+                path = os.path.join(folder, 'story.twee')
+                with open(path, 'w') as f:
+                    f.write(SAMPLE_STORY + ":: Hall [$lane:Upstairs]\nA second hall.\n")
+                index = StoryIndexCache().get(path)
+                saved = read_sidecar(path, index.signature)
+                restarted = StoryIndexCache().get(path)
+
+                with open(path, 'a') as f:
+                    f.write(':: Garden\nRoses.\n')
+                stat = os.stat(path)
+                stale = read_sidecar(path, (stat.st_mtime_ns, stat.st_size))
+
+                checks = [
+                    ("Index is saved beside the story",
+                     os.path.basename(sidecar_path(path)) == '.story.twee.idx' and saved is not None
+                     and saved['titles'] == index.titles),
+                    ("Restart reuses the sidecar", restarted.titles == index.titles and restarted.ends == index.ends),
+                    ("Edited story ignores the old sidecar", stale is None),
+                    ("Passages are found by title and lane",
+                     (index.find('Hall'), index.find('Hall', 'Upstairs'), index.find('Start', 'Main'))
+                     == (1, 5, 0) and index.find('Nowhere') is None),
+                    ("A single passage reads from its byte range",
+                     index.read([index.find('Hall', 'Upstairs')]) == [(5, 'A second hall.')])
+                ]
+
+            games = json.loads(urlopen(f"{self.base_url}/api/games").read())
+            if games:
+                game_id = games[0]['id']
+                outline = json.loads(urlopen(f"{self.base_url}/api/game/{game_id}/outline").read())['outline']
+                if outline and outline['passages']:
+                    title = outline['passages'][-1]['title']
+                    passage = json.loads(urlopen(
+                        f"{self.base_url}/api/game/{game_id}/passage?title={quote(title)}").read())
+                    checks.append(("/passage returns one passage",
+                                   passage['title'] == title and passage['index'] == len(outline['passages']) - 1))
+                try:
+                    urlopen(f"{self.base_url}/api/game/{game_id}/passage?title=No%20such%20passage")
+                    status = 200
+                except HTTPError as e:
+                    status = e.code
+                checks.append(("/passage 404s unknown titles", status == 404))
+
+            for check_name, condition in checks:
+                self.check(f"Sidecar: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Sidecar test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_collaboration(self):
+        """Test splices, journaled deltas and a simulated editing session"""
+        log("Testing Collaboration...", "suite")
+
+        try:
+            import argparse
+            import asyncio
+            from collab import CollabServer, OpError, apply_splices, coalesce_splices, simulate
+            from store import ProjectStore
+
+            try:
+                apply_splices('abc', [[2, 5, '']])
+                out_of_range = False
+            except OpError:
+                out_of_range = True
+
+            with tempfile.TemporaryDirectory() as folder:
+                store = ProjectStore(folder, compact_min_bytes=1 << 30)
+                store.save('story', {'passages': [{'id': 'p1', 'title': 'A', 'content': 'x'}]})
+                store.append('story', {'put': {'p2': {'id': 'p2', 'title': 'B', 'content': 'y'}}})
+                store.flush()
+                replayed = ProjectStore(folder, compact_min_bytes=1 << 30).load('story')
+                store.close()
+
+                # A whole-project save commits pending operations first, then drops the session
+                store = ProjectStore(folder, compact_min_bytes=1 << 30)
+                order = []
+
+                async def edit_then_save():
+                    server = CollabServer(store, commit=lambda project_id, delta: order.append('commit'))
+                    server.apply_ops('story', {'client': 'c1', 'ops': [
+                        {'op': 'edit', 'id': 'p1', 'base': 0, 'splices': [[1, 0, 'z']]}]})
+                    await server.replace('story', lambda: order.append('write'))
+                    return server
+
+                server = asyncio.run(edit_then_save())
+                store.close()
+
+            report = asyncio.run(simulate(argparse.Namespace(
+                clients=4, seconds=1.5, rate=30, passages=50, project='collab-test',
+                batch_ms=20, connect=None, seed=7, json=False)))
+
+            checks = [
+                ("Splices count UTF-16 code units", apply_splices('a😀b', [[3, 1, 'c']]) == 'a😀c'),
+                ("Out of range splices are refused", out_of_range),
+                ("Typing coalesces into one splice",
+                 coalesce_splices([[0, 0, 'ab']], [[2, 0, 'cd'], [3, 1, '']]) == [[0, 0, 'abc']]),
+                ("Appended deltas replay from the journal",
+                 [p['id'] for p in replayed['passages']] == ['p1', 'p2']),
+                ("Saves commit pending operations first",
+                 order == ['commit', 'write'] and 'story' not in server.sessions
+                 and server.closed_versions['story'] > 0),
+                ("Simulated clients converge",
+                 report['diverged'] == [] and report['accepted'] > 0 and report['errors'] == 0)
+            ]
+
+            for check_name, condition in checks:
+                self.check(f"Collab: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Collaboration test failed: {e}", "fail")
+            self.fail_count += 1
+
+    def test_asset_bundles(self):
+        """Test the minifiers and the hashed bundles served in place of the static files"""
+        log("Testing Asset Bundles...", "suite")
+
+        try:
+            import gzip
+            import re
+            from bundle import minify_css, minify_js
+
+            script = "// note\nconst url = 'http://x/*y*/';\n  let re = /\\/\\//g;   \n\n/* block */\nlet t = `a ${ {b: 1}.b } // c`;\n"
+            minified_js = minify_js(script)
+
+            response = urlopen(f"{self.base_url}/")
+            index = response.read().decode()
+            index_etag = response.headers.get('ETag')
+            try:
+                urlopen(Request(f"{self.base_url}/", headers={'If-None-Match': index_etag}))
+                index_status = 200
+            except HTTPError as e:
+                index_status = e.code
+
+            asset = re.search(r'/assets/branched\.[0-9a-f]+\.js', index)
+            asset_response = urlopen(Request(f"{self.base_url}{asset.group(0)}",
+                                             headers={'Accept-Encoding': 'gzip'}))
+            asset_body = gzip.decompress(asset_response.read()).decode()
+            try:
+                urlopen(f"{self.base_url}/assets/branched.0000000000000000.js")
+                missing_status = 200
+            except HTTPError as e:
+                missing_status = e.code
+
+            checks = [
+                ("Minified JS drops comments and blank lines",
+                 'note' not in minified_js and 'block' not in minified_js and '\n\n' not in minified_js),
+                ("Minified JS keeps strings, regexes and templates",
+                 "'http://x/*y*/'" in minified_js and '/\\/\\//g' in minified_js
+                 and '`a ${ {b: 1}.b } // c`' in minified_js),
+                ("Minified CSS collapses whitespace",
+                 minify_css("a  b {\n  color: red; /* x */\n}\n") == "a b{color: red;}\n"),
+                ("Index revalidates with its ETag",
+                 response.headers.get('Cache-Control') == 'no-cache' and index_status == 304),
+                ("Index points at a hashed bundle", asset is not None),
+                ("Bundles are cached as immutable",
+                 'immutable' in asset_response.headers.get('Cache-Control', '')
+                 and asset_response.headers.get('Content-Encoding') == 'gzip' and len(asset_body) > 0),
+                ("Unknown bundles return 404", missing_status == 404)
+            ]
+
+            for check_name, condition in checks:
+                self.check(f"Bundle: {check_name}", condition)
+        except Exception as e:
+            log(f"✗ Asset bundle test failed: {e}", "fail")
+            self.fail_count += 1
+
     def run_all_tests(self):
         """Run all tests"""
         print(f"\n{Colors.BOLD}{Colors.BLUE}{'═' * 50}{Colors.RESET}")
@@ -273,6 +1699,31 @@ class BranchEdTester:
         self.test_javascript_syntax()
         self.test_css_valid()
         self.test_twee_files()
+        self.test_twee_parser()
+        self.test_story_graph()
+        self.test_http_caching()
+        self.test_payload_cache()
+        self.test_twee_export()
+        self.test_project_store()
+        self.test_layout_engine()
+        self.test_search_index()
+        self.test_bulk_import()
+        self.test_story_generator()
+        self.test_metrics()
+        self.test_story_linter()
+        self.test_preview_runtime()
+        self.test_coverage()
+        self.test_story_model()
+        self.test_game_watcher()
+        self.test_story_outline()
+        self.test_parse_cache()
+        self.test_streaming_upload()
+        self.test_story_merge()
+        self.test_batch_analysis()
+        self.test_project_history()
+        self.test_story_sidecar()
+        self.test_collaboration()
+        self.test_asset_bundles()
 
         # Show results
         print(f"\n{Colors.BOLD}{Colors.BLUE}{'═' * 50}{Colors.RESET}")
@@ -289,6 +1740,8 @@ class BranchEdTester:
 
         # Stop server if we started it
         self.stop_server()
+        if self.flask_dir:
+            shutil.rmtree(self.flask_dir, ignore_errors=True)
 
         return self.fail_count == 0
 